@@ -7,8 +7,14 @@ from dotenv import load_dotenv
 from os import getenv
 import os
 import subprocess
+import sys
 import time
 
+# The schema migrations are shared with the bot
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "nerf-gun-control"))
+from migrations import migrate_sync
+from bonus_grants import GRANT_QUERY, grant_results, grant_rows, parse_csv_grants
+
 
 # Initialize connection.
 # Uses st.cache_resource to only run once.
@@ -73,6 +79,59 @@ def execute_and_commit(query, params=None):
         return False
 
 
+# The bot keeps these tables in memory and reloads them when config_version changes
+VERSIONED_TABLES = ("system_config", "subscription_levels")
+BUMP_CONFIG_VERSION = """
+INSERT INTO system_config (config_key, config_value) VALUES ('config_version', '1')
+ON DUPLICATE KEY UPDATE config_value = CAST(config_value AS UNSIGNED) + 1
+"""
+
+
+def bump_config_version():
+    """Tell the bot that system_config or subscription_levels changed"""
+    return execute_and_commit(BUMP_CONFIG_VERSION)
+
+
+@st.cache_resource
+def ensure_schema():
+    """Bring the schema up to date, once per admin process. Returns the schema version."""
+    conn = init_connection()
+    if not conn:
+        st.error("Could not check the database schema - database connection failed")
+        return None
+    return migrate_sync(conn, log=st.info)
+
+
+def grant_bonus_credits(grants):
+    """
+    Add {user_id: amount} bonus credits in one batch, creating the users who
+    have no row yet. Returns grant_results() for them, or None on error.
+    """
+    conn = init_connection()
+    if not conn:
+        return None
+
+    users = list(grants)
+    placeholders = ", ".join(["%s"] * len(users))
+    today = datetime.now().strftime("%Y-%m-%d")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT user_id, bonus_credits FROM subscribers WHERE user_id IN ({placeholders}) FOR UPDATE",
+                users,
+            )
+            before = dict(cur.fetchall())
+            cur.execute("SELECT max_credits_per_day FROM subscription_levels WHERE subscription_level = 0")
+            level = cur.fetchone()
+            cur.executemany(GRANT_QUERY, grant_rows(grants, level[0] if level else 0, today))
+        conn.commit()
+    except Error as e:
+        st.error(f"Error granting bonus credits: {e}")
+        conn.rollback()
+        return None
+    return grant_results(grants, before)
+
+
 def get_all_rows(table_name):
     query = f"SELECT * FROM {table_name}"
     return run_query(query)
@@ -88,7 +147,11 @@ def update_row(table_name, id_column, id_value, column_values):
     set_clause = ", ".join([f"{col} = %s" for col in column_values.keys()])
     query = f"UPDATE {table_name} SET {set_clause} WHERE {id_column} = %s"
     values = list(column_values.values()) + [id_value]
-    return execute_and_commit(query, values)
+    if not execute_and_commit(query, values):
+        return False
+    if table_name in VERSIONED_TABLES:
+        bump_config_version()
+    return True
 
 
 def delete_row(table_name, id_column, id_value):
@@ -102,9 +165,12 @@ def delete_row(table_name, id_column, id_value):
             print("In delete-row\n")
             query = f"DELETE FROM {table_name} WHERE {id_column} = %s"
             cur.execute(query, (id_value,))
+            deleted = cur.rowcount
+            if table_name in VERSIONED_TABLES:
+                cur.execute(BUMP_CONFIG_VERSION)
             conn.commit()
             print("After commit\n")
-        return cur.rowcount > 0  # Check if any row was actually deleted
+        return deleted > 0  # Check if any row was actually deleted
     except Error as e:
         st.error(f"Error deleting row: {e}")
         conn.rollback()
@@ -118,7 +184,11 @@ def insert_row(table_name, column_values):
     columns = ", ".join(column_values.keys())
     placeholders = ", ".join(["%s"] * len(column_values))
     query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-    return execute_and_commit(query, list(column_values.values()))
+    if not execute_and_commit(query, list(column_values.values())):
+        return False
+    if table_name in VERSIONED_TABLES:
+        bump_config_version()
+    return True
 
 
 def backup_database():
@@ -189,6 +259,7 @@ def restore_database(backup_file):
         # Clear cache after restore to force new connection
         st.cache_resource.clear()
         st.cache_data.clear()
+        bump_config_version()
 
         return True, "Database restored successfully"
     except Exception as e:
@@ -209,45 +280,7 @@ def get_gun_status():
 def set_gun_status(active):
     value = "1" if active else "0"
     query = "UPDATE system_config SET config_value = %s WHERE config_key = 'gun_active'"
-    return execute_and_commit(query, (value,))
-
-
-def ensure_bonus_credits_column_exists():
-    """
-    Check if the 'bonus_credits' column exists in the 'subscribers' table.
-    If not, add it with a default value of 0.
-    """
-    conn = init_connection()
-    if not conn:
-        st.error("Could not verify 'bonus_credits' column - database connection failed")
-        return
-
-    try:
-        with conn.cursor() as cur:
-            # Check if the column exists
-            db_name = getenv("DB_NAME")
-            query = """
-            SELECT COUNT(*)
-            FROM information_schema.columns
-            WHERE table_schema = %s
-              AND table_name = 'subscribers'
-              AND column_name = 'bonus_credits'
-            """
-            cur.execute(query, (db_name,))
-            column_exists = cur.fetchone()[0]
-
-            if not column_exists:
-                st.info("Adding missing 'bonus_credits' column to 'subscribers' table.")
-                alter_query = """
-                ALTER TABLE subscribers
-                ADD COLUMN bonus_credits INT NOT NULL DEFAULT 0 AFTER current_credits
-                """
-                cur.execute(alter_query)
-                conn.commit()
-                st.success("'bonus_credits' column added successfully.")
-    except Error as e:
-        st.error(f"Error checking or adding 'bonus_credits' column: {e}")
-        conn.rollback()
+    return execute_and_commit(query, (value,)) and bump_config_version()
 
 
 @st.fragment(run_every=5)
@@ -298,49 +331,13 @@ def show_gun_status():
             st.error("Failed to update gun status!")
 
 
-def ensure_system_config_defaults():
-    """
-    Ensure all required system_config rows exist in the database.
-    If any required row is missing, it will be created with a default value.
-    """
-    required_configs = {
-        "min_horizontal_angle": "0",
-        "max_horizontal_angle": "180",
-        "min_vertical_angle": "0", 
-        "max_vertical_angle": "90",
-        "home_x": "90",
-        "home_y": "45",
-        "gun_active": "1",
-        "idle_timeout": "300",
-        "horizontal_offset": "-45",
-        "vertical_offset": "-60",
-    }
-    
-    # Fetch existing config_keys
-    query = "SELECT config_key FROM system_config"
-    existing_keys = run_query(query)
-    
-    if existing_keys is None:  # Handle DB connection errors
-        st.error("Could not verify system configuration defaults - database connection failed")
-        return
-    
-    existing_keys = [row[0] for row in existing_keys]
-    
-    # Insert any missing keys with default values
-    for key, default_value in required_configs.items():
-        if key not in existing_keys:
-            st.info(f"Adding missing system_config key: {key} with default value: {default_value}")
-            insert_query = "INSERT INTO system_config (config_key, config_value) VALUES (%s, %s)"
-            if not execute_and_commit(insert_query, (key, default_value)):
-                st.error(f"Failed to add required system_config key: {key}")
-
-
 def main():
     st.title("NerfBot Database Management")
 
-    # Ensure all required system_config rows exist
-    ensure_system_config_defaults()
-    ensure_bonus_credits_column_exists()
+    try:
+        ensure_schema()
+    except (Error, RuntimeError) as e:
+        st.error(f"Error migrating the database schema: {e}")
     
     execute_and_commit("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
     # Add Gun Control button at the top of the sidebar
@@ -512,6 +509,26 @@ def main():
             else:
                 st.warning("User not found.")
 
+        st.subheader("Import from CSV")
+        st.caption(
+            "One `user,amount` line per viewer, a header line is allowed. "
+            "Viewers without a row are created at level 0."
+        )
+        uploaded = st.file_uploader("CSV file", type=["csv"])
+        if uploaded is not None and st.button("Import Bonus Credits"):
+            grants, invalid = parse_csv_grants(uploaded.getvalue().decode("utf-8-sig"))
+            if invalid:
+                st.warning(f"Skipped {len(invalid)} invalid lines: {', '.join(invalid)}")
+            if grants:
+                results = grant_bonus_credits(grants)
+                if results is not None:
+                    created = sum(1 for result in results if result[3])
+                    st.success(f"Added bonus credits to {len(results)} users ({created} new).")
+                    df = pd.DataFrame(results, columns=["User ID", "Added", "Bonus Credits", "New User"])
+                    st.dataframe(df)
+            else:
+                st.info("No valid grants in the file.")
+
     # Add backup and restore buttons to sidebar
     st.sidebar.markdown("---")  # Add a separator
 
@@ -47,7 +47,28 @@ VALUES
     ('home_y', '0'),
     ('idle_timeout', '300'),
     ('horizontal_offset', '-45'),
-    ('vertical_offset', '-60');
+    ('vertical_offset', '-60'),
+    -- Bumped on every change by the admin tools, the bot reloads its config when it moves
+    ('config_version', '0');
+
+-- Create the shot_history table, filled in batches by the bot
+CREATE TABLE shot_history (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    fired_at DATETIME(3) NOT NULL,
+    user_id VARCHAR(50) NOT NULL,
+    channel VARCHAR(50),
+    x INT NOT NULL,
+    y INT NOT NULL,
+    shots_requested INT NOT NULL,
+    shots_fired INT NOT NULL,
+    credits_charged INT NOT NULL,
+    validate_ms INT,
+    queue_ms INT,
+    gun_ms INT,
+    total_ms INT,
+    INDEX idx_shot_history_fired_at (fired_at),
+    INDEX idx_shot_history_user (user_id, fired_at)
+);
  
 -- Create an event to reset credits daily
 DELIMITER //
@@ -0,0 +1,80 @@
+import asyncio
+
+from metrics import REGISTRY
+
+BATCH_SIZE = REGISTRY.histogram(
+    "nerf_batch_size", "Keys per batched lookup", ["batch"], buckets=(1, 2, 5, 10, 25, 50, 100)
+)
+
+
+class MicroBatcher:
+    """
+    Turns many concurrent single-key lookups into a few batched calls.
+
+    get(key) waits up to `delay` seconds for other keys to be asked for, then
+    fetch([key, ...]) resolves up to max_batch of them in one call. fetch
+    returns {key: value}, and keys missing from it get None. Concurrent get()
+    calls for a key that is already pending or in flight share its result, so
+    every key is fetched once at a time. If fetch raises, every get() waiting
+    on that batch gets the exception.
+    """
+
+    def __init__(self, fetch, max_batch=100, delay=0.005, name="batch"):
+        self.fetch = fetch
+        self.max_batch = max_batch
+        self.delay = delay
+        self.name = name
+        # key -> future, waiting for the next batch
+        self._pending = {}
+        # key -> future, in a batch being fetched
+        self._in_flight = {}
+        self._timer = None
+        self._tasks = set()
+
+    async def get(self, key):
+        future = self._pending.get(key) or self._in_flight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            # Retrieved here so an exception nobody waits for any more is not reported as lost
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch:
+                self._dispatch()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.delay, self._dispatch)
+        # A caller giving up must not cancel the lookup for the others
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        self._in_flight.update(batch)
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        BATCH_SIZE.labels(self.name).observe(len(batch))
+        try:
+            results = await self.fetch(list(batch))
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(results.get(key))
+        finally:
+            for key, future in batch.items():
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
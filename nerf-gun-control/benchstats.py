@@ -0,0 +1,56 @@
+import math
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+def percentile(values, p):
+    """Nearest-rank percentile, None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values):
+    """count, mean, p50/p95/p99 and max of a list of latencies"""
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def histogram(values, buckets=DEFAULT_BUCKETS):
+    """
+    Count of values per bucket, as [(upper bound, count)]. The last bucket,
+    with an upper bound of None, holds everything above the largest bound.
+    """
+    counts = [0] * (len(buckets) + 1)
+    for value in values:
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return list(zip(list(buckets) + [None], counts))
+
+
+def format_histogram(buckets, width=40):
+    """Text bars for a histogram() result, skipping empty buckets at either end"""
+    counts = [count for _, count in buckets]
+    used = [i for i, count in enumerate(counts) if count]
+    if not used:
+        return []
+    peak = max(counts)
+    lines = []
+    for bound, count in buckets[used[0] : used[-1] + 1]:
+        label = f"<= {bound * 1000:g} ms" if bound is not None else "more"
+        bar = "#" * max(1 if count else 0, round(width * count / peak))
+        lines.append(f"{label:>12} {count:6} {bar}")
+    return lines
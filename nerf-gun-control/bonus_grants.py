@@ -0,0 +1,122 @@
+"""
+Bulk bonus credit grants, shared by the bot's !addbonus and the admin UI's CSV import.
+
+All grants go to the database as one executemany() of GRANT_QUERY. The drivers
+turn that into a single multi-row INSERT. Viewers who already have a row get
+the amount added to their bonus_credits. Viewers who have none get a new level 0
+row holding their daily credits plus the grant.
+
+The single-user chat form also takes a negative amount (!addbonus alice -10),
+which takes bonus credits back, down to 0. It only applies to viewers who
+already have a row.
+"""
+import csv
+import io
+import re
+
+# Twitch logins, which are what subscribers.user_id holds
+USERNAME = re.compile(r"^[a-z0-9_]{1,25}$")
+
+GRANT_QUERY = """
+INSERT INTO subscribers (user_id, subscription_level, current_credits, bonus_credits, subscription_anniversary, last_reset_date)
+VALUES (%s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE bonus_credits = GREATEST(bonus_credits + VALUES(bonus_credits), 0)
+"""
+
+# Twitch cuts chat messages at 500 characters
+MAX_MESSAGE_LENGTH = 450
+
+
+def normalize_user(name):
+    """The user_id for a chat or CSV name ("@Alice" -> "alice"), or None if it cannot be one"""
+    name = name.strip().lstrip("@").lower()
+    return name if USERNAME.match(name) else None
+
+
+def _add(grants, invalid, name, amount, allow_negative=False):
+    user = normalize_user(name)
+    if user is None or amount == 0 or (amount < 0 and not allow_negative):
+        invalid.append(name)
+    else:
+        grants[user] = grants.get(user, 0) + amount
+
+
+def parse_chat_grants(args):
+    """
+    Grants from !addbonus arguments, either "alice 50" or "50 alice @bob carol".
+    Only the single-user form takes a negative amount, to take credits back.
+    Returns ({user_id: amount}, [invalid names]); a user named twice gets both.
+    Raises ValueError when the arguments are neither form.
+    """
+    grants, invalid = {}, []
+    if len(args) == 2 and not args[0].lstrip("-").isdigit():
+        _add(grants, invalid, args[0], int(args[1]), allow_negative=True)
+    elif len(args) >= 2:
+        amount = int(args[0])
+        for name in args[1:]:
+            _add(grants, invalid, name, amount)
+    else:
+        raise ValueError("expected a user and an amount")
+    return grants, invalid
+
+
+def parse_csv_grants(text):
+    """
+    Grants from CSV text with one "user,amount" per line; a header line is skipped.
+    Returns ({user_id: amount}, [invalid lines]).
+    """
+    grants, invalid = {}, []
+    for line_number, row in enumerate(csv.reader(io.StringIO(text)), start=1):
+        cells = [cell.strip() for cell in row]
+        if not any(cells):
+            continue
+        try:
+            name, amount = cells[0], int(cells[1])
+        except (IndexError, ValueError):
+            if line_number > 1:
+                invalid.append(",".join(cells))
+            continue
+        _add(grants, invalid, name, amount)
+    return grants, invalid
+
+
+def applicable_grants(grants, before):
+    """Drops the negative grants to users without a row (before): there is nothing to take back"""
+    return {user: amount for user, amount in grants.items() if amount > 0 or user in before}
+
+
+def grant_rows(grants, initial_credits, today):
+    """GRANT_QUERY parameters; initial_credits and today are only used for new rows"""
+    return [(user, 0, initial_credits, amount, today, today) for user, amount in grants.items()]
+
+
+def grant_results(grants, before):
+    """
+    Per-user results: (user_id, amount, bonus now, created). before maps the
+    users who already had a row to their bonus_credits before the grant.
+    """
+    return [
+        (user, amount, max(before.get(user, 0) + amount, 0), user not in before)
+        for user, amount in grants.items()
+    ]
+
+
+def format_results(results, invalid=()):
+    """Chat messages reporting a grant, each short enough for Twitch"""
+    parts = [
+        f"{user} {amount:+} ({'new, ' if created else ''}now {total})"
+        for user, amount, total, created in results
+    ]
+    if invalid:
+        parts.append("skipped: " + " ".join(invalid))
+    if not results:
+        return ["No bonus credits added, " + (parts[0] if parts else "no users given")]
+    head = f"Added bonus credits to {len(results)} user{'s' if len(results) != 1 else ''}: "
+    messages, current = [], head
+    for part in parts:
+        if len(current) + len(part) + 2 > MAX_MESSAGE_LENGTH and current != head:
+            messages.append(current.rstrip(", "))
+            current = ""
+        current += part + ", "
+    messages.append(current.rstrip(", "))
+    return messages
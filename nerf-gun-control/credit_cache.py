@@ -0,0 +1,217 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY
+
+CACHE_REQUESTS = REGISTRY.counter(
+    "nerf_credit_cache_requests_total", "Subscriber lookups in the credit cache", ["result"]
+)
+CACHE_FLUSHES = REGISTRY.counter("nerf_credit_cache_flushes_total", "Credit flushes", ["result"])
+CACHE_PENDING = REGISTRY.gauge("nerf_credit_cache_pending", "Subscribers with credit changes not yet in the DB")
+
+
+class CreditCache:
+    """
+    Write-back cache of subscriber rows, keyed by user_id.
+
+    A row is loaded with loader(user_id, *args) the first time it is asked for
+    (concurrent lookups of the same user share one load) and kept in LRU order,
+    at most max_entries rows. Clean rows older than ttl seconds are reloaded, so
+    changes made outside the bot (admin panel, daily reset) show up eventually.
+
+    Credit changes are not written one by one: add_credits() updates the cached
+    row and accumulates the change per user, and flush() hands all of them to
+    writer([(current_delta, bonus_delta, user_id), ...]) in one go. It runs every
+    flush_interval seconds, as soon as flush_threshold users have changes, and
+    on stop(). Changes are relative, so they add up with whatever else modified
+    the row in the database in the meantime.
+
+    What a cached row shows is always the database row as loaded plus the changes
+    not flushed yet, so rows can be dropped (evicted, invalidated) at any time.
+    """
+
+    def __init__(
+        self,
+        loader,
+        writer,
+        max_entries=1000,
+        ttl=60,
+        flush_interval=5,
+        flush_threshold=50,
+    ):
+        self.loader = loader
+        self.writer = writer
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        # user_id -> (row, loaded_at)
+        self._rows = OrderedDict()
+        # user_id -> [current_delta, bonus_delta] not written yet
+        self._pending = {}
+        self._loading = {}
+        # Bumped by every flush so a load racing with one can tell
+        self._flush_generation = 0
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        CACHE_PENDING.set_function(lambda: len(self._pending))
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    async def get(self, user_id, *args):
+        """The subscriber row (a dict, do not modify it), or None if loading it failed"""
+        entry = self._rows.get(user_id)
+        if entry is not None:
+            row, loaded_at = entry
+            if time.monotonic() - loaded_at < self.ttl or user_id in self._pending:
+                self._rows.move_to_end(user_id)
+                CACHE_REQUESTS.labels("hit").inc()
+                return row
+        CACHE_REQUESTS.labels("miss").inc()
+
+        if user_id not in self._loading:
+            self._loading[user_id] = asyncio.ensure_future(self._load(user_id, args))
+        try:
+            return await asyncio.shield(self._loading[user_id])
+        finally:
+            task = self._loading.get(user_id)
+            if task is not None and task.done():
+                del self._loading[user_id]
+
+    async def _load(self, user_id, args):
+        while True:
+            generation = self._flush_generation
+            async with self._flush_lock:
+                pass
+            row = await self.loader(user_id, *args)
+            if row is None:
+                return None
+            # A flush that started meanwhile may or may not be in what we read: read again
+            if generation == self._flush_generation and not self._flush_lock.locked():
+                break
+
+        row = dict(row)
+        current_delta, bonus_delta = self._pending.get(user_id, (0, 0))
+        row["current_credits"] += current_delta
+        row["bonus_credits"] = row.get("bonus_credits", 0) + bonus_delta
+        self._store(user_id, row)
+        return row
+
+    def _store(self, user_id, row):
+        self._rows[user_id] = (row, time.monotonic())
+        self._rows.move_to_end(user_id)
+        while len(self._rows) > self.max_entries:
+            # Safe even with changes pending: those are kept in self._pending
+            self._rows.popitem(last=False)
+
+    def add_credits(self, user_id, current_delta, bonus_delta):
+        """Change a cached subscriber's credits; the database follows at the next flush"""
+        entry = self._rows.get(user_id)
+        if entry is not None:
+            row = dict(entry[0])
+            row["current_credits"] += current_delta
+            row["bonus_credits"] = row.get("bonus_credits", 0) + bonus_delta
+            self._rows[user_id] = (row, entry[1])
+        pending = self._pending.setdefault(user_id, [0, 0])
+        pending[0] += current_delta
+        pending[1] += bonus_delta
+        if len(self._pending) >= self.flush_threshold:
+            self._wakeup.set()
+
+    async def reserve(self, user_id, cost, *args):
+        """
+        Take cost credits, daily ones first, if the subscriber has enough.
+        Returns (from_current, from_bonus), or None when they do not (or the row
+        could not be loaded). Give credits back with add_credits().
+        """
+        row = await self.get(user_id, *args)
+        if row is None:
+            return None
+        # The row may have changed while get() handed it over; from here on
+        # nothing awaits, so two reservations cannot both spend the same credits
+        entry = self._rows.get(user_id)
+        if entry is not None:
+            row = entry[0]
+        current = max(row["current_credits"], 0)
+        bonus = row.get("bonus_credits", 0)
+        if current + bonus < cost:
+            return None
+        from_current = min(current, cost)
+        from_bonus = cost - from_current
+        self.add_credits(user_id, -from_current, -from_bonus)
+        return from_current, from_bonus
+
+    def invalidate(self, user_id=None):
+        """Drop one row (or all of them) so the next get() reloads it from the database"""
+        if user_id is None:
+            self._rows.clear()
+        else:
+            self._rows.pop(user_id, None)
+
+    async def exclusive(self, func):
+        """
+        Flush, then run func() with flushes held off, for a bulk update of the
+        subscribers table that pending changes must not straddle. A load racing
+        with it reads the row again afterwards. Returns what func() returns.
+        """
+        async with self._flush_lock:
+            await self._flush()
+            if self._pending:
+                raise RuntimeError("pending credit changes could not be written")
+            self._flush_generation += 1
+            return await func()
+
+    async def flush(self):
+        """Write every pending change. On failure they are kept for the next flush."""
+        async with self._flush_lock:
+            return await self._flush()
+
+    async def _flush(self):
+        self._flush_generation += 1
+        changes, self._pending = self._pending, {}
+        changes = [(c, b, user_id) for user_id, (c, b) in changes.items() if c or b]
+        if not changes:
+            return 0
+        try:
+            await self.writer(changes)
+        except Exception as e:
+            print(f"Error flushing {len(changes)} credit changes: {e}")
+            CACHE_FLUSHES.labels("error").inc()
+            for current_delta, bonus_delta, user_id in changes:
+                pending = self._pending.setdefault(user_id, [0, 0])
+                pending[0] += current_delta
+                pending[1] += bonus_delta
+            return 0
+        CACHE_FLUSHES.labels("ok").inc()
+        return len(changes)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background flushes and write what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
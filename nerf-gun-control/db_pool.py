@@ -0,0 +1,87 @@
+import asyncio
+import contextlib
+import time
+
+from metrics import REGISTRY
+
+POOL_ACQUIRE_SECONDS = REGISTRY.histogram(
+    "nerf_db_pool_acquire_seconds", "Time spent waiting for a database connection"
+)
+POOL_EXHAUSTED = REGISTRY.counter(
+    "nerf_db_pool_exhausted_total", "Acquires that found every connection of a full pool in use"
+)
+POOL_TIMEOUTS = REGISTRY.counter(
+    "nerf_db_pool_timeouts_total", "Acquires that gave up waiting for a connection"
+)
+POOL_IN_USE = REGISTRY.gauge("nerf_db_pool_in_use", "Database connections handed out")
+POOL_SIZE = REGISTRY.gauge("nerf_db_pool_size", "Database connections open, in use or idle")
+
+
+class InstrumentedPool:
+    """
+    Wraps an aiomysql pool (or anything with the same acquire()) and times how
+    long acquire() waits, counts acquires that find the pool exhausted, and
+    tracks the connections in use. With acquire_timeout set, waiting longer
+    than that raises asyncio.TimeoutError instead of queueing forever behind
+    slow queries.
+
+        async with pool.acquire() as conn:
+            ...
+
+    Other attributes (size, freesize, maxsize...) are the wrapped pool's.
+    """
+
+    def __init__(self, pool, acquire_timeout=None):
+        self.pool = pool
+        self.acquire_timeout = acquire_timeout or None
+        self.in_use = 0
+        POOL_IN_USE.set_function(lambda: self.in_use)
+        POOL_SIZE.set_function(lambda: getattr(self.pool, "size", self.in_use))
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    def acquire(self):
+        return _Acquire(self)
+
+    async def warm_up(self, count):
+        """Hold count connections at once, so that many are open, and check each with SELECT 1"""
+        async with contextlib.AsyncExitStack() as stack:
+            for _ in range(count):
+                conn = await stack.enter_async_context(self.acquire())
+                async with conn.cursor() as cursor:
+                    await cursor.execute("SELECT 1")
+                    await cursor.fetchall()
+
+    def close(self):
+        self.pool.close()
+
+    async def wait_closed(self):
+        await self.pool.wait_closed()
+
+
+class _Acquire:
+    def __init__(self, owner):
+        self.owner = owner
+        self._cm = None
+
+    async def __aenter__(self):
+        pool = self.owner.pool
+        maxsize = getattr(pool, "maxsize", None)
+        if maxsize and getattr(pool, "freesize", 1) == 0 and getattr(pool, "size", 0) >= maxsize:
+            POOL_EXHAUSTED.inc()
+        self._cm = pool.acquire()
+        start = time.perf_counter()
+        try:
+            conn = await asyncio.wait_for(self._cm.__aenter__(), self.owner.acquire_timeout)
+        except asyncio.TimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_ACQUIRE_SECONDS.observe(time.perf_counter() - start)
+        self.owner.in_use += 1
+        return conn
+
+    async def __aexit__(self, *exc):
+        self.owner.in_use -= 1
+        return await self._cm.__aexit__(*exc)
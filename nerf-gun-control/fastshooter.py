@@ -1,20 +1,262 @@
-from nerf_controller import NerfController
-from params import NERF_CONTROLLER_URL
+"""
+Gun throughput benchmark.
 
-nerf = NerfController(NERF_CONTROLLER_URL)
+Fires a series of volleys at the gun (or the simulator) through NerfController
+or AsyncNerfController and reports shots/sec, the latency of every fire call as
+a histogram, and how many /status requests each volley cost.
 
-# Generate random coordinates pairs
+    python nerf-gun-control/fastshooter.py --count 100 --distribution clustered
+    python nerf-gun-control/fastshooter.py --controller async --no-long-poll --json async.json
+
+With --no-wait, fire() returns as soon as the gun accepts the volley and the next
+one goes out straight away; the gun refuses it while still busy, which is counted
+as a rejected volley.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
 import random
+import re
+import sys
 import time
 
-coords = [(random.randint(-45, 45), random.randint(0, 60)) for _ in range(100)]
-
-for x, y in coords:
-    print(f"Firing at x={x}, y={y}")
-    ok, status = nerf.fire(x, y, 1, wait=True)
-    #time.sleep(1)
-    # ok, status = nerf.wait_until_idle()
-    if not ok:
-        print(f"Error: {status}")
-        break
-    # time.sleep(1)
+import requests
+
+from benchstats import format_histogram, histogram, summarize
+from nerf_controller import AsyncNerfController, NerfController, _parse_shots
+from params import MAX_HORIZONTAL, MAX_VERTICAL, MIN_HORIZONTAL, MIN_VERTICAL, NERF_CONTROLLER_URL
+
+DISTRIBUTIONS = ["uniform", "clustered", "sweep"]
+
+
+def make_targets(distribution, count, bounds, seed=None, clusters=3, spread=5.0):
+    """
+    count (x, y) targets within bounds = (min_x, max_x, min_y, max_y):
+
+    uniform    anywhere, at random
+    clustered  normally spread around a few random points, like a chat aiming at
+               a handful of things on screen
+    sweep      a raster over the whole range, row by row, alternating direction
+    """
+    rng = random.Random(seed)
+    min_x, max_x, min_y, max_y = bounds
+
+    def clamp(x, y):
+        return (
+            min(max(round(x), min_x), max_x),
+            min(max(round(y), min_y), max_y),
+        )
+
+    if distribution == "uniform":
+        return [(rng.randint(min_x, max_x), rng.randint(min_y, max_y)) for _ in range(count)]
+
+    if distribution == "clustered":
+        centers = [(rng.uniform(min_x, max_x), rng.uniform(min_y, max_y)) for _ in range(clusters)]
+        targets = []
+        for _ in range(count):
+            cx, cy = rng.choice(centers)
+            targets.append(clamp(rng.gauss(cx, spread), rng.gauss(cy, spread)))
+        return targets
+
+    if distribution == "sweep":
+        rows = max(1, round(math.sqrt(count)))
+        columns = math.ceil(count / rows)
+        targets = []
+        for row in range(rows):
+            y = min_y + (max_y - min_y) * (row / (rows - 1) if rows > 1 else 0.5)
+            xs = [min_x + (max_x - min_x) * (col / (columns - 1) if columns > 1 else 0.5) for col in range(columns)]
+            if row % 2:
+                xs.reverse()
+            targets.extend(clamp(x, y) for x in xs)
+        return targets[:count]
+
+    raise ValueError(f"unknown distribution {distribution!r}")
+
+
+class StatusCounter:
+    """Wraps a controller's _fetch_status to count the /status requests it makes"""
+
+    def __init__(self, controller):
+        self.count = 0
+        fetch = controller._fetch_status
+        if asyncio.iscoroutinefunction(fetch):
+
+            async def counted(*args, **kwargs):
+                self.count += 1
+                return await fetch(*args, **kwargs)
+
+        else:
+
+            def counted(*args, **kwargs):
+                self.count += 1
+                return fetch(*args, **kwargs)
+
+        controller._fetch_status = counted
+
+
+def error_kind(status):
+    """Error message without the request URL, so the same failure is counted once"""
+    message = str(status.get("message", status.get("status")))
+    return re.split(r",? (?:url=|for url:)", message)[0]
+
+
+def record(results, start, ok, status, polls):
+    shots = 0
+    if ok:
+        # Without wait, fire() returns the /nerf answer: count the shots the gun accepted
+        shots = status["shots"] if "shots" in status else _parse_shots(status)
+    results.append({
+        "latency": time.monotonic() - start,
+        "ok": ok,
+        "shots": max(shots, 0),
+        "status_polls": polls,
+        "error": None if ok else error_kind(status),
+    })
+
+
+def run_sync(args, targets):
+    controller = NerfController(args.url, long_poll=args.long_poll)
+    counter = StatusCounter(controller)
+    results = []
+    for x, y in targets:
+        before = counter.count
+        start = time.monotonic()
+        ok, status = controller.fire(x, y, args.shots, wait=args.wait)
+        record(results, start, ok, status, counter.count - before)
+    return results
+
+
+async def run_async(args, targets):
+    async with AsyncNerfController(args.url, long_poll=args.long_poll) as controller:
+        counter = StatusCounter(controller)
+        results = []
+        for x, y in targets:
+            before = counter.count
+            start = time.monotonic()
+            ok, status = await controller.fire(x, y, args.shots, wait=args.wait)
+            record(results, start, ok, status, counter.count - before)
+        return results
+
+
+def gun_stats(url, reset=False):
+    """The simulator's /stats counters, None for a gun that does not have them"""
+    try:
+        response = requests.get(f"{url.rstrip('/')}/stats", params={"reset": 1} if reset else None, timeout=2)
+        response.raise_for_status()
+        return response.json()
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def benchmark(args):
+    bounds = (args.min_x, args.max_x, args.min_y, args.max_y)
+    targets = make_targets(args.distribution, args.count, bounds, args.seed, args.clusters, args.spread)
+
+    gun_stats(args.url, reset=True)
+    start = time.monotonic()
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            # The controllers print every request and answer
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        if args.controller == "async":
+            calls = asyncio.run(run_async(args, targets))
+        else:
+            calls = run_sync(args, targets)
+    elapsed = time.monotonic() - start
+
+    latencies = [call["latency"] for call in calls]
+    shots = sum(call["shots"] for call in calls)
+    polls = sum(call["status_polls"] for call in calls)
+    errors = {}
+    for call in calls:
+        if not call["ok"]:
+            errors[call["error"]] = errors.get(call["error"], 0) + 1
+
+    return {
+        "settings": {
+            "url": args.url,
+            "controller": args.controller,
+            "wait": args.wait,
+            "long_poll": args.long_poll,
+            "distribution": args.distribution,
+            "count": args.count,
+            "shots_per_volley": args.shots,
+            "seed": args.seed,
+        },
+        "elapsed": elapsed,
+        "volleys": len(calls),
+        "ok": sum(1 for call in calls if call["ok"]),
+        "shots": shots,
+        "shots_per_sec": shots / elapsed if elapsed > 0 else 0,
+        "volleys_per_sec": len(calls) / elapsed if elapsed > 0 else 0,
+        "latency": summarize(latencies),
+        "histogram": [{"le": bound, "count": count} for bound, count in histogram(latencies)],
+        "status_polls": polls,
+        "status_polls_per_volley": polls / len(calls) if calls else 0,
+        "errors": errors,
+        "gun_stats": gun_stats(args.url),
+    }
+
+
+def print_report(results):
+    settings = results["settings"]
+    print(
+        f"{settings['controller']} controller, {'wait' if settings['wait'] else 'no-wait'}, "
+        f"{'long-poll' if settings['long_poll'] else 'polling'}, {settings['distribution']} targets"
+    )
+    print(
+        f"{results['volleys']} volleys ({results['ok']} ok) in {results['elapsed']:.2f}s: "
+        f"{results['shots_per_sec']:.2f} shots/s, {results['volleys_per_sec']:.2f} volleys/s"
+    )
+    latency = results["latency"]
+    if latency["count"]:
+        print(
+            f"fire() latency ms: mean {latency['mean'] * 1000:.1f}, p50 {latency['p50'] * 1000:.1f}, "
+            f"p95 {latency['p95'] * 1000:.1f}, p99 {latency['p99'] * 1000:.1f}, max {latency['max'] * 1000:.1f}"
+        )
+    buckets = [(bucket["le"], bucket["count"]) for bucket in results["histogram"]]
+    for line in format_histogram(buckets):
+        print(line)
+    print(f"status requests: {results['status_polls']} ({results['status_polls_per_volley']:.2f} per volley)")
+    for error, count in results["errors"].items():
+        print(f"error x{count}: {error}")
+    if results["gun_stats"]:
+        stats = results["gun_stats"]
+        print(f"gun: {stats['volleys']} volleys, {stats['shots']} shots, {stats['travel']:.0f} degrees of travel")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the gun's throughput through the controllers")
+    parser.add_argument("--url", default=NERF_CONTROLLER_URL, help=f"Gun URL (default: {NERF_CONTROLLER_URL})")
+    parser.add_argument("-n", "--count", type=int, default=100, help="Number of volleys (default: 100)")
+    parser.add_argument("--shots", type=int, default=1, help="Shots per volley (default: 1)")
+    parser.add_argument("-d", "--distribution", choices=DISTRIBUTIONS, default="uniform", help="How targets are picked (default: uniform)")
+    parser.add_argument("--clusters", type=int, default=3, help="Number of clusters for --distribution clustered")
+    parser.add_argument("--spread", type=float, default=5.0, help="Standard deviation around a cluster, in degrees")
+    parser.add_argument("--controller", choices=["sync", "async"], default="sync", help="NerfController or AsyncNerfController")
+    parser.add_argument("--no-wait", dest="wait", action="store_false", help="Do not wait for the gun to be idle between volleys")
+    parser.add_argument("--no-long-poll", dest="long_poll", action="store_false", help="Poll /status instead of long-polling it")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the targets")
+    parser.add_argument("--min-x", type=int, default=MIN_HORIZONTAL)
+    parser.add_argument("--max-x", type=int, default=MAX_HORIZONTAL)
+    parser.add_argument("--min-y", type=int, default=MIN_VERTICAL)
+    parser.add_argument("--max-y", type=int, default=MAX_VERTICAL)
+    parser.add_argument("--json", metavar="FILE", help="Also write the results as JSON ('-' for stdout)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the controller's own output")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = benchmark(args)
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(results)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,246 @@
+import asyncio
+import itertools
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+# Relative share of gun time per subscription level when several users are waiting
+DEFAULT_LEVEL_WEIGHTS = {0: 1, 1: 2, 2: 3, 3: 4}
+
+
+def split_shots(fired, requested):
+    """
+    Share the shots a coalesced volley actually fired between its requests,
+    in proportion to what each one asked for (largest remainder, ties go to
+    the earlier request). Nobody is credited more than they requested.
+    """
+    total = sum(requested)
+    if fired >= total:
+        return list(requested)
+    if fired <= 0:
+        return [0] * len(requested)
+
+    exact = [fired * r / total for r in requested]
+    shares = [int(e) for e in exact]
+    leftover = fired - sum(shares)
+    by_remainder = sorted(range(len(requested)), key=lambda i: (shares[i] - exact[i], i))
+    for i in by_remainder[:leftover]:
+        shares[i] += 1
+    return shares
+
+
+def travel(start, targets):
+    """Total angular distance the gun slews going from start through targets in order"""
+    total = 0.0
+    x, y = start
+    for tx, ty in targets:
+        total += math.hypot(tx - x, ty - y)
+        x, y = tx, ty
+    return total
+
+
+@dataclass
+class FireRequest:
+    """A validated fire command waiting for the gun"""
+
+    username: str
+    x: int
+    y: int
+    shots: int
+    subscription_level: int = 0
+    # Channel owner shots are not charged
+    free: bool = False
+    # Credits taken from the user before queuing, see NerfGunBot.reserve_credits
+    credits_per_shot: int = 0
+    reserved_current: int = 0
+    reserved_bonus: int = 0
+    channel: object = None
+    author: object = None
+    # time.monotonic() when the chat command arrived, 0 if unknown
+    received_at: float = 0.0
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # Set by FireScheduler.submit
+    seq: int = 0
+    finish_tag: float = 0.0
+    # How many later requests were served first to save servo travel
+    overtaken: int = 0
+
+
+class FireScheduler:
+    """
+    Bounded weighted fair queue of FireRequests served by a single worker.
+
+    Every user gets their own FIFO queue. Requests are tagged with a virtual
+    finish time (self-clocked fair queuing): shots / weight added to the later of
+    the current virtual time and the user's previous tag, and the worker always
+    serves the smallest tag. A user spamming !fire therefore only delays their own
+    requests, and higher subscription levels get a proportionally larger share.
+
+    submit() never waits: when the queue (or the user's share of it) is full the
+    request is rejected and the caller tells the user to try later.
+
+    With coalesce_tolerance >= 0, the worker also pulls the next request of other
+    users aimed within that many degrees of the one it is about to serve, up to
+    coalesce_max_shots in total, and hands them to the handler together so they
+    go out as a single volley. The handler always receives a list of requests.
+
+    With reorder_window > 1, the worker looks at that many requests in fair order
+    and serves the one closest to where the gun is currently aimed (nearest
+    neighbour), which cuts servo travel between volleys. A request that has been
+    overtaken max_reorder times is served next regardless, so nobody starves.
+    """
+
+    def __init__(
+        self,
+        handler,
+        max_pending=50,
+        max_per_user=3,
+        level_weights=None,
+        coalesce_tolerance=-1,
+        coalesce_max_shots=10,
+        reorder_window=1,
+        max_reorder=3,
+    ):
+        self.handler = handler
+        self.max_pending = max_pending
+        self.max_per_user = max_per_user
+        self.level_weights = level_weights or DEFAULT_LEVEL_WEIGHTS
+        self.coalesce_tolerance = coalesce_tolerance
+        self.coalesce_max_shots = coalesce_max_shots
+        self.reorder_window = reorder_window
+        self.max_reorder = max_reorder
+        # Where the gun is aimed, once known
+        self.position = None
+        self._queues = {}
+        self._last_finish = {}
+        self._virtual_time = 0.0
+        self._depth = 0
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @property
+    def depth(self):
+        """Number of requests waiting (not counting the one being fired)"""
+        return self._depth
+
+    def user_depth(self, username):
+        queue = self._queues.get(username)
+        return len(queue) if queue else 0
+
+    def can_accept(self, username):
+        return self._depth < self.max_pending and self.user_depth(username) < self.max_per_user
+
+    def submit(self, request):
+        """Queue a request. Returns False without queuing it if the queue is full."""
+        if not self.can_accept(request.username):
+            return False
+
+        weight = self.level_weights.get(request.subscription_level, 1)
+        start = max(self._virtual_time, self._last_finish.get(request.username, 0.0))
+        request.seq = next(self._seq)
+        request.finish_tag = start + max(request.shots, 1) / weight
+        self._last_finish[request.username] = request.finish_tag
+
+        self._queues.setdefault(request.username, deque()).append(request)
+        self._depth += 1
+        self._wakeup.set()
+        return True
+
+    def drain(self):
+        """Remove and return every request still waiting, in fair order"""
+        requests = sorted(
+            (request for queue in self._queues.values() for request in queue),
+            key=lambda r: (r.finish_tag, r.seq),
+        )
+        self._queues.clear()
+        self._last_finish.clear()
+        self._depth = 0
+        return requests
+
+    def note_position(self, x, y):
+        """Tell the scheduler the gun was aimed somewhere outside of a fire request"""
+        self.position = (x, y)
+
+    def _pop_next(self):
+        # Tags only grow within a user's queue, so the smallest tag is always at a head
+        heads = sorted(
+            (queue[0] for queue in self._queues.values()), key=lambda r: (r.finish_tag, r.seq)
+        )
+        window = heads[: max(self.reorder_window, 1)]
+        chosen = window[0]
+        if len(window) > 1 and self.position is not None:
+            x, y = self.position
+            chosen = min(window, key=lambda r: math.hypot(r.x - x, r.y - y))
+            # Anything ahead of the nearest one that was overtaken enough goes first
+            for request in window:
+                if request is chosen:
+                    break
+                if request.overtaken >= self.max_reorder:
+                    chosen = request
+                    break
+            for request in window:
+                if request is chosen:
+                    break
+                request.overtaken += 1
+        return self._take(chosen.username)
+
+    def _coalesce(self, head):
+        batch = [head]
+        if self.coalesce_tolerance < 0:
+            return batch
+
+        # Only the head of each other user's queue, so per-user order is kept
+        # and nobody is charged twice in one volley
+        shots = head.shots
+        candidates = sorted(
+            (queue[0] for queue in self._queues.values()), key=lambda r: (r.finish_tag, r.seq)
+        )
+        for candidate in candidates:
+            if candidate.username == head.username:
+                continue
+            if shots + candidate.shots > self.coalesce_max_shots:
+                continue
+            if math.hypot(candidate.x - head.x, candidate.y - head.y) <= self.coalesce_tolerance:
+                batch.append(self._take(candidate.username))
+                shots += candidate.shots
+        return batch
+
+    def _take(self, username):
+        queue = self._queues[username]
+        request = queue.popleft()
+        if not queue:
+            del self._queues[username]
+            del self._last_finish[username]
+        self._virtual_time = max(self._virtual_time, request.finish_tag)
+        self._depth -= 1
+        return request
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            if not self._queues:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            batch = self._coalesce(self._pop_next())
+            self.position = (batch[0].x, batch[0].y)
+            try:
+                await self.handler(batch)
+            except Exception as e:
+                users = ", ".join(request.username for request in batch)
+                print(f"Error processing fire request from {users}: {e}")
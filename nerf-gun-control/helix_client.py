@@ -0,0 +1,195 @@
+"""
+Rate-limit-aware gatekeeper for Twitch Helix calls.
+
+Twitch gives the bot's token a bucket of points (800 a minute) and reports
+what is left in the Ratelimit-Remaining and Ratelimit-Reset headers of every
+response. twitchio passes those headers to the bucket of its HTTP client, so
+the bot installs a HelixClient there (bot._http.bucket = client) and every
+Helix response updates it, including the pages of paginated requests.
+
+    followers = await client.call(INTERACTIVE, "get_channel_followers", lambda: ...)
+
+call() runs the coroutine factory once it is its turn:
+- at most `concurrency` calls are in flight, and a free slot goes to the
+  interactive lane (checks for a waiting !fire) before the background lane
+  (follower sync);
+- background calls leave `reserve` points to interactive ones and wait for
+  the window to reset instead;
+- with no points left every call waits for the reset;
+- network errors and timeouts are retried up to max_retries times, after a
+  jittered exponential backoff. 429s and 5xx are not: twitchio's HTTP client
+  already retries those itself (5 attempts, about 30 s for 5xx), and another
+  round here would keep a waiting !fire hanging for minutes.
+"""
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+import aiohttp
+
+from metrics import REGISTRY
+
+INTERACTIVE = 0
+BACKGROUND = 1
+LANES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+HELIX_SECONDS = REGISTRY.histogram("nerf_helix_request_seconds", "Twitch Helix API calls", ["endpoint"])
+HELIX_WAIT_SECONDS = REGISTRY.histogram(
+    "nerf_helix_wait_seconds", "Time Helix calls waited for a free slot or rate limit points", ["lane"]
+)
+HELIX_QUEUED = REGISTRY.gauge("nerf_helix_queued", "Helix calls waiting for their turn", ["lane"])
+HELIX_RETRIES = REGISTRY.counter(
+    "nerf_helix_retries_total", "Helix calls retried after a network error or a timeout", ["endpoint"]
+)
+HELIX_RATELIMIT_REMAINING = REGISTRY.gauge(
+    "nerf_helix_ratelimit_remaining", "Helix rate limit points left, from Ratelimit-Remaining"
+)
+HELIX_RATELIMIT_RESET = REGISTRY.gauge(
+    "nerf_helix_ratelimit_reset_seconds", "Seconds until the Helix rate limit points refill"
+)
+
+
+def is_retryable(error):
+    """A network error or a timeout; twitchio's HTTPExceptions come after its own retries"""
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+class HelixClient:
+    """
+    Schedules Helix calls by lane within the rate limit the responses report.
+    Also implements the part of twitchio's RateBucket its HTTP client uses
+    (limited, update() and wait_reset()), so it can replace it.
+    """
+
+    def __init__(self, concurrency=4, reserve=100, max_retries=2, backoff=0.5, max_backoff=10,
+                 limit=800, window=60):
+        self.concurrency = concurrency
+        self.reserve = reserve
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limit = limit
+        self.window = window
+        # Until Twitch says otherwise: a full bucket refilling within a window
+        self.remaining = limit
+        # Epoch seconds, like Ratelimit-Reset
+        self.reset_at = time.time() + window
+        # Calls admitted and not answered yet: each holds a point remaining does not show yet
+        self.in_flight = 0
+        # (lane, seq, future) of the calls waiting for a slot; cancelled ones are dropped lazily
+        self._waiters = []
+        self._seq = itertools.count()
+        self._timer = None
+        HELIX_RATELIMIT_REMAINING.set_function(lambda: self.remaining)
+        HELIX_RATELIMIT_RESET.set_function(lambda: max(0.0, self.reset_at - time.time()))
+        for lane, name in LANES.items():
+            HELIX_QUEUED.set_function(lambda lane=lane: self.queued(lane), name)
+
+    def queued(self, lane):
+        return sum(1 for waiting, _, future in self._waiters if waiting == lane and not future.done())
+
+    async def call(self, lane, endpoint, factory):
+        """Run factory() in lane when the rate limit allows, retrying transient failures"""
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            await self._acquire(lane)
+            HELIX_WAIT_SECONDS.labels(LANES[lane]).observe(time.perf_counter() - start)
+            try:
+                with HELIX_SECONDS.labels(endpoint).time():
+                    return await factory()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                print(f"Helix {endpoint} failed ({e}), retrying")
+            finally:
+                self._release()
+            attempt += 1
+            HELIX_RETRIES.labels(endpoint).inc()
+            await asyncio.sleep(self.backoff_delay(attempt))
+
+    def backoff_delay(self, attempt):
+        """Full jitter: anywhere up to backoff * 2 ** (attempt - 1), capped at max_backoff"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    # twitchio's RateBucket interface
+
+    @property
+    def limited(self):
+        # The points of admitted calls are theirs to spend: only running out
+        # beyond those (another user of the token, a 429) makes twitchio wait
+        self._refresh()
+        return self.remaining <= 0
+
+    def update(self, *, reset=None, remaining=None):
+        """Record the Ratelimit-Reset and Ratelimit-Remaining headers of a response"""
+        try:
+            if reset:
+                self.reset_at = float(reset)
+            if remaining is not None and remaining != "":
+                self.remaining = int(remaining)
+        except ValueError:
+            pass
+        self._wake()
+
+    async def wait_reset(self):
+        # Spread out so the calls that waited do not all hit Twitch at the same instant
+        await asyncio.sleep(max(0.0, self.reset_at - time.time()) + random.uniform(0, self.backoff))
+        self._refresh()
+
+    def __await__(self):
+        return self.wait_reset().__await__()
+
+    # Scheduling
+
+    def _refresh(self):
+        now = time.time()
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.window
+
+    def _can_start(self, lane):
+        if self.in_flight >= self.concurrency:
+            return False
+        self._refresh()
+        return self.remaining - self.in_flight > (self.reserve if lane == BACKGROUND else 0)
+
+    async def _acquire(self, lane):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (lane, next(self._seq), future))
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Cancelled right after being given a slot: hand it on
+            if not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        """Start waiting calls, interactive ones first, while there are slots and points"""
+        while self._waiters:
+            lane, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            # The heap puts every interactive call before the background ones
+            if not self._can_start(lane):
+                break
+            heapq.heappop(self._waiters)
+            self.in_flight += 1
+            future.set_result(None)
+        if self._waiters and self.in_flight < self.concurrency and self._timer is None:
+            # Out of points: nothing finishing will wake the waiters, the reset will
+            delay = max(0.0, self.reset_at - time.time()) + random.uniform(0, self.backoff)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_reset)
+
+    def _on_reset(self):
+        self._timer = None
+        self._wake()
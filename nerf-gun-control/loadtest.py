@@ -0,0 +1,672 @@
+"""
+End-to-end load test of the fire pipeline.
+
+Runs a real NerfGunBot without Twitch or MySQL: chat messages, authors and
+channels are small fakes, the database is an in-memory FakePool that answers
+the bot's queries (with an optional latency), and Helix calls are replaced by
+fakes with their own latency. Messages are replayed at a fixed rate against the
+simulator, started in-process unless --gun-url is given.
+
+For every fire command that reaches the gun it measures:
+
+    validate  do_fire_command: config, bounds, follower checks and the credit
+              reservation, up to the queue
+    queue     waiting in the fire scheduler
+    prepare   execute_fire_batch before the volley
+    gun       do_fire, the volley itself
+    settle    refunds of unfired shots and replies after the volley
+    total     from the chat message to the "fired" reply
+
+and prints p50/p95/p99 per stage plus throughput.
+
+    python nerf-gun-control/loadtest.py --messages 2000 --rate 50 --shot-cycle 0.01
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(HERE)
+sys.path.append(os.path.join(HERE, "..", "nerf-gun-simluator"))
+
+import aiomysql
+import main
+import migrations
+from main import NerfGunBot
+from db_pool import InstrumentedPool
+from benchstats import summarize
+from simulator import GunModel, make_server
+
+BROADCASTER_ID = "1000"
+STAGES = ["validate", "queue", "prepare", "gun", "settle", "total"]
+
+
+class FakeDatabase:
+    """
+    In-memory stand-in for the bot's MySQL tables. Queries are dispatched on
+    regular expressions; anything unknown is counted and answers no rows, so a
+    new query in the bot shows up in the report instead of crashing the run.
+    """
+
+    def __init__(self, config, levels, credits, latency=0.0, pool_size=10):
+        self.config = {key: str(value) for key, value in config.items()}
+        # subscription_level: (initial credits, credits per shot)
+        self.levels = levels
+        self.default_credits = credits
+        self.subscribers = {}
+        # Rows inserted into shot_history, as tuples in shot_history.COLUMNS order
+        self.shot_history = []
+        self.latency = latency
+        self.pool_size = pool_size
+        self.pool = asyncio.Semaphore(pool_size)
+        self.queries = defaultdict(int)
+        self.unknown = defaultdict(int)
+        self.handlers = [
+            (r"SELECT MAX\(version\) FROM schema_version", self.select_schema_version),
+            (r"SELECT config_key, config_value\s+FROM system_config", self.select_config),
+            (r"SELECT config_value\s+FROM system_config\s+WHERE config_key = 'gun_active'", self.select_gun_active),
+            (r"SELECT config_value FROM system_config WHERE config_key = 'config_version'", self.select_config_version),
+            (r"SELECT \* FROM subscribers WHERE user_id = %s", self.select_subscriber),
+            (r"SELECT user_id, bonus_credits FROM subscribers WHERE user_id IN", self.select_bonuses),
+            (r"INSERT INTO subscribers .* ON DUPLICATE KEY UPDATE bonus_credits = GREATEST\(bonus_credits \+ VALUES", self.grant_bonus),
+            (r"INSERT INTO subscribers", self.insert_subscriber),
+            (r"UPDATE subscribers SET current_credits = current_credits \+ %s, bonus_credits = bonus_credits \+ %s WHERE user_id = %s", self.add_credits),
+            (r"UPDATE subscribers SET bonus_credits = bonus_credits - LAST_INSERT_ID\(", self.reserve_credits),
+            (r"SELECT subscription_level, max_credits_per_day, credits_per_shot FROM subscription_levels", self.select_levels),
+            (r"CHECKSUM TABLE subscription_levels", self.checksum_levels),
+            (r"UPDATE subscribers s JOIN subscription_levels sl .* WHERE s.last_reset_date < CURDATE\(\)", self.reset_credits),
+            (r"CREATE TABLE IF NOT EXISTS shot_history", self.create_shot_history),
+            (r"INSERT INTO shot_history", self.insert_shot_history),
+        ]
+
+    def add_subscriber(self, user_id, level=0, credits=None, last_reset_date=None):
+        self.subscribers[user_id] = {
+            "user_id": user_id,
+            "subscription_level": level,
+            "current_credits": self.default_credits if credits is None else credits,
+            "bonus_credits": 0,
+            "subscription_anniversary": "2024-01-01",
+            # Already reset today unless told otherwise, so the run keeps its credits
+            "last_reset_date": last_reset_date or date.today().isoformat(),
+        }
+
+    async def execute(self, query, args):
+        """Returns (columns, rows, rowcount), plus lastrowid for some queries"""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        query = " ".join(query.split())
+        for pattern, handler in self.handlers:
+            if re.match(pattern, query):
+                self.queries[handler.__name__] += 1
+                return handler(*(args or ()))
+        self.unknown[query[:60]] += 1
+        return [], [], 0
+
+    def select_config(self, *keys):
+        rows = [(key, value) for key, value in self.config.items() if not keys or key in keys]
+        return ["config_key", "config_value"], rows, len(rows)
+
+    def select_schema_version(self):
+        # An up-to-date schema: the bot's migrations have nothing to do
+        return ["MAX(version)"], [(migrations.LATEST,)], 1
+
+    def select_gun_active(self):
+        return ["config_value"], [(self.config.get("gun_active", "1"),)], 1
+
+    def select_config_version(self):
+        if "config_version" not in self.config:
+            return ["config_value"], [], 0
+        return ["config_value"], [(self.config["config_version"],)], 1
+
+    def set_config(self, key, value):
+        """Change a config row the way the admin tools do, bumping config_version"""
+        self.config[key] = str(value)
+        self.config["config_version"] = str(int(self.config.get("config_version", 0)) + 1)
+
+    def select_subscriber(self, user_id):
+        row = self.subscribers.get(user_id)
+        if row is None:
+            return [], [], 0
+        columns = list(row)
+        return columns, [tuple(row.values())], 1
+
+    def select_bonuses(self, *user_ids):
+        rows = [(user_id, self.subscribers[user_id]["bonus_credits"]) for user_id in user_ids if user_id in self.subscribers]
+        return ["user_id", "bonus_credits"], rows, len(rows)
+
+    def grant_bonus(self, user_id, level, credits, bonus, anniversary, reset_date):
+        row = self.subscribers.get(user_id)
+        if row is None:
+            return self.insert_subscriber(user_id, level, credits, bonus, anniversary, reset_date)
+        row["bonus_credits"] = max(row["bonus_credits"] + bonus, 0)
+        return [], [], 2
+
+    def insert_subscriber(self, user_id, level, credits, bonus, anniversary, reset_date):
+        self.subscribers[user_id] = {
+            "user_id": user_id,
+            "subscription_level": level,
+            "current_credits": credits,
+            "bonus_credits": bonus,
+            "subscription_anniversary": anniversary,
+            "last_reset_date": reset_date,
+        }
+        return [], [], 1
+
+    def add_credits(self, current_delta, bonus_delta, user_id):
+        row = self.subscribers.get(user_id)
+        if row is None:
+            return [], [], 0
+        row["current_credits"] += current_delta
+        row["bonus_credits"] += bonus_delta
+        return [], [], 1
+
+    def reserve_credits(self, cost, _cost, user_id, _required):
+        row = self.subscribers.get(user_id)
+        if row is None:
+            return [], [], 0
+        current = max(row["current_credits"], 0)
+        if current + row["bonus_credits"] < cost or cost <= 0:
+            return [], [], 0
+        from_bonus = max(cost - current, 0)
+        row["bonus_credits"] -= from_bonus
+        row["current_credits"] = max(row["current_credits"] - cost, 0)
+        # The query hands the bonus part back through LAST_INSERT_ID()
+        return [], [], 1, from_bonus
+
+    def reset_credits(self):
+        today = date.today().isoformat()
+        rows = 0
+        for row in self.subscribers.values():
+            if str(row["last_reset_date"]) < today and row["subscription_level"] in self.levels:
+                row["current_credits"] = self.levels[row["subscription_level"]][0]
+                row["last_reset_date"] = today
+                rows += 1
+        return [], [], rows
+
+    def create_shot_history(self):
+        return [], [], 0
+
+    def insert_shot_history(self, *row):
+        self.shot_history.append(row)
+        return [], [], 1
+
+    def select_levels(self):
+        rows = [(level, max_credits, per_shot) for level, (max_credits, per_shot) in sorted(self.levels.items())]
+        return ["subscription_level", "max_credits_per_day", "credits_per_shot"], rows, len(rows)
+
+    def checksum_levels(self):
+        return ["Table", "Checksum"], [("subscription_levels", hash(tuple(sorted(self.levels.items()))))], 1
+
+
+class FakeCursor:
+    def __init__(self, db, as_dict):
+        self.db = db
+        self.as_dict = as_dict
+        self.rows = []
+        self.rowcount = 0
+        self.lastrowid = 0
+        self.description = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, query, args=None):
+        columns, rows, self.rowcount, *lastrowid = await self.db.execute(query, args)
+        self.lastrowid = lastrowid[0] if lastrowid else 0
+        self.description = [(column,) for column in columns] or None
+        if self.as_dict:
+            rows = [dict(zip(columns, row)) for row in rows]
+        self.rows = list(rows)
+        return self.rowcount
+
+    async def executemany(self, query, args):
+        total = 0
+        for row in args:
+            total += await self.execute(query, row)
+        self.rowcount = total
+        return total
+
+    async def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    async def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, cursor_class=None):
+        as_dict = cursor_class is not None and issubclass(cursor_class, aiomysql.DictCursor)
+        return FakeCursor(self.db, as_dict)
+
+    # Counted, not enforced: statements take effect as they run
+    async def begin(self):
+        self.db.queries["begin"] += 1
+
+    async def commit(self):
+        self.db.queries["commit"] += 1
+
+    async def rollback(self):
+        self.db.queries["rollback"] += 1
+
+
+class FakePool:
+    """Stands for aiomysql's pool: at most pool_size connections in use at once"""
+
+    def __init__(self, db):
+        self.db = db
+
+    # What InstrumentedPool reads off an aiomysql pool
+    @property
+    def maxsize(self):
+        return self.db.pool_size
+
+    @property
+    def size(self):
+        return self.db.pool_size
+
+    @property
+    def freesize(self):
+        return self.db.pool._value
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        await self.db.pool.acquire()
+        return FakeConnection(self.db)
+
+    async def __aexit__(self, *exc):
+        self.db.pool.release()
+        return False
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+class FakeChannel:
+    def __init__(self, name):
+        self.name = name
+        self.sent = []
+
+    async def send(self, content):
+        self.sent.append(content)
+
+
+class FakeAuthor:
+    def __init__(self, name, user_id, is_mod=False):
+        self.name = name
+        self.id = user_id
+        self.is_mod = is_mod
+        self.display_name = name
+        self.whispers = []
+        # Set by the harness when the message carrying this author arrives
+        self.received_at = None
+
+    async def send(self, content):
+        self.whispers.append(content)
+
+
+class FakeUser:
+    """What fetch_users returns"""
+
+    def __init__(self, name, user_id):
+        self.name = name
+        self.id = user_id
+        self.display_name = name
+
+
+class FakeMessage:
+    def __init__(self, content, author, channel):
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.echo = False
+        self.tags = {"room-id": BROADCASTER_ID, "user-id": str(author.id), "display-name": author.name}
+
+
+class FakeContext:
+    """Just enough of commands.Context for the fire command"""
+
+    def __init__(self, message):
+        self.message = message
+        self.author = message.author
+        self.channel = message.channel
+
+    async def send(self, content):
+        await self.channel.send(content)
+
+
+class LoadTestBot(NerfGunBot):
+    """NerfGunBot with its external services replaced and every pipeline stage timed"""
+
+    def __init__(self, fake_db, helix_latency=0.0, followers=None, tiers=None):
+        super().__init__()
+        self.fake_db = fake_db
+        self.helix_latency = helix_latency
+        # None: everybody follows
+        self.followers = followers
+        # user_id -> subscription tier (1000, 2000, 3000)
+        self.tiers = tiers or {}
+        self.samples = defaultdict(list)
+        self.batches = 0
+        self.fired_requests = 0
+        self.shots_fired = 0
+        self.in_flight = 0
+        self._volley_times = None
+        # Helix requests by endpoint
+        self.helix_calls = defaultdict(int)
+
+        # Helix calls made through twitchio's HTTP client
+        self._http.get_channel_followers = self.fake_get_channel_followers
+        self._http.get_channel_subscriptions = self.fake_get_channel_subscriptions
+
+    async def connect_db(self):
+        self.db = InstrumentedPool(FakePool(self.fake_db), acquire_timeout=main.DB_POOL_ACQUIRE_TIMEOUT)
+
+    async def fake_get_channel_followers(self, token, broadcaster_id, user_id=None):
+        self.helix_calls["get_channel_followers"] += 1
+        if self.helix_latency:
+            await asyncio.sleep(self.helix_latency)
+        if self.followers is None or str(user_id) in self.followers:
+            return [{"user_id": str(user_id), "broadcaster_id": broadcaster_id}]
+        return []
+
+    async def fake_get_channel_subscriptions(self, token, broadcaster_id, user_ids=None):
+        self.helix_calls["get_channel_subscriptions"] += 1
+        if self.helix_latency:
+            await asyncio.sleep(self.helix_latency)
+        return [
+            {"user_id": user_id, "broadcaster_id": broadcaster_id, "tier": str(self.tiers[user_id])}
+            for user_id in user_ids or []
+            if user_id in self.tiers
+        ]
+
+    async def fetch_followers(self, broadcaster_id, limit):
+        self.helix_calls["get_channel_followers_sync"] += 1
+        if self.helix_latency:
+            await asyncio.sleep(self.helix_latency)
+        followers = [] if self.followers is None else sorted(self.followers)
+        return [{"user_id": user_id, "broadcaster_id": broadcaster_id} for user_id in followers[:limit]]
+
+    async def fetch_users(self, names=None, ids=None, token=None, force=False):
+        self.helix_calls["get_users"] += 1
+        if self.helix_latency:
+            await asyncio.sleep(self.helix_latency)
+        return [FakeUser(name, 100000 + i) for i, name in enumerate(names or [])]
+
+    async def handle_commands(self, message):
+        # No Twitch command parser offline: only the fire command is dispatched
+        match = re.match(r"^!(fire|f)\s+(.*)$", message.content.strip())
+        if match:
+            await self.fire_command._callback(self, FakeContext(message), args_str=match.group(2))
+
+    async def do_fire_command(self, author, message, channel, x, y, z):
+        start = time.monotonic()
+        await super().do_fire_command(author, message, channel, x, y, z)
+        self.samples["validate"].append(time.monotonic() - start)
+
+    async def execute_fire_batch(self, requests):
+        self.in_flight += 1
+        start = time.monotonic()
+        for request in requests:
+            self.samples["queue"].append(start - request.enqueued_at)
+        self._volley_times = None
+        try:
+            await super().execute_fire_batch(requests)
+        finally:
+            self.in_flight -= 1
+        end = time.monotonic()
+        self.batches += 1
+
+        if self._volley_times is None:
+            return
+        gun_start, gun_end, fired = self._volley_times
+        self.samples["prepare"].append(gun_start - start)
+        self.samples["gun"].append(gun_end - gun_start)
+        self.samples["settle"].append(end - gun_end)
+        if fired > 0:
+            self.shots_fired += fired
+            for request in requests:
+                self.fired_requests += 1
+                if request.author is not None and request.author.received_at is not None:
+                    self.samples["total"].append(end - request.author.received_at)
+
+    async def do_fire(self, x, y, z):
+        start = time.monotonic()
+        fired = await super().do_fire(x, y, z)
+        self._volley_times = (start, time.monotonic(), fired)
+        return fired
+
+    async def shutdown(self):
+        await self.kill_watchdog()
+        await self.stop_services()
+
+
+def make_messages(count, users, compact_ratio, max_shots, seed):
+    """(user index, chat line) pairs aimed anywhere within the gun's range"""
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        user = rng.randrange(users)
+        x, y = rng.randint(0, 90), rng.randint(0, 60)
+        shots = rng.randint(1, max_shots)
+        if rng.random() < compact_ratio:
+            content = f"!!{x},{y},{shots}"
+        else:
+            content = f"!fire {x} {y} {shots}"
+        messages.append((user, content))
+    return messages
+
+
+def classify(reply):
+    for key, pattern in [
+        ("fired", " fired "),
+        ("busy", "gun is busy"),
+        ("credits", "enough credits"),
+        ("offline", "offline"),
+        ("disabled", "disabled"),
+        ("follower", "need to be a follower"),
+        ("bounds", "out of bounds"),
+        ("gun_error", "Error shooting"),
+    ]:
+        if pattern in reply:
+            return key
+    return "other"
+
+
+async def run_load(args, gun_url):
+    # Whatever .env says, nothing here talks to Twitch or the real gun
+    main.TWITCH_CHANNEL_NAME = "loadtest"
+    main.TWITCH_ACCESS_TOKEN = "loadtest"
+    main.TWITCH_CLIENT_ID = "loadtest"
+    main.METRICS_PORT = args.metrics_port
+    main.CREDIT_CACHE_SIZE = args.credit_cache_size
+    main.NERF_CONTROLLER_URL = gun_url
+    main.OBS_MESSAGE_LOG_FILE = args.obs_log
+    main.FIRE_QUEUE_MAX_PENDING = args.max_pending
+    main.FIRE_QUEUE_MAX_PER_USER = args.max_per_user
+    main.FIRE_COALESCE_TOLERANCE = args.coalesce_tolerance
+    main.FIRE_REORDER_WINDOW = args.reorder_window
+
+    config = {
+        "min_horizontal_angle": -45,
+        "max_horizontal_angle": 45,
+        "min_vertical_angle": 0,
+        "max_vertical_angle": 60,
+        "home_x": 0,
+        "home_y": 0,
+        "gun_active": 1,
+        "idle_timeout": 300,
+        # Chat angles 0..90 map to the gun's -45..45, so !!x,y,z (digits only) covers it all
+        "horizontal_offset": -45,
+        "vertical_offset": 0,
+    }
+    levels = {0: (5, 1), 1: (100, 10), 2: (200, 8), 3: (300, 6)}
+    fake_db = FakeDatabase(config, levels, args.credits, latency=args.db_latency, pool_size=args.pool_size)
+    for user in range(args.users):
+        fake_db.add_subscriber(f"viewer{user}")
+
+    bot = LoadTestBot(fake_db, helix_latency=args.helix_latency)
+    await bot.initialize_async()
+    channel = FakeChannel(bot.channel_names[0])
+    messages = make_messages(args.messages, args.users, args.compact_ratio, args.max_shots, args.seed)
+
+    tasks = []
+    interval = 1.0 / args.rate if args.rate > 0 else 0
+    start = time.monotonic()
+    for i, (user, content) in enumerate(messages):
+        delay = start + i * interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        author = FakeAuthor(f"viewer{user}", 100000 + user)
+        author.received_at = time.monotonic()
+        # twitchio dispatches every chat message in its own task
+        tasks.append(asyncio.create_task(bot.event_message(FakeMessage(content, author, channel))))
+    sent_time = time.monotonic() - start
+
+    await asyncio.gather(*tasks)
+    while bot.fire_scheduler.depth or bot.in_flight:
+        await asyncio.sleep(0.01)
+    elapsed = time.monotonic() - start
+    await bot.shutdown()
+
+    outcomes = defaultdict(int)
+    for reply in channel.sent:
+        outcomes[classify(reply)] += 1
+
+    return {
+        "messages": args.messages,
+        "rate": args.rate,
+        "send_time": round(sent_time, 3),
+        "elapsed": round(elapsed, 3),
+        "throughput": {
+            "messages_per_sec": round(args.messages / elapsed, 2),
+            "fired_per_sec": round(bot.fired_requests / elapsed, 2),
+            "shots_per_sec": round(bot.shots_fired / elapsed, 2),
+            "shots": bot.shots_fired,
+            "volleys": bot.batches,
+        },
+        "outcomes": dict(outcomes),
+        "stages": {stage: summarize(bot.samples[stage]) for stage in STAGES},
+        # Read after shutdown, so it includes the credit cache's last flush
+        "credits_spent": args.users * args.credits
+        - sum(row["current_credits"] + row["bonus_credits"] for row in fake_db.subscribers.values()),
+        "history_rows": len(fake_db.shot_history),
+        "helix_calls": dict(bot.helix_calls),
+        "db_queries": dict(fake_db.queries),
+        "unknown_queries": dict(fake_db.unknown),
+    }
+
+
+def start_simulator(args):
+    gun = GunModel(
+        slew_rate=args.slew_rate,
+        settle_time=args.settle_time,
+        shot_cycle=args.shot_cycle,
+        ko_rate=args.ko_rate,
+        seed=args.seed,
+    )
+    httpd = make_server(0, gun, latency=args.gun_latency, error_rate=args.error_rate, quiet=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+
+
+def print_report(results):
+    print(f"\n{results['messages']} messages at {results['rate']}/s, done in {results['elapsed']}s")
+    throughput = results["throughput"]
+    print(
+        f"throughput: {throughput['messages_per_sec']} msg/s, {throughput['fired_per_sec']} fired/s, "
+        f"{throughput['shots_per_sec']} shots/s in {throughput['volleys']} volleys"
+    )
+    print("outcomes:", ", ".join(f"{k}={v}" for k, v in sorted(results["outcomes"].items())))
+    print(f"\n{'stage':<10}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, stats in results["stages"].items():
+        cells = [f"{stats[k] * 1000:10.1f}" if stats[k] is not None else f"{'-':>10}" for k in ("p50", "p95", "p99", "max")]
+        print(f"{stage:<10}{stats['count']:>8}{''.join(cells)}")
+    if results["unknown_queries"]:
+        print("\nqueries the fake DB does not know:", results["unknown_queries"])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the bot's fire pipeline offline")
+    parser.add_argument("--messages", type=int, default=1000, help="Chat messages to replay (default: 1000)")
+    parser.add_argument("--rate", type=float, default=20.0, help="Messages per second, 0 for all at once (default: 20)")
+    parser.add_argument("--users", type=int, default=50, help="Distinct chatters (default: 50)")
+    parser.add_argument("--compact-ratio", type=float, default=0.5, help="Share of !!x,y,z messages, the rest are !fire x y z")
+    parser.add_argument("--max-shots", type=int, default=3, help="Shots per command are drawn from 1..max (default: 3)")
+    parser.add_argument("--credits", type=int, default=1000000, help="Starting credits of every chatter")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the messages and the simulator")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="Seconds per fake DB query (default: 0.002)")
+    parser.add_argument("--pool-size", type=int, default=10, help="Fake DB connections (aiomysql's default is 10)")
+    parser.add_argument("--helix-latency", type=float, default=0.05, help="Seconds per fake Helix call (default: 0.05)")
+    parser.add_argument("--max-pending", type=int, default=50, help="FIRE_QUEUE_MAX_PENDING")
+    parser.add_argument("--max-per-user", type=int, default=3, help="FIRE_QUEUE_MAX_PER_USER")
+    parser.add_argument("--coalesce-tolerance", type=float, default=-1, help="FIRE_COALESCE_TOLERANCE")
+    parser.add_argument("--reorder-window", type=int, default=1, help="FIRE_REORDER_WINDOW")
+    parser.add_argument("--gun-url", help="Use this gun instead of starting the simulator in-process")
+    parser.add_argument("--slew-rate", type=float, default=120.0, help="Simulator servo speed, degrees/s")
+    parser.add_argument("--settle-time", type=float, default=0.1, help="Simulator settle time, seconds")
+    parser.add_argument("--shot-cycle", type=float, default=0.5, help="Simulator time per shot, seconds")
+    parser.add_argument("--gun-latency", type=float, default=0.0, help="Simulator network latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Simulator HTTP 500 probability")
+    parser.add_argument("--ko-rate", type=float, default=0.0, help="Simulator jam probability per volley")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results as JSON ('-' for stdout)")
+    parser.add_argument("--fail-p95", type=float, metavar="SECONDS", help="Exit with status 1 if the total p95 is above this")
+    parser.add_argument("--credit-cache-size", type=int, default=1000, help="CREDIT_CACHE_SIZE, 0 for no credit cache")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve the bot's /metrics on this port during the run (default: off)")
+    parser.add_argument("--obs-log", default=os.path.join(tempfile.gettempdir(), "nerf-loadtest-obs.txt"), help="OBS log file to write to")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the bot's own output")
+    return parser.parse_args(argv)
+
+
+def run(args):
+    httpd = None
+    gun_url = args.gun_url
+    if gun_url is None:
+        httpd, gun_url = start_simulator(args)
+    try:
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                # The bot prints every step of every command
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+            return asyncio.run(run_load(args, gun_url))
+    finally:
+        if httpd is not None:
+            httpd.shutdown()
+            httpd.server_close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run(args)
+    print_report(results)
+    if args.json == "-":
+        print(json.dumps(results, indent=2))
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    p95 = results["stages"]["total"]["p95"]
+    if args.fail_p95 is not None and (p95 is None or p95 > args.fail_p95):
+        print(f"total p95 {p95} is above {args.fail_p95}s")
+        sys.exit(1)
@@ -1,6 +1,7 @@
 from codecs import ascii_encode
 #from lib2to3.btm_matcher import BottomMatcher
 from math import asin
+import math
 from operator import ne
 import re
 import stat
@@ -9,10 +10,30 @@ import asyncio
 import logging
 import requests
 import os
-from twitchio.ext import commands
-from datetime import datetime, timedelta
+import time
+from twitchio.ext import commands, eventsub
+from twitchio.http import Route
+from datetime import datetime
+from types import MappingProxyType
 from reqlogger import ReqLogger
-from nerf_controller import NerfController
+from nerf_controller import AsyncNerfController
+from fire_scheduler import FireScheduler, FireRequest, split_shots
+from credit_cache import CreditCache
+from db_pool import InstrumentedPool
+from bonus_grants import (
+    GRANT_QUERY,
+    applicable_grants,
+    format_results as format_grant_results,
+    grant_results,
+    grant_rows,
+    parse_chat_grants,
+)
+from migrations import migrate
+from shot_history import COLUMNS as SHOT_HISTORY_COLUMNS, ShotHistory
+from ttl_cache import MISSING, TTLCache
+from batching import MicroBatcher
+from helix_client import BACKGROUND, INTERACTIVE, HelixClient
+from metrics import REGISTRY, start_metrics_server
 from twitchio.errors import AuthenticationError
 from params import *
 import aiomysql
@@ -20,6 +41,62 @@ import aiomysql
 # Load environment variables
 NEED_SUBSCRIPTION = False
 
+FIRE_COMMAND_SECONDS = REGISTRY.histogram(
+    "nerf_fire_command_seconds", "do_fire_command: checks from the chat message up to the fire queue"
+)
+DO_FIRE_SECONDS = REGISTRY.histogram("nerf_do_fire_seconds", "do_fire: a volley, from the status check to idle")
+DB_QUERY_SECONDS = REGISTRY.histogram("nerf_db_query_seconds", "Database queries", ["query"])
+LOCK_WAIT_SECONDS = REGISTRY.histogram("nerf_lock_wait_seconds", "Time waiting to acquire a lock", ["lock"])
+FIRE_QUEUE_DEPTH = REGISTRY.gauge("nerf_fire_queue_depth", "Fire commands waiting for the gun")
+FIRE_REJECTED = REGISTRY.counter("nerf_fire_rejected_total", "Fire commands turned away", ["reason"])
+SHOTS_FIRED = REGISTRY.counter("nerf_shots_fired_total", "Shots the gun reported fired for chat commands")
+CREDIT_RESET_SECONDS = REGISTRY.histogram("nerf_credit_reset_seconds", "Daily credit reset job")
+CREDIT_RESET_ROWS = REGISTRY.counter("nerf_credit_reset_rows_total", "Subscribers refilled by the daily credit reset")
+
+# Pricing for levels missing from the subscription_levels table, as in nerfdb-setup.sql
+DEFAULT_SUBSCRIPTION_LEVELS = MappingProxyType({
+    0: MappingProxyType({"max_credits_per_day": 5, "credits_per_shot": 1}),
+    1: MappingProxyType({"max_credits_per_day": 100, "credits_per_shot": 10}),
+    2: MappingProxyType({"max_credits_per_day": 200, "credits_per_shot": 8}),
+    3: MappingProxyType({"max_credits_per_day": 300, "credits_per_shot": 6}),
+})
+
+
+def _config_bool(value):
+    return str(value).strip() == "1"
+
+
+# system_config key: (gun_config key, type, default when the row is missing or invalid)
+GUN_CONFIG_KEYS = {
+    "min_horizontal_angle": ("min_horizontal", int, MIN_HORIZONTAL),
+    "max_horizontal_angle": ("max_horizontal", int, MAX_HORIZONTAL),
+    "min_vertical_angle": ("min_vertical", int, MIN_VERTICAL),
+    "max_vertical_angle": ("max_vertical", int, MAX_VERTICAL),
+    "home_x": ("home_x", int, 0),
+    "home_y": ("home_y", int, 0),
+    "gun_active": ("gun_active", _config_bool, True),
+    "idle_timeout": ("idle_timeout", int, 300),
+    "horizontal_offset": ("horizontal_offset", int, -45),
+    "vertical_offset": ("vertical_offset", int, -60),
+}
+
+
+def parse_gun_config(rows):
+    """
+    Build the gun configuration from (config_key, config_value) rows in one pass.
+    Returns a read-only mapping: a new configuration replaces it as a whole.
+    """
+    config = {name: default for name, _, default in GUN_CONFIG_KEYS.values()}
+    for key, value in rows:
+        if key not in GUN_CONFIG_KEYS:
+            continue
+        name, convert, default = GUN_CONFIG_KEYS[key]
+        try:
+            config[name] = convert(value)
+        except (TypeError, ValueError):
+            print(f"Invalid value {value!r} for {key}, using {default}")
+    return MappingProxyType(config)
+
 
 # Function to initialize OBS message log file
 def initialize_obs_log():
@@ -144,13 +221,43 @@ class NerfGunBot(commands.Bot):
             "Authorization": f"Bearer {self.token_manager.access_token}",
         }
         self.broadcaster_id = None
-        self.nerf_controller = NerfController(NERF_CONTROLLER_URL)
-        # Cache for follower status to minimize API calls
-        self.follower_cache = {}
-        # Cache timeout (5 minutes)
-        self.cache_timeout = 300
+        # Every Helix call goes through this client: checks for a waiting !fire before
+        # background syncs, within the rate limit. twitchio hands the Ratelimit headers
+        # of each response to its bucket, so the client replaces it.
+        self.helix = HelixClient(
+            concurrency=HELIX_CONCURRENCY,
+            reserve=HELIX_BACKGROUND_RESERVE,
+            max_retries=HELIX_MAX_RETRIES,
+            backoff=HELIX_RETRY_BACKOFF,
+        )
+        self._http.bucket = self.helix
+        self.nerf_controller = AsyncNerfController(
+            NERF_CONTROLLER_URL, on_state_change=self.on_gun_breaker_change
+        )
+        # (broadcaster_id, user_id) -> follows, so repeat shooters skip the Helix call.
+        # Warmed by sync_followers() and channel.follow notifications.
+        self.follower_cache = TTLCache(
+            FOLLOWER_CACHE_SIZE, FOLLOWER_CACHE_TTL, negative_ttl=FOLLOWER_NEGATIVE_TTL, name="followers"
+        )
+        self.eventsub_client = None
+        self._follower_sync_task = None
+        # login -> {"id", "login", "display_name"}, mostly from chat tags, else from Helix
+        self.identity_cache = TTLCache(
+            IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL, negative_ttl=60, name="identities"
+        )
+        # Logins looked up at about the same time share one fetch_users call
+        self.user_batcher = MicroBatcher(self.fetch_identities, max_batch=100, delay=HELIX_BATCH_DELAY, name="users")
+        # One follower query per user at a time, however many of their commands wait on it
+        self.follower_lookups = MicroBatcher(self.fetch_follower_status, max_batch=1, delay=0, name="followers")
+        # user_id -> tier (0: not subscribed)
+        self.subscription_cache = TTLCache(
+            SUBSCRIPTION_CACHE_SIZE, SUBSCRIPTION_CACHE_TTL, negative_ttl=SUBSCRIPTION_NEGATIVE_TTL, name="subscriptions"
+        )
+        # Subscription checks within HELIX_BATCH_DELAY share one request for up to 100 users
+        self.subscription_batcher = MicroBatcher(
+            self.fetch_subscription_tiers, max_batch=100, delay=HELIX_BATCH_DELAY, name="subscriptions"
+        )
         self.db = None
-        self.gun_config = None
         # Gun is not at home position (use just one variable)
         self.at_home = False
         # Add lock for gun status
@@ -158,47 +265,69 @@ class NerfGunBot(commands.Bot):
         # Initialize watchdog-related attributes
         self._lock = asyncio.Lock()
         self._last_shot_time = datetime.now()
-        self.gun_config = {}
+        # Read-only snapshot from parse_gun_config(), swapped whole on reload
+        self.gun_config = MappingProxyType({})
+        # Fire commands wait here for the gun instead of piling up on self._lock
+        self.fire_scheduler = FireScheduler(
+            self.execute_fire_batch,
+            max_pending=FIRE_QUEUE_MAX_PENDING,
+            max_per_user=FIRE_QUEUE_MAX_PER_USER,
+            coalesce_tolerance=FIRE_COALESCE_TOLERANCE,
+            coalesce_max_shots=FIRE_COALESCE_MAX_SHOTS,
+            reorder_window=FIRE_REORDER_WINDOW,
+            max_reorder=FIRE_MAX_REORDER,
+        )
+        FIRE_QUEUE_DEPTH.set_function(lambda: self.fire_scheduler.depth)
+        self.metrics_runner = None
+        # Read-only {level: {"max_credits_per_day", "credits_per_shot"}}, replaced
+        # as a whole by load_subscription_levels()
+        self.subscription_levels = DEFAULT_SUBSCRIPTION_LEVELS
+        self.subscription_levels_checksum = None
+        # system_config's config_version when the config was last read, see refresh_config()
+        self.config_version = None
+        self._config_task = None
+        self._credit_reset_task = None
+        # Subscriber rows stay in memory and credit changes are written in batches
+        self.credit_cache = None
+        if CREDIT_CACHE_SIZE > 0:
+            self.credit_cache = CreditCache(
+                self.load_user_data,
+                self.write_credit_changes,
+                max_entries=CREDIT_CACHE_SIZE,
+                ttl=CREDIT_CACHE_TTL,
+                flush_interval=CREDIT_FLUSH_INTERVAL,
+                flush_threshold=CREDIT_FLUSH_THRESHOLD,
+            )
+        # Who fired where and when, written in batches behind the fire path
+        self.shot_history = None
+        if SHOT_HISTORY_MAX_PENDING > 0:
+            self.shot_history = ShotHistory(
+                self.write_shot_history,
+                max_pending=SHOT_HISTORY_MAX_PENDING,
+                batch_size=SHOT_HISTORY_BATCH_SIZE,
+                flush_interval=SHOT_HISTORY_FLUSH_INTERVAL,
+            )
 
 
-    async def ensure_system_config_defaults(self):
-        """
-        Ensure all required system_config rows exist in the database.
-        If any required row is missing, it will be created with a default value.
-        """
-        required_configs = {
-            "min_horizontal_angle": 0,
-            "max_horizontal_angle": 180,
-            "min_vertical_angle": 0,
-            "max_vertical_angle": 90,
-            "home_x": 90,
-            "home_y": 45,
-            "gun_active": 1,
-            "idle_timeout": 300,
-            "horizontal_offset": -45,
-            "vertical_offset": -45,
-        }
-        
-        # Fetch existing config_keys
-        query = "SELECT config_key FROM system_config"
-        async with self.db.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(query)
-                existing_keys = set(row[0] for row in await cur.fetchall())
-                
-                # Insert any missing keys with default values
-                for key, default_value in required_configs.items():
-                    if key not in existing_keys:
-                        print(f"Adding missing system_config key: {key} with default value: {default_value}")
-                        insert_query = "INSERT INTO system_config (config_key, config_value) VALUES (%s, %s)"
-                        await cur.execute(insert_query, (key, str(default_value)))
-                await conn.commit()
-
     async def initialize_async(self):
         await self.connect_db()
-        await self.ensure_system_config_defaults()  # Ensure all required config rows exist
+        # Tables, indexes and default config rows; a single version check once up to date
+        await migrate(self.db)
+        # Read before the config itself, so a change made meanwhile is picked up at the next refresh
+        self.config_version = await self.get_config_version()
         self.gun_config = await self.load_gun_config()
         print(f"Gun configuration: {self.gun_config}")
+        await self.load_subscription_levels()
+        if CONFIG_REFRESH_INTERVAL > 0 and self._config_task is None:
+            self._config_task = asyncio.create_task(self._config_refresher())
+        if CREDIT_RESET_INTERVAL > 0 and self._credit_reset_task is None:
+            self._credit_reset_task = asyncio.create_task(self._credit_reset_loop())
+        self.fire_scheduler.start()
+        if self.credit_cache is not None:
+            self.credit_cache.start()
+        if self.shot_history is not None:
+            self.shot_history.start()
+        await self.start_metrics()
         
         # Initialize OBS message log with a welcome message
         initialize_obs_log()  # Initialize the OBS message log file
@@ -215,21 +344,57 @@ class NerfGunBot(commands.Bot):
             await self.return_to_home()
 
     async def connect_db(self):
-        self.db = await aiomysql.create_pool(
+        init_command = None
+        if DB_STATEMENT_TIMEOUT > 0:
+            # max_execution_time bounds SELECTs, innodb_lock_wait_timeout the waits of writes
+            init_command = (
+                f"SET SESSION max_execution_time = {int(DB_STATEMENT_TIMEOUT * 1000)}, "
+                f"innodb_lock_wait_timeout = {max(1, math.ceil(DB_STATEMENT_TIMEOUT))}"
+            )
+        pool = await aiomysql.create_pool(
             host=DB_HOST,
             port=DB_PORT,
             user=DB_USER,
             password=DB_PASSWORD,
             db=DB_NAME,
             autocommit=True,
+            minsize=DB_POOL_MIN_SIZE,
+            maxsize=DB_POOL_MAX_SIZE,
+            # Connections older than this are reopened instead of reused
+            pool_recycle=DB_POOL_RECYCLE if DB_POOL_RECYCLE > 0 else -1,
+            connect_timeout=DB_CONNECT_TIMEOUT,
+            init_command=init_command,
         )
+        self.db = InstrumentedPool(pool, acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT)
+        # The first commands should not pay for opening connections
+        await self.db.warm_up(DB_POOL_MIN_SIZE)
+
+    async def start_metrics(self):
+        """Serve /metrics unless METRICS_PORT is 0; a busy port only costs the metrics"""
+        if not METRICS_PORT or self.metrics_runner is not None:
+            return
+        try:
+            self.metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            print(f"Could not start the metrics endpoint on port {METRICS_PORT}: {e}")
+
+    async def stop_metrics(self):
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+            self.metrics_runner = None
 
     async def fetch_or_create_user_data(self, username, subscription_level):
+        if self.credit_cache is not None:
+            return await self.credit_cache.get(username, subscription_level)
+        return await self.load_user_data(username, subscription_level)
+
+    async def load_user_data(self, username, subscription_level):
         query = "SELECT * FROM subscribers WHERE user_id = %s"
-        async with self.db.acquire() as conn:
-            async with conn.cursor(aiomysql.DictCursor) as cur:
-                await cur.execute(query, (username,))
-                user_data = await cur.fetchone()
+        with DB_QUERY_SECONDS.labels("fetch_user").time():
+            async with self.db.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cur:
+                    await cur.execute(query, (username,))
+                    user_data = await cur.fetchone()
 
                 if user_data:
                     return user_data
@@ -252,20 +417,21 @@ class NerfGunBot(commands.Bot):
         """
 
         try:
-            async with self.db.acquire() as conn:
-                async with conn.cursor() as cur:
-                    await cur.execute(
-                        query,
-                        (
-                            new_subscriber["user_id"],
-                            new_subscriber["subscription_level"],
-                            new_subscriber["current_credits"],
-                            new_subscriber["bonus_credits"],
-                            new_subscriber["subscription_anniversary"],
-                            new_subscriber["last_reset_date"],
-                        ),
-                    )
-                    return new_subscriber
+            with DB_QUERY_SECONDS.labels("create_user").time():
+                async with self.db.acquire() as conn:
+                    async with conn.cursor() as cur:
+                        await cur.execute(
+                            query,
+                            (
+                                new_subscriber["user_id"],
+                                new_subscriber["subscription_level"],
+                                new_subscriber["current_credits"],
+                                new_subscriber["bonus_credits"],
+                                new_subscriber["subscription_anniversary"],
+                                new_subscriber["last_reset_date"],
+                            ),
+                        )
+                        return new_subscriber
         except Exception as e:
             print(f"Error creating new subscriber: {e}")
             return None
@@ -282,145 +448,108 @@ class NerfGunBot(commands.Bot):
             print("Failed to refresh token")
             return None
 
+    async def read_gun_config(self):
+        """The gun configuration from system_config; raises on database errors"""
+        placeholders = ", ".join(["%s"] * len(GUN_CONFIG_KEYS))
+        query = f"SELECT config_key, config_value FROM system_config WHERE config_key IN ({placeholders})"
+        with DB_QUERY_SECONDS.labels("gun_config").time():
+            async with self.db.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(query, tuple(GUN_CONFIG_KEYS))
+                    rows = await cur.fetchall()
+        return parse_gun_config(rows)
+
     async def load_gun_config(self):
-        query = """
-        SELECT config_key, config_value 
-        FROM system_config 
-        WHERE config_key IN ('min_horizontal_angle', 'max_horizontal_angle', 'min_vertical_angle', 'max_vertical_angle', 'home_x', 'home_y', 'gun_active', 'idle_timeout', 'horizontal_offset', 'vertical_offset')
-        """
+        """The gun configuration, or the defaults if the database cannot be read"""
         try:
-            async with self.db.acquire() as conn:
-                async with conn.cursor(aiomysql.DictCursor) as cur:
-                    await cur.execute(query)
-                    config_rows = await cur.fetchall()
-                    if config_rows:
-                        ret = {
-                            "min_horizontal": int(
-                                next(
-                                    (
-                                        row["config_value"]
-                                        for row in config_rows
-                                        if row["config_key"] == "min_horizontal_angle"
-                                    ),
-                                    MIN_HORIZONTAL,
-                                )
-                            ),
-                            "max_horizontal": int(
-                                next(
-                                    (
-                                        row["config_value"]
-                                        for row in config_rows
-                                        if row["config_key"] == "max_horizontal_angle"
-                                    ),
-                                    MAX_HORIZONTAL,
-                                )
-                            ),
-                            "min_vertical": int(
-                                next(
-                                    (
-                                        row["config_value"]
-                                        for row in config_rows
-                                        if row["config_key"] == "min_vertical_angle"
-                                    ),
-                                    MIN_VERTICAL,
-                                )
-                            ),
-                            "max_vertical": int(
-                                next(
-                                    (
-                                        row["config_value"]
-                                        for row in config_rows
-                                        if row["config_key"] == "max_vertical_angle"
-                                    ),
-                                    MAX_VERTICAL,
-                                )
-                            ),
-                            "home_x": int(
-                                next(
-                                    (
-                                        row["config_value"]
-                                        for row in config_rows
-                                        if row["config_key"] == "home_x"
-                                    ),
-                                    0,
-                                )
-                            ),
-                            "home_y": int(
-                                next(
-                                    (
-                                        row["config_value"]
-                                        for row in config_rows
-                                        if row["config_key"] == "home_y"
-                                    ),
-                                    0,
-                                )
-                            ),
-                            "gun_active": next(
-                                (
-                                    row["config_value"]
-                                    for row in config_rows
-                                    if row["config_key"] == "gun_active"
-                                ),
-                                "1",
-                            )
-                            == "1",
-                            "idle_timeout": int(
-                                next(
-                                    (
-                                        row["config_value"]
-                                        for row in config_rows
-                                        if row["config_key"] == "idle_timeout"
-                                    ),
-                                    300,
-                                )
-                            ),
-                            "horizontal_offset": int(
-                                next(
-                                    (
-                                        row["config_value"]
-                                        for row in config_rows
-                                        if row["config_key"] == "horizontal_offset"
-                                    ),
-                                    -45,
-                                )
-                            ),
-                            "vertical_offset": int(
-                                next(
-                                    (
-                                        row["config_value"]
-                                        for row in config_rows
-                                        if row["config_key"] == "vertical_offset"
-                                    ),
-                                    -60,
-                                )
-                            ),
-                        }
+            config = await self.read_gun_config()
         except Exception as e:
             print(f"Error loading gun config from database: {e}")
-            ret = {
-                "min_horizontal": MIN_HORIZONTAL,
-                "max_horizontal": MAX_HORIZONTAL,
-                "min_vertical": MIN_VERTICAL,
-                "max_vertical": MAX_VERTICAL,
-                "home_x": 0,
-                "home_y": 0,
-                "gun_active": True,
-                "idle_timeout": 300,
-                "horizontal_offset": -45,
-                "vertical_offset": -60,
-            }
-        finally:
-            print(f"Got config:\m{ret}")
-            return ret
+            config = parse_gun_config([])
+        print(f"Got config:\n{dict(config)}")
+        return config
+
+    async def reload_gun_config(self):
+        """Swap in the configuration from the database. On error the current one stays."""
+        try:
+            config = await self.read_gun_config()
+        except Exception as e:
+            print(f"Error reloading gun config, keeping the current one: {e}")
+            return False
+
+        async with self._gun_status_lock:
+            old_config, self.gun_config = self.gun_config, config
+        changes = {key: value for key, value in config.items() if old_config.get(key) != value}
+        if changes:
+            print(f"Gun configuration changed: {changes}")
+        if "gun_active" in changes:
+            status_message = f"Nerf Gun status changed to {'ACTIVE' if config['gun_active'] else 'INACTIVE'}"
+            log_message_for_obs(status_message, "System")
+        return True
 
     async def event_ready(self):
         print(f"Logged in as | {self.nick}")
         # FIXME:  need to handle multiple channels
         self.broadcaster_id = await self.get_user_id(self.channel_names[0])
+        if self.broadcaster_id is None:
+            return
+        if FOLLOWER_SYNC_LIMIT > 0 and self._follower_sync_task is None:
+            self._follower_sync_task = asyncio.create_task(self.sync_followers(str(self.broadcaster_id)))
+        if EVENTSUB_ENABLED and self.eventsub_client is None:
+            await self.start_eventsub()
+
+    async def start_eventsub(self):
+        """Subscribe to follow and subscription events over an EventSub websocket to keep the caches warm"""
+        self.eventsub_client = eventsub.EventSubWSClient(self)
+        token = self.token_manager.access_token
+        subscriptions = {
+            "follow": self.eventsub_client.subscribe_channel_follows_v2(
+                broadcaster=self.broadcaster_id, moderator=self.user_id or self.broadcaster_id, token=token
+            ),
+            "subscribe": self.eventsub_client.subscribe_channel_subscriptions(broadcaster=self.broadcaster_id, token=token),
+            "subscription end": self.eventsub_client.subscribe_channel_subscription_end(
+                broadcaster=self.broadcaster_id, token=token
+            ),
+        }
+        # Each needs its own scope: a missing one only costs those notifications
+        for name, subscribe in subscriptions.items():
+            try:
+                await subscribe
+            except Exception as e:
+                print(f"Could not subscribe to {name} events: {e}")
+
+    async def event_eventsub_notification_followV2(self, event):
+        follow = event.data
+        self.follower_cache.set((str(follow.broadcaster.id), str(follow.user.id)), True)
+
+    async def fetch_followers(self, broadcaster_id, limit):
+        """The channel's newest followers, up to limit, as Helix rows (paginated by twitchio)"""
+        route = Route(
+            "GET",
+            "channels/followers",
+            query=[("broadcaster_id", broadcaster_id)],
+            token=self.token_manager.access_token,
+        )
+        return await self.helix.call(
+            BACKGROUND, "get_channel_followers_sync", lambda: self._http.request(route, limit=limit)
+        )
+
+    async def sync_followers(self, broadcaster_id):
+        """Fill the follower cache with the newest followers, the likeliest shooters"""
+        try:
+            followers = await self.fetch_followers(broadcaster_id, min(FOLLOWER_SYNC_LIMIT, FOLLOWER_CACHE_SIZE))
+        except Exception as e:
+            print(f"Error syncing followers: {e}")
+            return 0
+        for follower in followers:
+            self.follower_cache.set((broadcaster_id, str(follower["user_id"])), True)
+        print(f"Cached {len(followers)} followers")
+        return len(followers)
 
     async def event_message(self, message):
         if message.echo:
             return
+        self.remember_chatter(message.author)
         await self.handle_commands(message)
 
         # Custom handling for the compact command format
@@ -442,31 +571,19 @@ class NerfGunBot(commands.Bot):
 
     async def check_follower_status(self, user_id: str, broadcaster_id: str) -> bool:
         """Check if a user is following the channel, with caching"""
-        cache_key = f"{user_id}_{broadcaster_id}"
+        cache_key = (str(broadcaster_id), str(user_id))
 
-        print(f"Checking follower status for {cache_key}...")
         # Check cache first
-        if False and (cache_key in self.follower_cache):
-            cached_data = self.follower_cache[cache_key]
-            if datetime.now() - cached_data["timestamp"] < timedelta(seconds=self.cache_timeout):
-                return cached_data["is_following"]
+        is_following = self.follower_cache.get(cache_key)
+        if is_following is not MISSING:
+            return is_following
 
         try:
-            # Use TwitchIO's built-in method
-            print("Sending get_channel_followers request")
-            followers = await self._http.get_channel_followers(
-                token=self.token_manager.access_token,
-                broadcaster_id=broadcaster_id,
-                user_id=int(user_id),
-            )
+            # Helix takes one user per follower query: concurrent checks of a user share it
+            is_following = await self.follower_lookups.get(cache_key)
 
-            is_following = len(followers) > 0
-
-            # Update cache
-            self.follower_cache[cache_key] = {
-                "is_following": is_following,
-                "timestamp": datetime.now(),
-            }
+            # Update cache; errors below are not cached
+            self.follower_cache.set(cache_key, is_following)
 
             return is_following
 
@@ -474,6 +591,35 @@ class NerfGunBot(commands.Bot):
             print(f"Error checking follower status: {e}")
             return False
 
+    async def fetch_follower_status(self, keys):
+        """{(broadcaster_id, user_id): follows} for a batch of one"""
+        (broadcaster_id, user_id), = keys
+        # Use TwitchIO's built-in method
+        print("Sending get_channel_followers request")
+        followers = await self.helix.call(
+            INTERACTIVE,
+            "get_channel_followers",
+            lambda: self._http.get_channel_followers(
+                token=self.token_manager.access_token,
+                broadcaster_id=broadcaster_id,
+                user_id=int(user_id),
+            ),
+        )
+        return {(broadcaster_id, user_id): len(followers) > 0}
+
+    async def fetch_subscription_tiers(self, user_ids):
+        """{user_id: tier (1000, 2000, 3000)} for up to 100 users in one Helix call; absent: not subscribed"""
+        subs = await self.helix.call(
+            INTERACTIVE,
+            "get_channel_subscriptions",
+            lambda: self._http.get_channel_subscriptions(
+                token=self.token_manager.access_token,
+                broadcaster_id=str(self.broadcaster_id),
+                user_ids=user_ids,
+            ),
+        )
+        return {str(sub["user_id"]): int(sub["tier"]) for sub in subs}
+
 
     @commands.command(name='fire', aliases=['f', '!'])
     async def fire_command(self, ctx: commands.Context, *, args_str=""):
@@ -491,7 +637,9 @@ class NerfGunBot(commands.Bot):
         await ctx.send("Usage: !fire 30 45 2  or  !f 30,45,2  or  !!30,45,2")
 
  
+    @FIRE_COMMAND_SECONDS.time()
     async def do_fire_command(self, author, message, channel, x: int, y: int, z: int):
+        received_at = time.monotonic()
         if not await self.get_gun_status():
             await channel.send("The Nerf gun is currently disabled.")
             log_message_for_obs("The Nerf gun is currently disabled.", "System")
@@ -504,30 +652,44 @@ class NerfGunBot(commands.Bot):
         username = author.name
         bcaster_id = message.tags.get("room-id")
 
+        # One snapshot for all the checks, even if the config is reloaded meanwhile
+        config = self.gun_config
+
         # Apply offsets before firing
-        x_with_offset = x + self.gun_config.get("horizontal_offset", 0)
-        y_with_offset = y + self.gun_config.get("vertical_offset", 0)
+        x_with_offset = x + config.get("horizontal_offset", 0)
+        y_with_offset = y + config.get("vertical_offset", 0)
 
         # Check angle limits (with offsets applied)
         if (
-            x_with_offset < self.gun_config["min_horizontal"]
-            or x_with_offset > self.gun_config["max_horizontal"]
-            or y_with_offset < self.gun_config["min_vertical"]
-            or y_with_offset > self.gun_config["max_vertical"]
+            x_with_offset < config["min_horizontal"]
+            or x_with_offset > config["max_horizontal"]
+            or y_with_offset < config["min_vertical"]
+            or y_with_offset > config["max_vertical"]
         ):
-            error_msg = f"Fire command out of bounds. Horizontal: {self.gun_config['min_horizontal']} to {self.gun_config['max_horizontal']}, Vertical: {self.gun_config['min_vertical']} to {self.gun_config['max_vertical']}"
+            error_msg = f"Fire command out of bounds. Horizontal: {config['min_horizontal']} to {config['max_horizontal']}, Vertical: {config['min_vertical']} to {config['max_vertical']}"
             await channel.send(error_msg)
             log_message_for_obs(error_msg, "System")
             return
 
+        if not self.nerf_controller.available:
+            await channel.send("The Nerf gun is offline right now, try again later.")
+            return
+
+        # Reject early, before any Twitch API call, if there is no room for this user
+        if not self.fire_scheduler.can_accept(username):
+            FIRE_REJECTED.labels("busy").inc()
+            await channel.send(f"@{username}, the gun is busy, try again later.")
+            return
+
         # Check if user is subscribed
         # FIXME:  temporarily fail owner check and force follower and subscriber checking
         channel_owner = True and (username in self.channel_names)
+        subscription_level = 0
         if not channel_owner:
 
             # Check if follower verification is required
             # FIXME:  Temporary force identity check
-            if True or self.gun_config.get("follower_required") == "1":
+            if True or config.get("follower_required") == "1":
                 # Get channel ID from the context
                 # channel_id = ctx.channel.id
                 is_following = await self.check_follower_status(str(author.id), bcaster_id)
@@ -541,233 +703,407 @@ class NerfGunBot(commands.Bot):
                     return
 
                 if NEED_SUBSCRIPTION:
-                    if not await self.check_subscription(author):
+                    is_subscribed, subscription_level = await self.resolve_subscription(author)
+                    if not is_subscribed:
                         sub_msg = f"{username} is not a subscriber and cannot use the !fire command."
                         await channel.send(sub_msg)
                         await channel.send(f"/w {username} you are not a subscriber")
                         log_message_for_obs(sub_msg, "System")
                         return
 
-                    subscription_level = await self.get_subscription_level(ctx.author)
-                    user_data = await self.fetch_or_create_user_data(username, subscription_level)
-                else:
-                    subscription_level = 0
-                    user_data = await self.fetch_or_create_user_data(username, subscription_level)
+        request = FireRequest(
+            username=username,
+            x=x_with_offset,
+            y=y_with_offset,
+            shots=z,
+            subscription_level=3 if channel_owner else subscription_level,
+            free=channel_owner,
+            channel=channel,
+            author=author,
+            received_at=received_at,
+        )
 
+        # Pay for every shot up front: unfired ones are refunded after the volley
+        if not channel_owner:
+            request.credits_per_shot = self.get_credits_per_shot(subscription_level)
+            total_cost = request.credits_per_shot * z
+            reserved = await self.reserve_credits(username, subscription_level, total_cost)
+            if reserved is None:
+                user_data = await self.fetch_or_create_user_data(username, subscription_level)
                 if user_data is None:
-                    error_msg = f"Failed to fetch or create data for {username}."
-                    await channel.send(error_msg)
-                    log_message_for_obs(error_msg, "System")
-                    return
+                    credit_msg = f"Failed to fetch or create data for {username}."
+                else:
+                    available = user_data["current_credits"] + user_data.get("bonus_credits", 0)
+                    credit_msg = f"{username} doesn't have enough credits. Required: {total_cost}, Available: {available}"
+                FIRE_REJECTED.labels("credits").inc()
+                await channel.send(credit_msg)
+                log_message_for_obs(credit_msg, "System")
+                return
+            request.reserved_current, request.reserved_bonus = reserved
 
-                current_credits = user_data["current_credits"]
-                bonus_credits = user_data.get("bonus_credits", 0)
-                credits_per_shot = await self.get_credit_for_shot_from_db(subscription_level)
+        # The checks above awaited Twitch, so the queue may have filled up meanwhile
+        request.enqueued_at = time.monotonic()
+        if not self.fire_scheduler.submit(request):
+            await self.refund_credits(request)
+            FIRE_REJECTED.labels("busy").inc()
+            await channel.send(f"@{username}, the gun is busy, try again later.")
 
-                total_cost = credits_per_shot * z
-                if (current_credits + bonus_credits) < total_cost:
-                    credit_msg = f"{username} doesn't have enough credits. Required: {total_cost}, Available: {current_credits + bonus_credits}"
-                    await channel.send(credit_msg)
-                    log_message_for_obs(credit_msg, "System") 
-                    return
+    async def execute_fire_batch(self, requests):
+        """
+        Fire queued requests; called by the fire scheduler one batch at a time.
+        A batch holds one request, or several aimed at the same spot when
+        coalescing is on: they go out as one volley and the shots actually fired
+        are shared between the requesters in proportion to what they asked for.
+        Credits were reserved when the requests were queued; whatever the gun
+        did not fire is refunded here.
+        """
+        # Perform the fire action
+        for request in requests:
+            if request.free:
+                print("Channel owner, firing without credits")
+            fire_message = f"{request.username} firing {request.shots} shots!"
+            log_message_for_obs(fire_message, request.username)
+
+        aim = requests[0]
+        total_shots = sum(request.shots for request in requests)
+        if len(requests) > 1:
+            print(f"Coalesced {len(requests)} fire commands into one volley of {total_shots} shots")
+        gun_start = time.monotonic()
+        try:
+            shots_fired = await self.do_fire(aim.x, aim.y, total_shots)
+        except (Exception, asyncio.CancelledError):
+            for request in requests:
+                await self.refund_credits(request)
+            raise
+        gun_end = time.monotonic()
+        async with self._lock:
+            self.at_home = False
 
-                # Perform the fire action
-                fire_message = f"{username} firing {z} shots!"
-                log_message_for_obs(fire_message, username)
- 
-                shots_fired = await self.do_fire(x_with_offset, y_with_offset, z)
-                async with self._lock:
-                    self.at_home = False
-
-                if shots_fired >= 0:
-                    # Update user credits
-                    credits_used = shots_fired * credits_per_shot
-                    remaining_daily_credits = max(0, current_credits - credits_used)
-                    credits_deducted_from_bonus = max(0, credits_used - current_credits)
-                    remaining_bonus_credits = bonus_credits - credits_deducted_from_bonus
-                    await self.update_user_credits(username, remaining_daily_credits, remaining_bonus_credits)
-        else:
-            # Perform the fire action
-            print("Channel owner, firing without credits")
-            fire_message = f"{username} firing {z} shots!"
-            log_message_for_obs(fire_message, username)
-            shots_fired = await self.do_fire(x_with_offset, y_with_offset, z)
-            remaining_credits = "unlimited"
+        if shots_fired < 0:
+            for request in requests:
+                await self.refund_credits(request)
+                self.record_shot(request, 0, gun_start, gun_end)
+            error_message = "Error shooting... Gun INACTIVE"
+            for channel in {request.channel for request in requests}:
+                await channel.send(error_message)
+            log_message_for_obs(error_message, "System")
+            return
+
+        SHOTS_FIRED.inc(shots_fired)
+        shares = split_shots(shots_fired, [request.shots for request in requests])
+        for request, fired in zip(requests, shares):
+            username = request.username
+            if request.free:
+                remaining_credits = "unlimited"
+            else:
+                await self.refund_credits(request, fired)
+                user_data = await self.fetch_or_create_user_data(username, request.subscription_level)
+                if user_data is None:
+                    remaining_credits = "unknown"
+                else:
+                    remaining_credits = user_data["current_credits"] + user_data.get("bonus_credits", 0)
 
-        if shots_fired >= 0:
             # Send messages
-            fire_message = f"{username} fired {shots_fired} shots!"
+            fire_message = f"{username} fired {fired} shots!"
             credit_message = f"You have {remaining_credits} credits remaining."
-            await channel.send(fire_message)
-            await author.send(credit_message)
+            await request.channel.send(fire_message)
+            await request.author.send(credit_message)
             log_message_for_obs(fire_message, username)
             # Also log the remaining credits info to OBS
             # log_message_for_obs(credit_message, "System")
+            self.record_shot(request, fired, gun_start, gun_end)
+
+    def record_shot(self, request, fired, gun_start, gun_end):
+        """Queue a shot_history row for a request; never waits on the database"""
+        if self.shot_history is None:
+            return
+
+        def ms(seconds):
+            return round(seconds * 1000)
+
+        self.shot_history.record(
+            fired_at=datetime.now(),
+            user_id=request.username,
+            channel=getattr(request.channel, "name", None),
+            x=request.x,
+            y=request.y,
+            shots_requested=request.shots,
+            shots_fired=fired,
+            credits_charged=0 if request.free else fired * request.credits_per_shot,
+            validate_ms=ms(request.enqueued_at - request.received_at) if request.received_at else None,
+            queue_ms=ms(gun_start - request.enqueued_at),
+            gun_ms=ms(gun_end - gun_start),
+            total_ms=ms(time.monotonic() - request.received_at) if request.received_at else None,
+        )
+
+    @commands.command(name='queue')
+    async def queue_command(self, ctx: commands.Context):
+        mine = self.fire_scheduler.user_depth(ctx.author.name)
+        await ctx.send(
+            f"@{ctx.author.name}, {self.fire_scheduler.depth} fire commands waiting, {mine} of them yours."
+        )
+
+    @commands.command(name='reloadconfig', aliases=['reloadlevels'])
+    async def reload_config_command(self, ctx: commands.Context):
+        if not ctx.author.is_mod:
+            await ctx.send("You must be a moderator to use this command.")
+            return
+        if await self.reload_gun_config() and await self.load_subscription_levels():
+            await ctx.send("Gun configuration and subscription levels reloaded.")
         else:
-            error_message = "Error shooting... Gun INACTIVE"
-            await channel.send(error_message)
-            log_message_for_obs(error_message, "System")
+            await ctx.send("Could not reload the configuration, keeping the current one.")
 
     @commands.command(name='addbonus')
-    async def add_bonus_command(self, ctx: commands.Context, username: str, amount: int):
+    async def add_bonus_command(self, ctx: commands.Context, *, args_str=""):
         if not ctx.author.is_mod:
             await ctx.send("You must be a moderator to use this command.")
             return
 
-        # Fetch the user's current bonus credits
-        query = "SELECT bonus_credits FROM subscribers WHERE user_id = %s"
-        async with self.db.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(query, (username,))
-                result = await cur.fetchone()
-                if result:
-                    current_bonus = result[0]
-                    new_bonus = current_bonus + amount
-                    
-                    # Update the bonus credits
-                    update_query = "UPDATE subscribers SET bonus_credits = %s WHERE user_id = %s"
-                    await cur.execute(update_query, (new_bonus, username))
-                    await conn.commit()
-                    
-                    await ctx.send(f"Added {amount} bonus credits to {username}. They now have {new_bonus} bonus credits.")
-                else:
-                    await ctx.send(f"User {username} not found.")
-
-    async def old_check_subscription(self, user):
+        try:
+            grants, invalid = parse_chat_grants(args_str.split())
+        except ValueError:
+            await ctx.send("Usage: !addbonus alice 50  or  !addbonus 50 alice bob carol")
+            return
 
-        #        with ReqLogger(logging.DEBUG):
-        user_id = await self.get_user_id(user.name)
-        url = f"https://api.twitch.tv/helix/subscriptions/user?broadcaster_id={self.broadcaster_id}&user_id={user_id}"
+        results = await self.grant_bonus_credits(grants) if grants else []
+        if results is None:
+            await ctx.send("Failed to add bonus credits.")
+            return
+        # Credits cannot be taken back from users who have none
+        granted = {user for user, *_ in results}
+        invalid += [f"{user} (not found)" for user in grants if user not in granted]
+        for message in format_grant_results(results, invalid):
+            await ctx.send(message)
 
+    async def grant_bonus_credits(self, grants):
+        """
+        Add {user_id: amount} bonus credits in one batch, creating the users who
+        have no row yet. Returns grant_results() for the grants applied, which
+        leaves out taking credits back from users without a row, or None on error.
+        """
+        users = list(grants)
+        placeholders = ", ".join(["%s"] * len(users))
+        select = f"SELECT user_id, bonus_credits FROM subscribers WHERE user_id IN ({placeholders}) FOR UPDATE"
+        today = datetime.utcnow().strftime("%Y-%m-%d")
         try:
-            response = requests.get(url, headers=self.twitch_headers)
-            response.raise_for_status()
-            data = response.json()
-            return len(data["data"]) > 0
-        except requests.RequestException as e:
-            print(f"Error checking subscription: {e}")
-            return False
+            with DB_QUERY_SECONDS.labels("grant_bonus").time():
+                async with self.db.acquire() as conn:
+                    # One transaction, so the reported totals are the ones written
+                    await conn.begin()
+                    try:
+                        async with conn.cursor() as cur:
+                            await cur.execute(select, users)
+                            before = dict(await cur.fetchall())
+                            grants = applicable_grants(grants, before)
+                            if grants:
+                                rows = grant_rows(grants, self.get_initial_credits(0), today)
+                                await cur.executemany(GRANT_QUERY, rows)
+                        await conn.commit()
+                    except BaseException:
+                        await conn.rollback()
+                        raise
+        except Exception as e:
+            print(f"Error granting bonus credits: {e}")
+            return None
+        if self.credit_cache is not None:
+            for user in users:
+                self.credit_cache.invalidate(user)
+        return grant_results(grants, before)
+
+    async def resolve_subscription(self, user):
+        """
+        (subscribed, level) of a chatter, level being the tier's 1-3 or 0.
+        Cached, and kept current by channel.subscribe / channel.subscription.end
+        notifications; uncached checks are batched with the others in flight.
+        """
+        user_id = await self.get_chatter_id(user)
+        if user_id is None:
+            return False, 0
+        tier = self.subscription_cache.get(user_id)
+        if tier is MISSING:
+            try:
+                tier = await self.subscription_batcher.get(user_id) or 0
+            except Exception as e:
+                print(f"Error checking subscription: {e}")
+                return False, 0
+            self.subscription_cache.set(user_id, tier)
+        return tier > 0, tier // 1000  # Convert tier (1000, 2000, 3000) to level (1, 2, 3)
 
     async def check_subscription(self, user):
+        subscribed, _ = await self.resolve_subscription(user)
+        return subscribed
 
-        #        with ReqLogger(logging.DEBUG):
-        user_id = await self.get_user_id(user.name)
-        # url = f"https://api.twitch.tv/helix/subscriptions/user?broadcaster_id={self.broadcaster_id}&user_id={user_id}"
+    async def get_subscription_level(self, user):
+        _, level = await self.resolve_subscription(user)
+        return level
+
+    async def event_eventsub_notification_subscription(self, event):
+        self.subscription_cache.set(str(event.data.user.id), event.data.tier)
+
+    async def event_eventsub_notification_subscription_end(self, event):
+        self.subscription_cache.set(str(event.data.user.id), 0)
+
+    def remember_chatter(self, author):
+        """Cache a chatter's identity from the message tags, which costs no API call"""
+        user_id, login = getattr(author, "id", None), getattr(author, "name", None)
+        if user_id and login:
+            self.identity_cache.set(login.lower(), {
+                "id": str(user_id),
+                "login": login.lower(),
+                "display_name": getattr(author, "display_name", None) or login,
+            })
+
+    async def fetch_identities(self, logins):
+        """{login: identity} for up to 100 logins in one Helix call"""
+        users = await self.helix.call(INTERACTIVE, "get_users", lambda: self.fetch_users(names=logins))
+        return {
+            user.name.lower(): {"id": str(user.id), "login": user.name.lower(), "display_name": user.display_name}
+            for user in users
+        }
 
+    async def resolve_user(self, username):
+        """The identity of a login, or None if there is no such user or Twitch could not be asked"""
+        login = username.lower()
+        identity = self.identity_cache.get(login)
+        if identity is not MISSING:
+            return identity
         try:
-            subs = await self._http.get_channel_subscriptions(
-                token=self.token_manager.access_token,
-                broadcaster_id=self.broadcaster_id,
-                user_ids=[user_id],
-            )
-            if subs:
-                return True
+            identity = await self.user_batcher.get(login)
+        except Exception as e:
+            print(f"Error getting user ID: {e}")
+            return None
+        self.identity_cache.set(login, identity)
+        return identity
 
-            return False
-        except requests.RequestException as e:
-            print(f"Error checking subscription: {e}")
-            return False
+    async def get_user_id(self, username):
+        identity = await self.resolve_user(username)
+        return identity["id"] if identity else None
 
-    async def get_subscription_level(self, user):
-        user_id = await self.get_user_id(user.name)
-        url = f"https://api.twitch.tv/helix/subscriptions/user?broadcaster_id={self.broadcaster_id}&user_id={user_id}"
+    async def get_chatter_id(self, user):
+        """A chatter's user id, from the chat tags when the message carried them"""
+        if getattr(user, "id", None):
+            return str(user.id)
+        return await self.get_user_id(user.name)
 
-        try:
-            response = requests.get(url, headers=self.twitch_headers)
-            response.raise_for_status()
-            data = response.json()
+    def get_level(self, subscription_level):
+        """Pricing of a subscription level, level 0's for an unknown one"""
+        levels = self.subscription_levels
+        return levels.get(subscription_level) or levels.get(0) or DEFAULT_SUBSCRIPTION_LEVELS[0]
 
-            if not data["data"]:
-                return 0  # Not subscribed
+    def get_initial_credits(self, subscription_level):
+        return self.get_level(subscription_level)["max_credits_per_day"]
 
-            tier = data["data"][0]["tier"]
-            return tier // 1000  # Convert tier (1000, 2000, 3000) to level (1, 2, 3)
-        except requests.RequestException as e:
-            print(f"Error getting subscription level: {e}")
-            return 0
+    def get_credits_per_shot(self, subscription_level):
+        return self.get_level(subscription_level)["credits_per_shot"]
 
-    async def old_get_user_id(self, username):
+    async def load_subscription_levels(self):
+        """
+        Read the subscription_levels table into self.subscription_levels.
+        On error the levels already loaded (or the defaults) stay in use.
+        """
+        query = "SELECT subscription_level, max_credits_per_day, credits_per_shot FROM subscription_levels"
+        try:
+            with DB_QUERY_SECONDS.labels("subscription_levels").time():
+                async with self.db.acquire() as conn:
+                    async with conn.cursor() as cursor:
+                        # Checksum first: a change in between only costs one more reload
+                        await cursor.execute("CHECKSUM TABLE subscription_levels")
+                        checksum = await cursor.fetchone()
+                        await cursor.execute(query)
+                        rows = await cursor.fetchall()
+        except Exception as e:
+            print(f"Error loading subscription levels, keeping the current ones: {e}")
+            return False
 
-        url = f"https://api.twitch.tv/helix/users?login={username}"
+        levels = dict(DEFAULT_SUBSCRIPTION_LEVELS)
+        for level, max_credits_per_day, credits_per_shot in rows:
+            levels[int(level)] = MappingProxyType({
+                "max_credits_per_day": int(max_credits_per_day),
+                "credits_per_shot": int(credits_per_shot),
+            })
+        # Swapped in one assignment, commands in flight see either the old or the new table
+        self.subscription_levels = MappingProxyType(levels)
+        self.subscription_levels_checksum = checksum[1] if checksum else None
+        print(f"Subscription levels: { {level: dict(row) for level, row in levels.items()} }")
+        return True
 
+    async def refresh_subscription_levels(self):
+        """Reload the levels if CHECKSUM TABLE says the table changed. Returns True if reloaded."""
         try:
-            response = requests.get(url, headers=self.twitch_headers)
-            response.raise_for_status()
-            data = response.json()
-            return data["data"][0]["id"]
-        except requests.RequestException as e:
-            print(f"Error getting user ID: {e}")
-            return None
+            with DB_QUERY_SECONDS.labels("levels_checksum").time():
+                async with self.db.acquire() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute("CHECKSUM TABLE subscription_levels")
+                        checksum = await cursor.fetchone()
+        except Exception as e:
+            print(f"Error checking subscription levels: {e}")
+            return False
+        if checksum is None or checksum[1] == self.subscription_levels_checksum:
+            return False
+        print("Subscription levels changed, reloading")
+        return await self.load_subscription_levels()
 
-    async def get_user_id(self, username):
+    async def get_config_version(self):
+        """system_config's config_version, bumped by the admin tools on every write. None on error."""
+        query = "SELECT config_value FROM system_config WHERE config_key = 'config_version'"
         try:
-            users = await self.fetch_users(names=[username])
-            return users[0].id
-        except requests.RequestException as e:
-            print(f"Error getting user ID: {e}")
+            with DB_QUERY_SECONDS.labels("config_version").time():
+                async with self.db.acquire() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(query)
+                        row = await cursor.fetchone()
+        except Exception as e:
+            print(f"Error reading the config version: {e}")
             return None
+        return row[0] if row else "0"
 
-    def get_initial_credits(self, subscription_level):
-        credits = {0: 5, 1: 100, 2: 200, 3: 300}
-        return credits.get(subscription_level, 5)
+    async def refresh_config(self):
+        """Reload the gun configuration and subscription levels if config_version changed. Returns True if it did."""
+        version = await self.get_config_version()
+        # Compared for equality only: restoring a backup may take the version back
+        if version is None or version == self.config_version:
+            return False
+        print(f"Config version changed from {self.config_version} to {version}, reloading")
+        config_loaded = await self.reload_gun_config()
+        levels_loaded = await self.load_subscription_levels()
+        if config_loaded and levels_loaded:
+            self.config_version = version
+        return True
 
-    def get_credits_per_shot(self, subscription_level):
-        credits = {0: 1, 1: 10, 2: 8, 3: 6}
-        return credits.get(subscription_level, 1)
-        
-    async def get_credit_for_shot_from_db(self, subscription_level):
-        """
-        Retrieve credits per shot from database based on subscription level.
-        Falls back to default values if database query fails.
-        
-        Args:
-            subscription_level: The user's subscription level (0-3)
-            
-        Returns:
-            int: Number of credits required per shot
+    async def _config_refresher(self):
         """
-        query = """
-        SELECT credits_per_shot 
-        FROM subscription_levels 
-        WHERE subscription_level = %s
+        Poll config_version every CONFIG_REFRESH_INTERVAL seconds. The levels
+        checksum, every LEVELS_REFRESH_INTERVAL, still catches changes made to
+        subscription_levels without the admin tools.
         """
-        
-        try:
-            async with self.db.acquire() as conn:
-                async with conn.cursor() as cursor:
-                    await cursor.execute(query, (subscription_level,))
-                    result = await cursor.fetchone()
-                    if result and result[0]:
-                        return int(result[0])
-                    else:
-                        # Fall back to default values if not found in DB
-                        credits = {0: 1, 1: 10, 2: 8, 3: 6}
-                        return credits.get(subscription_level, 1)
-        except Exception as e:
-            print(f"Error retrieving credits per shot from database: {e}")
-            # Fall back to default values on error
-            credits = {0: 1, 1: 10, 2: 8, 3: 6}
-            return credits.get(subscription_level, 1)
+        levels_checked = time.monotonic()
+        while True:
+            await asyncio.sleep(CONFIG_REFRESH_INTERVAL)
+            if await self.refresh_config():
+                levels_checked = time.monotonic()
+            elif LEVELS_REFRESH_INTERVAL > 0 and time.monotonic() - levels_checked >= LEVELS_REFRESH_INTERVAL:
+                levels_checked = time.monotonic()
+                await self.refresh_subscription_levels()
 
     async def _watchdog_monitor(self):
-        WATCHDOG_TIMEOUT = self.gun_config.get("idle_timeout", 300)
         SLEEP_TIMEOUT = 5
         while True:
             if await self.get_gun_status():
                 await asyncio.sleep(SLEEP_TIMEOUT)
                 
-                # Check if we need to return to home
+                # Check if we need to return to home; read every time so a reload applies
+                idle_timeout = self.gun_config.get("idle_timeout", 300)
                 needs_home = False
                 async with self._lock:
-                    if not self.at_home and (datetime.now() - self._last_shot_time).total_seconds() >= WATCHDOG_TIMEOUT:
+                    if not self.at_home and (datetime.now() - self._last_shot_time).total_seconds() >= idle_timeout:
                         needs_home = True
             
                 # Call return_to_home outside the lock
                 if needs_home:
                     await self.return_to_home()
             else:
+                # The config refresher turns the gun back on when the admin does
                 await asyncio.sleep(SLEEP_TIMEOUT)
-                await self.check_gun_status()
 
     async def return_to_home(self):
         """Return gun to home position with proper synchronization"""
@@ -778,12 +1114,12 @@ class NerfGunBot(commands.Bot):
             return
         
         async with self._lock:
-            if self.gun_config["gun_active"] and not self.at_home:
+            config = self.gun_config
+            if config["gun_active"] and not self.at_home:
                 self.at_home = True
                 print("Moving the gun")
-                ok, status = self.nerf_controller.fire(
-                    self.gun_config["home_x"], self.gun_config["home_y"], 0, False
-                )
+                ok, status = await self.nerf_controller.fire(config["home_x"], config["home_y"], 0, False)
+                self.fire_scheduler.note_position(config["home_x"], config["home_y"])
                 print(f"result = {ok, status}")
             else:
                 print("Already at home or INACTIVE")
@@ -792,27 +1128,6 @@ class NerfGunBot(commands.Bot):
         async with self._lock:
             self._last_shot_time = datetime.now()
 
-    async def update_gun_status(self, status):
-        query = """
-        UPDATE system_config 
-        SET config_value = %s
-        WHERE config_key = 'gun_active'
-        """
-
-        try:
-            async with self.db.acquire() as conn:
-                async with conn.cursor() as cursor:
-                    await cursor.execute(query, (1 if status else 0,))
-                    await conn.commit()
-                    await self.set_gun_status(status)  # Update local config with lock
-                    # Log the status change to OBS
-                    status_message = f"Nerf Gun status changed to {'ACTIVE' if status else 'INACTIVE'}"
-                    log_message_for_obs(status_message, "System")
-                    return True
-        except Exception as e:
-            print(f"Error updating gun status: {e}")
-            return False
-
     async def check_gun_status(self):
         query = """
         SELECT config_value 
@@ -820,22 +1135,23 @@ class NerfGunBot(commands.Bot):
         WHERE config_key = 'gun_active'
         """
         try:
-            async with self.db.acquire() as conn:
-                async with conn.cursor() as cursor:
-                    await cursor.execute(query)
-                    result = await cursor.fetchone()
-                    if result:
-                        status = bool(int(result[0]))
-                        old_status = self.gun_config.get("gun_active", False)
-                        await self.set_gun_status(status)  # Update local config with lock
-                        
-                        # Only log if the status has changed
-                        if old_status != status:
-                            status_message = f"Nerf Gun status changed to {'ACTIVE' if status else 'INACTIVE'}"
-                            log_message_for_obs(status_message, "System")
-                            
-                        return status
-                    return False
+            with DB_QUERY_SECONDS.labels("gun_status").time():
+                async with self.db.acquire() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(query)
+                        result = await cursor.fetchone()
+            if result:
+                status = bool(int(result[0]))
+                old_status = self.gun_config.get("gun_active", False)
+                await self.set_gun_status(status)  # Update local config with lock
+
+                # Only log if the status has changed
+                if old_status != status:
+                    status_message = f"Nerf Gun status changed to {'ACTIVE' if status else 'INACTIVE'}"
+                    log_message_for_obs(status_message, "System")
+
+                return status
+            return False
         except Exception as e:
             print(f"Error checking gun status: {e}")
             return False
@@ -852,6 +1168,33 @@ class NerfGunBot(commands.Bot):
             delattr(self, "_last_shot_time")
             delattr(self, "_lock")
 
+    async def stop_services(self):
+        """Stop the background tasks, write pending credits and history, close the gun session and /metrics"""
+        for task in (self._config_task, self._credit_reset_task, self._follower_sync_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._config_task = self._credit_reset_task = self._follower_sync_task = None
+        await self.fire_scheduler.stop()
+        # Commands still queued will not fire: give their credits back
+        for request in self.fire_scheduler.drain():
+            await self.refund_credits(request)
+        if self.credit_cache is not None:
+            await self.credit_cache.stop()
+        if self.shot_history is not None:
+            await self.shot_history.stop()
+        await self.nerf_controller.close()
+        await self.stop_metrics()
+
+    async def close(self):
+        """Close the gun session along with the Twitch connection"""
+        await self.stop_services()
+        await super().close()
+
+    @DO_FIRE_SECONDS.time()
     async def do_fire(self, x, y, z):
         # Start the watchdog if it's not already running
         if not hasattr(self, "_watchdog_task"):
@@ -860,37 +1203,176 @@ class NerfGunBot(commands.Bot):
         # Update the last shot time
         asyncio.create_task(self.update_last_shot())
 
-        # Perform the actual firing
-        if not await self.check_gun_status():
+        # Perform the actual firing; gun_active is kept current by the config refresher
+        if not await self.get_gun_status():
+            return -1
+
+        # Gun KO or unreachable: the circuit breaker fails this in microseconds
+        if not self.nerf_controller.available:
             return -1
 
         print(f"Firing: x={x}, y={y}, z={z}")
+        wait_start = time.perf_counter()
         async with self._lock:
-            ok, status = self.nerf_controller.fire(x, y, z, wait=True)
+            LOCK_WAIT_SECONDS.labels("gun").observe(time.perf_counter() - wait_start)
+            ok, status = await self.nerf_controller.fire(x, y, z, wait=True)
         
         if not ok:
+            # No need to switch gun_active off: the controller's circuit breaker keeps
+            # a failing gun out of service and lets it back in once it answers again
             print(f"Error: {status}")
-            await self.update_gun_status(False)
             return status.get("shots", 0) # Return the number of shots fired
 
         return status.get("shots", 0)
 
-    async def update_user_credits(self, user_id, new_credits, new_bonus_credits):
+    def on_gun_breaker_change(self, state):
+        """Called by the gun controller's circuit breaker when the gun goes down or comes back"""
+        if state == "open":
+            log_message_for_obs("Gun status: OFFLINE, retrying in the background", "System")
+        elif state == "closed":
+            log_message_for_obs("Gun status: back ONLINE", "System")
+
+    async def reserve_credits(self, username, subscription_level, cost):
+        """
+        Take cost credits from a subscriber, daily credits first, in one step that
+        cannot overspend even with several fire commands in flight. Returns
+        (from_current, from_bonus), or None if they do not have enough credits.
+        """
+        if self.credit_cache is not None:
+            return await self.credit_cache.reserve(username, cost, subscription_level)
+        if cost <= 0:
+            # MySQL counts changed rows only: a free shot would look like a refusal
+            return 0, 0
+
+        # Conditional update: a concurrent reservation either sees our deduction
+        # or waits on the row lock. Assignments run left to right, so bonus sees
+        # the old current_credits; LAST_INSERT_ID(expr) hands back the part taken
+        # from bonus_credits as the cursor's lastrowid.
         query = """
         UPDATE subscribers
-        SET current_credits = %s, bonus_credits = %s
-        WHERE user_id = %s
+        SET bonus_credits = bonus_credits - LAST_INSERT_ID(GREATEST(%s - GREATEST(current_credits, 0), 0)),
+            current_credits = GREATEST(current_credits - %s, 0)
+        WHERE user_id = %s AND GREATEST(current_credits, 0) + bonus_credits >= %s
         """
-
+        for attempt in range(2):
+            try:
+                with DB_QUERY_SECONDS.labels("reserve_credits").time():
+                    async with self.db.acquire() as conn:
+                        async with conn.cursor() as cursor:
+                            await cursor.execute(query, (cost, cost, username, cost))
+                            reserved, from_bonus = cursor.rowcount, cursor.lastrowid or 0
+                            await conn.commit()
+            except Exception as e:
+                print(f"Error reserving credits: {e}")
+                return None
+            if reserved:
+                return cost - from_bonus, from_bonus
+            if attempt:
+                return None
+            # Nothing updated: a new viewer without a row yet, or not enough credits
+            user_data = await self.load_user_data(username, subscription_level)
+            if user_data is None or user_data["current_credits"] + user_data.get("bonus_credits", 0) < cost:
+                return None
+
+    async def refund_credits(self, request, fired=0):
+        """Give back what a request reserved for the shots that were not fired"""
+        if request.free:
+            return
+        refund = max(0, request.shots - fired) * request.credits_per_shot
+        refund = min(refund, request.reserved_current + request.reserved_bonus)
+        if not refund:
+            return
+        # Bonus credits were spent last, so they come back first
+        bonus = min(refund, request.reserved_bonus)
+        current = refund - bonus
+        if self.credit_cache is not None:
+            self.credit_cache.add_credits(request.username, current, bonus)
+            return
         try:
+            await self.write_credit_changes([(current, bonus, request.username)])
+        except Exception as e:
+            print(f"Error refunding {refund} credits to {request.username}: {e}")
+
+    async def reset_daily_credits(self):
+        """
+        Refill the daily credits of every subscriber not reset yet today, in one
+        UPDATE. Running it again the same day touches nothing, and it agrees with
+        the reset_subscriber_credits event where that one is enabled.
+        Returns the number of subscribers refilled, None on error.
+        """
+        query = """
+        UPDATE subscribers s
+        JOIN subscription_levels sl ON s.subscription_level = sl.subscription_level
+        SET s.current_credits = sl.max_credits_per_day, s.last_reset_date = CURDATE()
+        WHERE s.last_reset_date < CURDATE()
+        """
+
+        async def run_reset():
             async with self.db.acquire() as conn:
                 async with conn.cursor() as cursor:
-                    await cursor.execute(query, (new_credits, new_bonus_credits, user_id))
-                    await conn.commit()  # Commit the transaction
-                    return True
+                    await cursor.execute(query)
+                    await conn.commit()
+                    rows = cursor.rowcount
+            if rows and self.credit_cache is not None:
+                self.credit_cache.invalidate()
+            return rows
+
+        start = time.perf_counter()
+        try:
+            with CREDIT_RESET_SECONDS.time():
+                if self.credit_cache is not None:
+                    # Spent credits not written yet must land before the refill, not after it
+                    rows = await self.credit_cache.exclusive(run_reset)
+                else:
+                    rows = await run_reset()
         except Exception as e:
-            print(f"Error updating user credits: {e}")
-            return False
+            print(f"Error resetting daily credits: {e}")
+            return None
+        CREDIT_RESET_ROWS.inc(rows)
+        if rows:
+            print(f"Daily credit reset: {rows} subscribers refilled in {time.perf_counter() - start:.3f}s")
+        return rows
+
+    async def _credit_reset_loop(self):
+        # Right away, to catch up after downtime, then every CREDIT_RESET_INTERVAL:
+        # the first run after midnight (database time) does the refill
+        while True:
+            await self.reset_daily_credits()
+            await asyncio.sleep(CREDIT_RESET_INTERVAL)
+
+    async def write_shot_history(self, rows):
+        """Insert a batch of ShotHistory rows"""
+        columns = ", ".join(SHOT_HISTORY_COLUMNS)
+        placeholders = ", ".join(["%s"] * len(SHOT_HISTORY_COLUMNS))
+        query = f"INSERT INTO shot_history ({columns}) VALUES ({placeholders})"
+        with DB_QUERY_SECONDS.labels("shot_history").time():
+            async with self.db.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.executemany(query, rows)
+                    await conn.commit()
+
+    async def write_credit_changes(self, changes):
+        """
+        Apply [(current_delta, bonus_delta, user_id), ...] from the credit cache.
+        aiomysql sends an UPDATE per row, so they run in one transaction: if any
+        fails none is kept, and the cache can retry all of them without applying
+        a delta twice.
+        """
+        query = """
+        UPDATE subscribers
+        SET current_credits = current_credits + %s, bonus_credits = bonus_credits + %s
+        WHERE user_id = %s
+        """
+        with DB_QUERY_SECONDS.labels("flush_credits").time():
+            async with self.db.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await conn.begin()
+                    try:
+                        await cursor.executemany(query, changes)
+                        await conn.commit()
+                    except BaseException:
+                        await conn.rollback()
+                        raise
 
     async def wp_update_user_credits(self, username, new_credits):
         try:
@@ -953,7 +1435,7 @@ class NerfGunBot(commands.Bot):
     async def set_gun_status(self, status: bool):
         """Set gun active status with synchronization"""
         async with self._gun_status_lock:
-            self.gun_config["gun_active"] = status
+            self.gun_config = MappingProxyType({**self.gun_config, "gun_active": status})
 
 
 async def main():
@@ -967,6 +1449,7 @@ async def main():
         if new_token:
             bot.token_manager.update_bot_token(bot)
             await bot.kill_watchdog()
+            await bot.stop_services()
             print("Token refreshed. Restarting bot...")
             bot = NerfGunBot(
                 tokmgr=bot.token_manager
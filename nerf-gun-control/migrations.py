@@ -0,0 +1,215 @@
+"""
+Schema migrations shared by the bot and the admin UI.
+
+The schema_version table records which migrations ran. When both programs
+start, they read MAX(version) from it, which is one query. If that is
+already LATEST there is nothing else to do. Otherwise they take a MySQL
+named lock and run the missing migrations in order. Each migration is
+recorded once it is done, so it runs exactly once per database, whichever
+program gets there first.
+
+A step can carry an `unless` query. The step is skipped when that query
+returns a non-zero count. This lets the first migrations adopt databases
+that were set up by hand or by the old startup probes.
+
+The migration logic is a generator of queries, so the same code serves
+aiomysql (migrate(pool) in the bot) and mysql.connector (migrate_sync(conn)
+in the admin UI).
+"""
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Step:
+    sql: str
+    # Skip the step when this query's first column is non-zero
+    unless: str = None
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    steps: tuple
+
+
+def _column_exists(table, column):
+    return (
+        "SELECT COUNT(*) FROM information_schema.columns WHERE table_schema = DATABASE() "
+        f"AND table_name = '{table}' AND column_name = '{column}'"
+    )
+
+
+def _index_on(table, column, unique=False):
+    """Counts the indexes of table that start with column (the unique ones only, if asked)"""
+    return (
+        "SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema = DATABASE() "
+        f"AND table_name = '{table}' AND column_name = '{column}' AND seq_in_index = 1"
+        + (" AND non_unique = 0" if unique else "")
+    )
+
+
+SYSTEM_CONFIG_DEFAULTS = {
+    "min_horizontal_angle": "0",
+    "max_horizontal_angle": "180",
+    "min_vertical_angle": "0",
+    "max_vertical_angle": "90",
+    "home_x": "90",
+    "home_y": "45",
+    "gun_active": "1",
+    "idle_timeout": "300",
+    "horizontal_offset": "-45",
+    "vertical_offset": "-60",
+    "config_version": "0",
+}
+
+MIGRATIONS = (
+    Migration(1, "subscribers.bonus_credits", (
+        Step(
+            "ALTER TABLE subscribers ADD COLUMN bonus_credits INT NOT NULL DEFAULT 0 AFTER current_credits",
+            unless=_column_exists("subscribers", "bonus_credits"),
+        ),
+    )),
+    Migration(2, "unique keys on subscribers.user_id and system_config.config_key", (
+        Step(
+            "ALTER TABLE subscribers ADD UNIQUE KEY uq_subscribers_user_id (user_id)",
+            unless=_index_on("subscribers", "user_id", unique=True),
+        ),
+        Step(
+            "ALTER TABLE system_config ADD UNIQUE KEY uq_system_config_key (config_key)",
+            unless=_index_on("system_config", "config_key", unique=True),
+        ),
+    )),
+    Migration(3, "index on subscribers.last_reset_date for the daily reset", (
+        Step(
+            "CREATE INDEX idx_last_reset_date ON subscribers (last_reset_date)",
+            unless=_index_on("subscribers", "last_reset_date"),
+        ),
+    )),
+    Migration(4, "system_config defaults", (
+        # Relies on the unique key of migration 2: rows already there keep their value
+        Step(
+            "INSERT IGNORE INTO system_config (config_key, config_value) VALUES "
+            + ", ".join(f"('{key}', '{value}')" for key, value in SYSTEM_CONFIG_DEFAULTS.items())
+        ),
+    )),
+    Migration(5, "shot_history table", (
+        Step("""
+        CREATE TABLE IF NOT EXISTS shot_history (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            fired_at DATETIME(3) NOT NULL,
+            user_id VARCHAR(50) NOT NULL,
+            channel VARCHAR(50),
+            x INT NOT NULL,
+            y INT NOT NULL,
+            shots_requested INT NOT NULL,
+            shots_fired INT NOT NULL,
+            credits_charged INT NOT NULL,
+            validate_ms INT,
+            queue_ms INT,
+            gun_ms INT,
+            total_ms INT,
+            INDEX idx_shot_history_fired_at (fired_at),
+            INDEX idx_shot_history_user (user_id, fired_at)
+        )
+        """),
+    )),
+)
+
+LATEST = MIGRATIONS[-1].version
+
+LOCK_NAME = "nerfbot_schema_migrations"
+LOCK_TIMEOUT = 30
+
+SELECT_VERSION = "SELECT MAX(version) FROM schema_version"
+CREATE_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INT PRIMARY KEY,
+    description VARCHAR(255) NOT NULL,
+    applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+INSERT_VERSION = "INSERT INTO schema_version (version, description) VALUES (%s, %s)"
+
+
+def _version(rows):
+    return (rows[0][0] if rows else None) or 0
+
+
+def _migrate(log):
+    """
+    Yields (query, params) and gets back the query's rows (an empty list for
+    statements). Driver errors are thrown back in. Returns the schema version.
+    """
+    try:
+        version = _version((yield SELECT_VERSION, None))
+    except Exception:
+        # No schema_version table yet
+        version = 0
+    if version >= LATEST:
+        return version
+
+    yield CREATE_VERSION_TABLE, None
+    rows = yield "SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT)
+    if not rows or rows[0][0] != 1:
+        raise RuntimeError("timed out waiting for another process to migrate the schema")
+    try:
+        # Someone else may have migrated while we waited for the lock
+        version = _version((yield SELECT_VERSION, None))
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+            log(f"Applying schema migration {migration.version}: {migration.description}")
+            for step in migration.steps:
+                if step.unless is not None:
+                    rows = yield step.unless, None
+                    if rows and rows[0][0]:
+                        continue
+                yield step.sql, None
+            yield INSERT_VERSION, (migration.version, migration.description)
+            yield "COMMIT", None
+            version = migration.version
+    except GeneratorExit:
+        raise
+    except BaseException:
+        yield "SELECT RELEASE_LOCK(%s)", (LOCK_NAME,)
+        raise
+    yield "SELECT RELEASE_LOCK(%s)", (LOCK_NAME,)
+    return version
+
+
+async def migrate(pool, log=print):
+    """Bring the schema up to LATEST through an aiomysql pool. Returns the version."""
+    steps = _migrate(log)
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            rows, error = None, None
+            try:
+                while True:
+                    query, params = steps.throw(error) if error is not None else steps.send(rows)
+                    rows, error = None, None
+                    try:
+                        await cursor.execute(query, params)
+                        rows = list(await cursor.fetchall()) if cursor.description else []
+                    except Exception as e:
+                        error = e
+            except StopIteration as done:
+                return done.value
+
+
+def migrate_sync(conn, log=print):
+    """Bring the schema up to LATEST through a DB-API connection. Returns the version."""
+    steps = _migrate(log)
+    with conn.cursor() as cursor:
+        rows, error = None, None
+        try:
+            while True:
+                query, params = steps.throw(error) if error is not None else steps.send(rows)
+                rows, error = None, None
+                try:
+                    cursor.execute(query, params)
+                    rows = list(cursor.fetchall()) if cursor.description else []
+                except Exception as e:
+                    error = e
+        except StopIteration as done:
+            return done.value
@@ -1,58 +1,255 @@
 from tkinter import NO
+import aiohttp
+import asyncio
+import contextlib
 import requests
+import threading
 import time
 import json
+from metrics import REGISTRY
+
+# Longest wait we ask the gun to hold a /status?wait_for=... request open
+LONG_POLL_MAX = 30
+# Extra client-side time on top of the long-poll wait before giving up on the request
+LONG_POLL_GRACE = 5
+# Per endpoint request timeouts, in seconds; a long-poll uses its wait time plus LONG_POLL_GRACE
+DEFAULT_TIMEOUTS = {"nerf": 5, "status": 2, "stop": 2}
+UNAVAILABLE_MESSAGE = "gun unavailable (circuit open)"
+
+GUN_REQUEST_SECONDS = REGISTRY.histogram(
+    "nerf_gun_request_seconds", "HTTP requests to the gun", ["endpoint", "result"]
+)
+GUN_UNAVAILABLE = REGISTRY.counter(
+    "nerf_gun_unavailable_total", "Calls failed fast because the circuit breaker was open"
+)
+GUN_BREAKER_TRANSITIONS = REGISTRY.counter(
+    "nerf_gun_breaker_transitions_total", "Circuit breaker state changes", ["state"]
+)
+
+
+def _parse_shots(response_json):
+    """Extract the number of shots the gun accepted from a /nerf response."""
+    rm = response_json.get("message", "shots:0")
+    rml = rm.split("shots:")
+    return int(rml[1]) if len(rml) > 1 else -1
+
+
+def _unavailable_status():
+    GUN_UNAVAILABLE.inc()
+    return {"status": "error", "message": UNAVAILABLE_MESSAGE, "shots": 0}
+
+
+@contextlib.contextmanager
+def _timed_request(endpoint):
+    """Observe the request time, labelled error if the block raises"""
+    start = time.perf_counter()
+    result = "error"
+    try:
+        yield
+        result = "ok"
+    finally:
+        GUN_REQUEST_SECONDS.labels(endpoint, result).observe(time.perf_counter() - start)
+
+
+def _is_gun_failure(error):
+    """
+    Whether an exception means the gun is down rather than just refusing this
+    command: a 4xx answer (429 while busy) still proves the gun is alive.
+    """
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return True
+
+
+class CircuitBreaker:
+    """
+    Tracks whether the gun is worth talking to.
+
+    closed: requests go through. failure_threshold failures in a row open it.
+    open: requests fail immediately, without touching the network.
+    half-open: a single probe is in flight; success closes the breaker, failure
+    opens it again. The controllers run the probe in the background.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=3, on_state_change=None):
+        self.failure_threshold = failure_threshold
+        # Called with the new state whenever it changes
+        self.on_state_change = on_state_change
+        self._state = self.CLOSED
+        self._failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow_request(self):
+        return self._state == self.CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            changed = self._set_state(self.CLOSED)
+        self._notify(changed)
+
+    def record_failure(self):
+        """Count a failure. Returns True if this failure opened the breaker."""
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                changed = self._set_state(self.OPEN)
+            else:
+                changed = False
+        self._notify(changed)
+        return changed
+
+    def half_open(self):
+        with self._lock:
+            changed = self._state == self.OPEN and self._set_state(self.HALF_OPEN)
+        self._notify(changed)
+
+    def _set_state(self, state):
+        changed = self._state != state
+        self._state = state
+        return changed
+
+    def _notify(self, changed):
+        if changed:
+            print(f"Gun circuit breaker {self._state}")
+            GUN_BREAKER_TRANSITIONS.labels(self._state).inc()
+            if self.on_state_change:
+                self.on_state_change(self._state)
 
 
 class NerfController:
-    def __init__(self, server_url):
+    def __init__(
+        self,
+        server_url,
+        long_poll=True,
+        timeouts=None,
+        failure_threshold=3,
+        reset_timeout=5,
+        on_state_change=None,
+    ):
         self.server_url = server_url.rstrip("/")  # Remove trailing slash if present
+        # Ask the gun to hold /status until it is idle instead of polling it
+        self.long_poll = long_poll
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.breaker = CircuitBreaker(failure_threshold, on_state_change)
+        # Seconds between background probes while the breaker is open
+        self.reset_timeout = reset_timeout
+        self._probe_thread = None
+
+    @property
+    def available(self):
+        return self.breaker.allow_request()
+
+    def _record_failure(self, error=None):
+        if error is not None and not _is_gun_failure(error):
+            return
+        if self.breaker.record_failure():
+            self._start_probe()
+
+    def _start_probe(self):
+        if self._probe_thread is None or not self._probe_thread.is_alive():
+            self._probe_thread = threading.Thread(target=self._probe_loop, daemon=True)
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        while self.breaker.state != CircuitBreaker.CLOSED:
+            time.sleep(self.reset_timeout)
+            self.breaker.half_open()
+            self._fetch_status()
 
     def fire(self, x=0, y=0, shot=1, wait=True):
+        if not self.breaker.allow_request():
+            return False, _unavailable_status()
+
         url = f"{self.server_url}/nerf"
         params = {"x": x, "y": y, "shot": shot}
         try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
+            with _timed_request("nerf"):
+                response = requests.get(url, params=params, timeout=self.timeouts["nerf"])
+                response.raise_for_status()
             print("Gun response: ", response.json())
             rr = response.json()
-            rm = rr.get("message", "shots:0")
-            rml = rm.split("shots:")
-            shots = int(rml[1]) if len(rml) > 1 else -1
+            shots = _parse_shots(rr)
 
             if wait:
                 ok, status = self.wait_until_idle(shots=shots)
                 return ok, status
+            self.breaker.record_success()
             return True, rr
         except Exception as e:
             print("Gun Error: ", e)
+            self._record_failure(e)
             return False, {"status": "error", "message": str(e), "shots": 0}
 
     def stop(self):
+        if not self.breaker.allow_request():
+            GUN_UNAVAILABLE.inc()
+            return f"Error: {UNAVAILABLE_MESSAGE}"
+
         url = f"{self.server_url}/stop"
         try:
-            response = requests.get(url)
-            response.raise_for_status()
+            with _timed_request("stop"):
+                response = requests.get(url, timeout=self.timeouts["stop"])
+                response.raise_for_status()
+            self.breaker.record_success()
             return response.text
         except Exception as e:
+            self._record_failure(e)
             return f"Error: {str(e)}"
 
-    def get_status(self):
+    def get_status(self, wait_for=None, timeout=LONG_POLL_MAX):
+        """
+        Return the gun status. With wait_for, the gun holds the request until it
+        reaches that state (or goes "ko"), for at most timeout seconds.
+        """
+        if not self.breaker.allow_request():
+            return _unavailable_status()
+        return self._fetch_status(wait_for, timeout)
+
+    def _fetch_status(self, wait_for=None, timeout=LONG_POLL_MAX):
         url = f"{self.server_url}/status"
         try:
-            print("Getting status")
-            response = requests.get(url)
-            response.raise_for_status()
-            print("Status: ", response.json())
-            return response.json()
+            with _timed_request("status_wait" if wait_for else "status"):
+                if wait_for:
+                    params = {"wait_for": wait_for, "timeout": timeout}
+                    response = requests.get(url, params=params, timeout=timeout + LONG_POLL_GRACE)
+                else:
+                    response = requests.get(url, timeout=self.timeouts["status"])
+                response.raise_for_status()
+                status = response.json()
+            print("Status: ", status)
+            if status.get("status") == "ko":
+                self._record_failure()
+            else:
+                self.breaker.record_success()
+            return status
         except Exception as e:
             print("Error getting status: ", e)
+            self._record_failure(e)
             return {"status": "error", "message": str(e)}
 
     def wait_until_idle(self, timeout=45, check_interval=0.05, shots=0):
+        # A gun that understands wait_for answers once, when the volley is over.
+        # One that ignores it answers right away and this degrades to polling.
         start_time = time.time()
         while time.time() - start_time < timeout:
-            status = self.get_status()
+            if self.long_poll:
+                remaining = timeout - (time.time() - start_time)
+                status = self.get_status(wait_for="idle", timeout=min(remaining, LONG_POLL_MAX))
+            else:
+                status = self.get_status()
             if status["status"] == "idle":
                 if not ("shots" in status):
                     status["shots"] = shots
@@ -69,6 +266,172 @@ class NerfController:
         return False, status
 
 
+class AsyncNerfController:
+    """
+    asyncio version of NerfController.
+
+    All requests go through one long-lived aiohttp session so the connection to
+    the gun is kept alive between calls, and waiting for the gun never blocks the
+    event loop. Call close() when done with the controller.
+    """
+
+    def __init__(
+        self,
+        server_url,
+        max_connections=4,
+        keepalive_timeout=60,
+        long_poll=True,
+        timeouts=None,
+        failure_threshold=3,
+        reset_timeout=5,
+        on_state_change=None,
+    ):
+        self.server_url = server_url.rstrip("/")  # Remove trailing slash if present
+        self.long_poll = long_poll
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.breaker = CircuitBreaker(failure_threshold, on_state_change)
+        self.reset_timeout = reset_timeout
+        self._session = None
+        self._probe_task = None
+
+    @property
+    def available(self):
+        return self.breaker.allow_request()
+
+    def _record_failure(self, error=None):
+        if error is not None and not _is_gun_failure(error):
+            return
+        if self.breaker.record_failure():
+            if self._probe_task is None or self._probe_task.done():
+                self._probe_task = asyncio.get_running_loop().create_task(self._probe_loop())
+
+    async def _probe_loop(self):
+        while self.breaker.state != CircuitBreaker.CLOSED:
+            await asyncio.sleep(self.reset_timeout)
+            self.breaker.half_open()
+            await self._fetch_status()
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections, keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def fire(self, x=0, y=0, shot=1, wait=True):
+        if not self.breaker.allow_request():
+            return False, _unavailable_status()
+
+        url = f"{self.server_url}/nerf"
+        params = {"x": x, "y": y, "shot": shot}
+        timeout = aiohttp.ClientTimeout(total=self.timeouts["nerf"])
+        try:
+            session = await self._get_session()
+            with _timed_request("nerf"):
+                async with session.get(url, params=params, timeout=timeout) as response:
+                    response.raise_for_status()
+                    rr = await response.json(content_type=None)
+            print("Gun response: ", rr)
+            shots = _parse_shots(rr)
+
+            if wait:
+                ok, status = await self.wait_until_idle(shots=shots)
+                return ok, status
+            self.breaker.record_success()
+            return True, rr
+        except Exception as e:
+            print("Gun Error: ", e)
+            self._record_failure(e)
+            return False, {"status": "error", "message": str(e), "shots": 0}
+
+    async def stop(self):
+        if not self.breaker.allow_request():
+            GUN_UNAVAILABLE.inc()
+            return f"Error: {UNAVAILABLE_MESSAGE}"
+
+        url = f"{self.server_url}/stop"
+        timeout = aiohttp.ClientTimeout(total=self.timeouts["stop"])
+        try:
+            session = await self._get_session()
+            with _timed_request("stop"):
+                async with session.get(url, timeout=timeout) as response:
+                    response.raise_for_status()
+                    text = await response.text()
+            self.breaker.record_success()
+            return text
+        except Exception as e:
+            self._record_failure(e)
+            return f"Error: {str(e)}"
+
+    async def get_status(self, wait_for=None, timeout=LONG_POLL_MAX):
+        """See NerfController.get_status"""
+        if not self.breaker.allow_request():
+            return _unavailable_status()
+        return await self._fetch_status(wait_for, timeout)
+
+    async def _fetch_status(self, wait_for=None, timeout=LONG_POLL_MAX):
+        url = f"{self.server_url}/status"
+        params = None
+        request_timeout = aiohttp.ClientTimeout(total=self.timeouts["status"])
+        if wait_for:
+            params = {"wait_for": wait_for, "timeout": timeout}
+            request_timeout = aiohttp.ClientTimeout(total=timeout + LONG_POLL_GRACE)
+        try:
+            session = await self._get_session()
+            with _timed_request("status_wait" if wait_for else "status"):
+                async with session.get(url, params=params, timeout=request_timeout) as response:
+                    response.raise_for_status()
+                    status = await response.json(content_type=None)
+            print("Status: ", status)
+            if status.get("status") == "ko":
+                self._record_failure()
+            else:
+                self.breaker.record_success()
+            return status
+        except Exception as e:
+            print("Error getting status: ", e)
+            self._record_failure(e)
+            return {"status": "error", "message": str(e)}
+
+    async def wait_until_idle(self, timeout=45, check_interval=0.05, shots=0):
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        status = {"status": "error", "message": "timeout", "shots": 0}
+        while loop.time() - start_time < timeout:
+            if self.long_poll:
+                remaining = timeout - (loop.time() - start_time)
+                status = await self.get_status(wait_for="idle", timeout=min(remaining, LONG_POLL_MAX))
+            else:
+                status = await self.get_status()
+            if status["status"] == "idle":
+                if not ("shots" in status):
+                    status["shots"] = shots
+                return True, status
+            elif status["status"] in ("ko", "error"):
+                if not ("shots" in status):
+                    status["shots"] = 0
+                return False, status
+            await asyncio.sleep(check_interval)
+        return False, status
+
+
 # Example usage
 if __name__ == "__main__":
     nerf = NerfController("http://localhost:5555")
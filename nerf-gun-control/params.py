@@ -25,10 +25,61 @@ DB_USER = None
 DB_PASSWORD = None
 DB_NAME = None
 DB_PORT = None
+DB_POOL_MIN_SIZE = None
+DB_POOL_MAX_SIZE = None
+DB_POOL_RECYCLE = None
+DB_POOL_ACQUIRE_TIMEOUT = None
+DB_CONNECT_TIMEOUT = None
+DB_STATEMENT_TIMEOUT = None
 
 # OBS Integration
 OBS_MESSAGE_LOG_FILE = None
 
+# Fire queue
+FIRE_QUEUE_MAX_PENDING = None
+FIRE_QUEUE_MAX_PER_USER = None
+FIRE_COALESCE_TOLERANCE = None
+FIRE_COALESCE_MAX_SHOTS = None
+FIRE_REORDER_WINDOW = None
+FIRE_MAX_REORDER = None
+
+# Metrics
+METRICS_HOST = None
+METRICS_PORT = None
+
+# Subscriber credit cache
+CREDIT_CACHE_SIZE = None
+CREDIT_CACHE_TTL = None
+CREDIT_FLUSH_INTERVAL = None
+CREDIT_FLUSH_THRESHOLD = None
+CREDIT_RESET_INTERVAL = None
+
+# Shot history
+SHOT_HISTORY_MAX_PENDING = None
+SHOT_HISTORY_BATCH_SIZE = None
+SHOT_HISTORY_FLUSH_INTERVAL = None
+
+# Twitch lookups
+FOLLOWER_CACHE_SIZE = None
+FOLLOWER_CACHE_TTL = None
+FOLLOWER_NEGATIVE_TTL = None
+FOLLOWER_SYNC_LIMIT = None
+EVENTSUB_ENABLED = None
+IDENTITY_CACHE_SIZE = None
+IDENTITY_CACHE_TTL = None
+HELIX_BATCH_DELAY = None
+HELIX_CONCURRENCY = None
+HELIX_BACKGROUND_RESERVE = None
+HELIX_MAX_RETRIES = None
+HELIX_RETRY_BACKOFF = None
+SUBSCRIPTION_CACHE_SIZE = None
+SUBSCRIPTION_CACHE_TTL = None
+SUBSCRIPTION_NEGATIVE_TTL = None
+
+# Config refresh
+CONFIG_REFRESH_INTERVAL = None
+LEVELS_REFRESH_INTERVAL = None
+
 
 # Configuration
 def load_vars():
@@ -38,7 +89,21 @@ def load_vars():
     global TWITCH_CLIENT_ID, TWITCH_SECRET
     global APP_ACCESS_TOKEN
     global DB_HOST, DB_USER, DB_PASSWORD, DB_NAME, DB_PORT
+    global DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_RECYCLE, DB_POOL_ACQUIRE_TIMEOUT
+    global DB_CONNECT_TIMEOUT, DB_STATEMENT_TIMEOUT
     global OBS_MESSAGE_LOG_FILE
+    global FIRE_QUEUE_MAX_PENDING, FIRE_QUEUE_MAX_PER_USER
+    global FIRE_COALESCE_TOLERANCE, FIRE_COALESCE_MAX_SHOTS
+    global FIRE_REORDER_WINDOW, FIRE_MAX_REORDER
+    global METRICS_HOST, METRICS_PORT
+    global CREDIT_CACHE_SIZE, CREDIT_CACHE_TTL, CREDIT_FLUSH_INTERVAL, CREDIT_FLUSH_THRESHOLD
+    global CREDIT_RESET_INTERVAL
+    global SHOT_HISTORY_MAX_PENDING, SHOT_HISTORY_BATCH_SIZE, SHOT_HISTORY_FLUSH_INTERVAL
+    global FOLLOWER_CACHE_SIZE, FOLLOWER_CACHE_TTL, FOLLOWER_NEGATIVE_TTL, FOLLOWER_SYNC_LIMIT
+    global EVENTSUB_ENABLED, IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL, HELIX_BATCH_DELAY
+    global HELIX_CONCURRENCY, HELIX_BACKGROUND_RESERVE, HELIX_MAX_RETRIES, HELIX_RETRY_BACKOFF
+    global SUBSCRIPTION_CACHE_SIZE, SUBSCRIPTION_CACHE_TTL, SUBSCRIPTION_NEGATIVE_TTL
+    global CONFIG_REFRESH_INTERVAL, LEVELS_REFRESH_INTERVAL
 
     dotenv.load_dotenv(override=True)
 
@@ -48,6 +113,16 @@ def load_vars():
     DB_NAME = os.getenv("DB_NAME")
     DB_PORT = int(os.getenv("DB_PORT", 3306))
     DB_NAME = os.getenv("DB_NAME")
+    # Connections opened (and checked) at startup, and the most open at once
+    DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+    DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+    # Seconds before a connection is reopened, well under the server's wait_timeout (0: never)
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+    # Seconds a query waits for a free connection before failing (0: no limit)
+    DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 5))
+    DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 5))
+    # Seconds a statement may run or wait for row locks (0: server defaults)
+    DB_STATEMENT_TIMEOUT = float(os.getenv("DB_STATEMENT_TIMEOUT", 5))
 
     WORDPRESS_API_URL = os.getenv("WORDPRESS_API_URL")
     NERF_CONTROLLER_URL = os.getenv("NERF_CONTROLLER_URL", "http://localhost:5555")
@@ -66,6 +141,64 @@ def load_vars():
     
     # OBS Integration
     OBS_MESSAGE_LOG_FILE = os.getenv('OBS_MESSAGE_LOG_FILE', '/Users/vadim/work/nerf/obs-messages.txt')
+
+    # Fire queue
+    FIRE_QUEUE_MAX_PENDING = int(os.getenv("FIRE_QUEUE_MAX_PENDING", 50))
+    FIRE_QUEUE_MAX_PER_USER = int(os.getenv("FIRE_QUEUE_MAX_PER_USER", 3))
+    # Merge queued commands aimed within this many degrees into one volley (negative: off)
+    FIRE_COALESCE_TOLERANCE = float(os.getenv("FIRE_COALESCE_TOLERANCE", -1))
+    FIRE_COALESCE_MAX_SHOTS = int(os.getenv("FIRE_COALESCE_MAX_SHOTS", 10))
+    # Serve the nearest of this many queued targets (1: fair order only)
+    FIRE_REORDER_WINDOW = int(os.getenv("FIRE_REORDER_WINDOW", 1))
+    FIRE_MAX_REORDER = int(os.getenv("FIRE_MAX_REORDER", 3))
+
+    # Metrics: Prometheus text on http://METRICS_HOST:METRICS_PORT/metrics (0: off)
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+
+    # Subscriber credit cache (CREDIT_CACHE_SIZE=0: read and write the DB on every command)
+    CREDIT_CACHE_SIZE = int(os.getenv("CREDIT_CACHE_SIZE", 1000))
+    # Seconds before an unchanged row is read again, to pick up admin edits and resets
+    CREDIT_CACHE_TTL = float(os.getenv("CREDIT_CACHE_TTL", 60))
+    CREDIT_FLUSH_INTERVAL = float(os.getenv("CREDIT_FLUSH_INTERVAL", 5))
+    CREDIT_FLUSH_THRESHOLD = int(os.getenv("CREDIT_FLUSH_THRESHOLD", 50))
+    # Seconds between runs of the daily credit reset; only the first run of a day refills (0: off)
+    CREDIT_RESET_INTERVAL = float(os.getenv("CREDIT_RESET_INTERVAL", 600))
+
+    # Shot history: rows wait in memory (at most MAX_PENDING, 0: off) and are inserted in batches
+    SHOT_HISTORY_MAX_PENDING = int(os.getenv("SHOT_HISTORY_MAX_PENDING", 10000))
+    SHOT_HISTORY_BATCH_SIZE = int(os.getenv("SHOT_HISTORY_BATCH_SIZE", 200))
+    SHOT_HISTORY_FLUSH_INTERVAL = float(os.getenv("SHOT_HISTORY_FLUSH_INTERVAL", 2))
+
+    # Follower status cache: followers are kept FOLLOWER_CACHE_TTL seconds, non-followers only
+    # FOLLOWER_NEGATIVE_TTL so a new follow counts quickly even without EventSub
+    FOLLOWER_CACHE_SIZE = int(os.getenv("FOLLOWER_CACHE_SIZE", 10000))
+    FOLLOWER_CACHE_TTL = float(os.getenv("FOLLOWER_CACHE_TTL", 3600))
+    FOLLOWER_NEGATIVE_TTL = float(os.getenv("FOLLOWER_NEGATIVE_TTL", 30))
+    # Newest followers loaded into the cache at startup (0: off)
+    FOLLOWER_SYNC_LIMIT = int(os.getenv("FOLLOWER_SYNC_LIMIT", 1000))
+    # Subscription tier cache; EventSub keeps it current, the TTLs bound staleness without it
+    SUBSCRIPTION_CACHE_SIZE = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", 10000))
+    SUBSCRIPTION_CACHE_TTL = float(os.getenv("SUBSCRIPTION_CACHE_TTL", 3600))
+    SUBSCRIPTION_NEGATIVE_TTL = float(os.getenv("SUBSCRIPTION_NEGATIVE_TTL", 300))
+    # EventSub websocket notifications (follows, subscriptions) keep the caches current (0: off)
+    EVENTSUB_ENABLED = os.getenv("EVENTSUB_ENABLED", "1") == "1"
+    # Login -> user id and profile, filled from chat tags and Helix as a fallback
+    IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", 10000))
+    IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", 86400))
+    # Seconds lookups wait for others to share one batched Helix call
+    HELIX_BATCH_DELAY = float(os.getenv("HELIX_BATCH_DELAY", 0.005))
+    # Helix calls in flight at once; rate limit points background syncs leave to !fire checks;
+    # retries of network errors and timeouts, after up to HELIX_RETRY_BACKOFF * 2^n seconds
+    HELIX_CONCURRENCY = int(os.getenv("HELIX_CONCURRENCY", 4))
+    HELIX_BACKGROUND_RESERVE = int(os.getenv("HELIX_BACKGROUND_RESERVE", 100))
+    HELIX_MAX_RETRIES = int(os.getenv("HELIX_MAX_RETRIES", 2))
+    HELIX_RETRY_BACKOFF = float(os.getenv("HELIX_RETRY_BACKOFF", 0.5))
+
+    # Seconds between checks of system_config's config_version, bumped by the admin tools (0: off)
+    CONFIG_REFRESH_INTERVAL = float(os.getenv("CONFIG_REFRESH_INTERVAL", 2))
+    # Seconds between checksums of subscription_levels, for edits made without the admin tools
+    LEVELS_REFRESH_INTERVAL = float(os.getenv("LEVELS_REFRESH_INTERVAL", 60))
     pass
 
 
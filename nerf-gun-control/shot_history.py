@@ -0,0 +1,109 @@
+import asyncio
+from collections import deque
+
+from metrics import REGISTRY
+
+HISTORY_ROWS = REGISTRY.counter(
+    "nerf_shot_history_rows_total", "Shot history rows by what happened to them", ["result"]
+)
+HISTORY_PENDING = REGISTRY.gauge("nerf_shot_history_pending", "Shot history rows waiting to be written")
+
+# Columns of the shot_history table, in the order the writer gets them
+COLUMNS = (
+    "fired_at",
+    "user_id",
+    "channel",
+    "x",
+    "y",
+    "shots_requested",
+    "shots_fired",
+    "credits_charged",
+    "validate_ms",
+    "queue_ms",
+    "gun_ms",
+    "total_ms",
+)
+
+
+class ShotHistory:
+    """
+    Write-behind log of fire commands for the shot_history table.
+
+    record() only appends to an in-memory queue and never waits, so the fire
+    path does not depend on the database. A background task hands the rows
+    to writer([row, ...]) in batches of up to batch_size, every flush_interval
+    seconds or as soon as a batch is full. Rows are tuples in COLUMNS order.
+
+    The queue holds at most max_pending rows: beyond that new rows are dropped
+    and counted, and so are rows of a failed batch that no longer fit back in.
+    """
+
+    def __init__(self, writer, max_pending=10000, batch_size=200, flush_interval=2):
+        self.writer = writer
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = deque()
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        HISTORY_PENDING.set_function(lambda: len(self._queue))
+
+    @property
+    def pending(self):
+        return len(self._queue)
+
+    def record(self, **values):
+        """Queue one row, given as column=value. Returns False if it was dropped."""
+        if len(self._queue) >= self.max_pending:
+            HISTORY_ROWS.labels("dropped").inc()
+            return False
+        self._queue.append(tuple(values.get(column) for column in COLUMNS))
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def flush(self):
+        """Write everything queued so far, batch by batch. Returns the number of rows written."""
+        written = 0
+        async with self._flush_lock:
+            while self._queue:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                try:
+                    await self.writer(batch)
+                except Exception as e:
+                    print(f"Error writing {len(batch)} shot history rows: {e}")
+                    HISTORY_ROWS.labels("failed").inc(len(batch))
+                    # Retried at the next flush, ahead of newer rows, as far as they fit
+                    room = max(self.max_pending - len(self._queue), 0)
+                    kept = batch[:room]
+                    self._queue.extendleft(reversed(kept))
+                    HISTORY_ROWS.labels("dropped").inc(len(batch) - len(kept))
+                    break
+                HISTORY_ROWS.labels("written").inc(len(batch))
+                written += len(batch)
+        return written
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and write what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
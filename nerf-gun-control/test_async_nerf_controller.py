@@ -0,0 +1,179 @@
+import os
+import sys
+import asyncio
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from nerf_controller import AsyncNerfController
+
+
+class FakeGun:
+    """Minimal gun server recording every request it receives."""
+
+    def __init__(self, busy_polls=2, shots=3, long_poll=False, ko=False):
+        self.busy_polls = busy_polls
+        self.ko = ko
+        self.shots = shots
+        self.long_poll = long_poll
+        self.requests = []
+        self.peers = set()
+
+    def _record(self, request):
+        self.requests.append((request.path, dict(request.query)))
+        self.peers.add(request.transport.get_extra_info("peername"))
+
+    async def nerf(self, request):
+        self._record(request)
+        return web.json_response({"message": f"Nerf activated shots:{request.query['shot']}"})
+
+    async def status(self, request):
+        self._record(request)
+        if self.ko:
+            return web.json_response({"status": "ko"})
+        if self.long_poll and request.query.get("wait_for") == "idle":
+            while self.busy_polls > 0:
+                await asyncio.sleep(0.01)
+                self.busy_polls -= 1
+        if self.busy_polls > 0:
+            self.busy_polls -= 1
+            return web.json_response({"status": "busy"})
+        return web.json_response({"status": "idle"})
+
+    async def stop(self, request):
+        self._record(request)
+        return web.Response(text="Nerf stopped")
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/nerf", self.nerf)
+        app.router.add_get("/status", self.status)
+        app.router.add_get("/stop", self.stop)
+        return app
+
+
+def run_with_gun(gun, body):
+    async def runner():
+        async with TestServer(gun.app()) as server:
+            async with AsyncNerfController(str(server.make_url("/"))) as controller:
+                return await body(controller)
+
+    return asyncio.run(runner())
+
+
+def test_fire_success_waits_for_idle():
+    gun = FakeGun(busy_polls=2)
+
+    async def body(controller):
+        return await controller.fire(x=10, y=20, shot=3, wait=True)
+
+    success, data = run_with_gun(gun, body)
+    assert success is True
+    assert data == {"status": "idle", "shots": 3}
+    assert gun.requests[0] == ("/nerf", {"x": "10", "y": "20", "shot": "3"})
+    assert [path for path, _ in gun.requests[1:]] == ["/status"] * 3
+
+
+def test_fire_waits_with_single_long_poll():
+    gun = FakeGun(busy_polls=5, long_poll=True)
+
+    async def body(controller):
+        return await controller.fire(x=10, y=20, shot=3, wait=True)
+
+    success, data = run_with_gun(gun, body)
+    assert success is True
+    assert data == {"status": "idle", "shots": 3}
+    status_requests = [query for path, query in gun.requests if path == "/status"]
+    assert len(status_requests) == 1
+    assert status_requests[0]["wait_for"] == "idle"
+
+
+def test_fire_without_wait_returns_gun_response():
+    gun = FakeGun()
+
+    async def body(controller):
+        return await controller.fire(x=1, y=2, shot=1, wait=False)
+
+    success, data = run_with_gun(gun, body)
+    assert success is True
+    assert data == {"message": "Nerf activated shots:1"}
+    assert len(gun.requests) == 1
+
+
+def test_fire_error():
+    async def body():
+        async with AsyncNerfController("http://127.0.0.1:1") as controller:
+            return await controller.fire(x=10, y=20, shot=3)
+
+    success, data = asyncio.run(body())
+    assert success is False
+    assert data["status"] == "error"
+    assert data["shots"] == 0
+
+
+def test_stop_and_status():
+    gun = FakeGun(busy_polls=0)
+
+    async def body(controller):
+        return await controller.stop(), await controller.get_status()
+
+    stopped, status = run_with_gun(gun, body)
+    assert stopped == "Nerf stopped"
+    assert status == {"status": "idle"}
+
+
+def test_wait_until_idle_timeout():
+    gun = FakeGun(busy_polls=1000)
+
+    async def body(controller):
+        return await controller.wait_until_idle(timeout=0.3, check_interval=0.05)
+
+    success, status = run_with_gun(gun, body)
+    assert success is False
+    assert status["status"] == "busy"
+
+
+def test_session_is_reused_across_calls():
+    gun = FakeGun(busy_polls=0)
+
+    async def body(controller):
+        await controller.get_status()
+        session = controller._session
+        await controller.fire(x=0, y=0, shot=1)
+        await controller.stop()
+        return session is controller._session
+
+    assert run_with_gun(gun, body) is True
+    # keep-alive: every request went over the same connection
+    assert len(gun.peers) == 1
+
+
+def test_breaker_fails_fast_and_recovers():
+    gun = FakeGun(busy_polls=0, ko=True)
+
+    async def body(controller):
+        controller.breaker.failure_threshold = 2
+        controller.reset_timeout = 0.05
+        await controller.get_status()
+        await controller.get_status()
+        assert not controller.available
+
+        calls = len(gun.requests)
+        success, data = await controller.fire(x=1, y=1, shot=1)
+        assert success is False
+        assert data["message"] == "gun unavailable (circuit open)"
+        assert len(gun.requests) == calls
+
+        gun.ko = False
+        for _ in range(100):
+            if controller.available:
+                break
+            await asyncio.sleep(0.01)
+        return controller.available
+
+    assert run_with_gun(gun, body) is True
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
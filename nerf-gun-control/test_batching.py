@@ -0,0 +1,73 @@
+import os
+import sys
+import asyncio
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from batching import MicroBatcher
+
+
+class Fetcher:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    async def __call__(self, keys):
+        self.calls.append(sorted(keys))
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("Helix is down")
+        return {key: key.upper() for key in keys if key != "nobody"}
+
+
+def test_concurrent_lookups_share_one_call():
+    async def scenario():
+        fetch = Fetcher()
+        batcher = MicroBatcher(fetch, delay=0.01)
+        results = await asyncio.gather(*(batcher.get(key) for key in ["a", "b", "a", "nobody"]))
+        assert results == ["A", "B", "A", None]
+        assert fetch.calls == [["a", "b", "nobody"]]
+
+    asyncio.run(scenario())
+
+
+def test_batches_are_capped():
+    async def scenario():
+        fetch = Fetcher()
+        batcher = MicroBatcher(fetch, max_batch=2, delay=0.01)
+        await asyncio.gather(*(batcher.get(key) for key in "abcde"))
+        assert [len(call) for call in fetch.calls] == [2, 2, 1]
+
+    asyncio.run(scenario())
+
+
+def test_in_flight_keys_are_not_fetched_twice():
+    async def scenario():
+        release = asyncio.Event()
+        calls = []
+
+        async def fetch(keys):
+            calls.append(keys)
+            await release.wait()
+            return {key: key.upper() for key in keys}
+
+        batcher = MicroBatcher(fetch, delay=0)
+        first = asyncio.ensure_future(batcher.get("a"))
+        while not calls:
+            await asyncio.sleep(0.001)
+        # "a" is being fetched now: this waits for the same result
+        second = asyncio.ensure_future(batcher.get("a"))
+        await asyncio.sleep(0.001)
+        release.set()
+        assert await first == await second == "A"
+        assert calls == [["a"]]
+
+    asyncio.run(scenario())
+
+
+def test_errors_reach_every_waiter():
+    async def scenario():
+        batcher = MicroBatcher(Fetcher(fail=True), delay=0.01)
+        results = await asyncio.gather(batcher.get("a"), batcher.get("b"), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    asyncio.run(scenario())
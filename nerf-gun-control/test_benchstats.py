@@ -0,0 +1,37 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from benchstats import format_histogram, histogram, percentile, summarize
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) is None
+
+
+def test_summarize():
+    stats = summarize([0.1, 0.2, 0.3, 0.4])
+    assert stats["count"] == 4
+    assert stats["mean"] == pytest.approx(0.25)
+    assert stats["p50"] == 0.2
+    assert stats["max"] == 0.4
+    assert summarize([])["p99"] is None
+
+
+def test_histogram():
+    buckets = histogram([0.001, 0.02, 0.02, 0.3, 20], buckets=[0.01, 0.1, 1])
+    assert buckets == [(0.01, 1), (0.1, 2), (1, 1), (None, 1)]
+    lines = format_histogram(buckets, width=10)
+    assert len(lines) == 4
+    assert lines[1].endswith("#" * 10)
+    assert format_histogram(histogram([])) == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
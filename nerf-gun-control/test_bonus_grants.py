@@ -0,0 +1,71 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from bonus_grants import (
+    MAX_MESSAGE_LENGTH,
+    applicable_grants,
+    format_results,
+    grant_results,
+    grant_rows,
+    parse_chat_grants,
+    parse_csv_grants,
+)
+
+
+def test_chat_single_user_form():
+    assert parse_chat_grants(["@Alice", "50"]) == ({"alice": 50}, [])
+
+
+def test_chat_bulk_form_merges_duplicates_and_skips_bad_names():
+    grants, invalid = parse_chat_grants(["10", "alice", "bob", "ALICE", "not-a-user"])
+    assert grants == {"alice": 20, "bob": 10}
+    assert invalid == ["not-a-user"]
+
+
+def test_chat_single_user_form_takes_credits_back():
+    assert parse_chat_grants(["alice", "-5"]) == ({"alice": -5}, [])
+    assert parse_chat_grants(["alice", "0"]) == ({}, ["alice"])
+
+
+def test_chat_bulk_form_rejects_non_positive_amounts_and_bad_usage():
+    assert parse_chat_grants(["-5", "alice", "bob"]) == ({}, ["alice", "bob"])
+    assert parse_csv_grants("alice,-5\n") == ({}, ["alice"])
+    with pytest.raises(ValueError):
+        parse_chat_grants(["alice"])
+    with pytest.raises(ValueError):
+        parse_chat_grants(["alice", "bob", "carol"])
+
+
+def test_csv_skips_header_and_reports_bad_lines():
+    text = "user,amount\nalice,10\n\n@Bob, 5\ncarol,lots\nalice,1\n"
+    grants, invalid = parse_csv_grants(text)
+    assert grants == {"alice": 11, "bob": 5}
+    assert invalid == ["carol,lots"]
+
+
+def test_rows_and_results():
+    grants = {"alice": 10, "bob": 5}
+    assert grant_rows(grants, 5, "2024-01-01") == [
+        ("alice", 0, 5, 10, "2024-01-01", "2024-01-01"),
+        ("bob", 0, 5, 5, "2024-01-01", "2024-01-01"),
+    ]
+    assert grant_results(grants, {"alice": 3}) == [("alice", 10, 13, False), ("bob", 5, 5, True)]
+
+
+def test_taking_back_needs_a_row_and_stops_at_zero():
+    grants = {"alice": -10, "bob": -10, "carol": 5}
+    assert applicable_grants(grants, {"alice": 3}) == {"alice": -10, "carol": 5}
+    assert grant_results({"alice": -10}, {"alice": 3}) == [("alice", -10, 0, False)]
+    assert format_results([("alice", -10, 0, False)]) == ["Added bonus credits to 1 user: alice -10 (now 0)"]
+
+
+def test_messages_fit_in_chat():
+    results = [(f"viewer{i:03}", 10, 10, True) for i in range(100)]
+    messages = format_results(results, ["bad!"])
+    assert len(messages) > 1
+    assert all(len(message) <= MAX_MESSAGE_LENGTH for message in messages)
+    assert messages[0].startswith("Added bonus credits to 100 users: viewer000 +10 (new, now 10)")
+    assert messages[-1].endswith("skipped: bad!")
+    assert format_results([], ["bad!"]) == ["No bonus credits added, skipped: bad!"]
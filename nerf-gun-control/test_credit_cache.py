@@ -0,0 +1,213 @@
+import os
+import sys
+import asyncio
+import pytest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from credit_cache import CreditCache
+
+
+class FakeTable:
+    """subscribers table: counts loads and applies the batches the cache writes"""
+
+    def __init__(self, **credits):
+        self.rows = {user: {"user_id": user, "current_credits": c, "bonus_credits": 0} for user, c in credits.items()}
+        self.loads = 0
+        self.batches = []
+        self.fail = False
+        self.load_delay = 0
+
+    async def load(self, user_id, level=0):
+        self.loads += 1
+        await asyncio.sleep(self.load_delay)
+        row = self.rows.get(user_id)
+        return dict(row) if row else None
+
+    async def write(self, changes):
+        if self.fail:
+            raise RuntimeError("db down")
+        self.batches.append(changes)
+        for current_delta, bonus_delta, user_id in changes:
+            self.rows[user_id]["current_credits"] += current_delta
+            self.rows[user_id]["bonus_credits"] += bonus_delta
+
+
+def test_loads_once_and_serves_from_memory():
+    table = FakeTable(a=10)
+
+    async def body():
+        cache = CreditCache(table.load, table.write)
+        rows = await asyncio.gather(*(cache.get("a") for _ in range(5)))
+        await cache.get("a")
+        return rows
+
+    rows = asyncio.run(body())
+    assert table.loads == 1
+    assert all(row["current_credits"] == 10 for row in rows)
+
+
+def test_changes_are_batched_and_relative():
+    table = FakeTable(a=10, b=10)
+
+    async def body():
+        cache = CreditCache(table.load, table.write)
+        await cache.get("a")
+        cache.add_credits("a", -2, 0)
+        cache.add_credits("a", -3, -1)
+        cache.add_credits("b", -1, 0)
+        assert (await cache.get("a"))["current_credits"] == 5
+        # someone else gives a bonus directly in the database meanwhile
+        table.rows["a"]["bonus_credits"] += 20
+        assert table.batches == []
+        assert await cache.flush() == 2
+
+    asyncio.run(body())
+    assert table.batches == [[(-5, -1, "a"), (-1, 0, "b")]]
+    assert table.rows["a"] == {"user_id": "a", "current_credits": 5, "bonus_credits": 19}
+    assert table.rows["b"]["current_credits"] == 9
+
+
+def test_concurrent_reservations_cannot_overspend():
+    table = FakeTable(a=10)
+    table.rows["a"]["bonus_credits"] = 5
+    table.load_delay = 0.01
+
+    async def body():
+        cache = CreditCache(table.load, table.write)
+        results = await asyncio.gather(*(cache.reserve("a", 4) for _ in range(5)))
+        await cache.flush()
+        return results
+
+    results = asyncio.run(body())
+    assert results == [(4, 0), (4, 0), (2, 2), None, None]
+    assert table.rows["a"]["current_credits"] == 0
+    assert table.rows["a"]["bonus_credits"] == 3
+
+
+def test_exclusive_flushes_first_and_holds_off_flushes():
+    table = FakeTable(a=10)
+
+    async def body():
+        cache = CreditCache(table.load, table.write)
+        await cache.reserve("a", 4)
+        order = []
+
+        async def reset():
+            order.append(("reset", table.rows["a"]["current_credits"]))
+            cache.add_credits("a", -1, 0)
+            # a flush asked for meanwhile waits for the reset
+            flush = asyncio.ensure_future(cache.flush())
+            await asyncio.sleep(0.01)
+            order.append(("flushed meanwhile", flush.done()))
+            table.rows["a"]["current_credits"] = 100
+            return flush
+
+        flush = await cache.exclusive(reset)
+        await flush
+        return order
+
+    order = asyncio.run(body())
+    assert order == [("reset", 6), ("flushed meanwhile", False)]
+    assert table.rows["a"]["current_credits"] == 99
+
+
+def test_exclusive_refuses_to_run_with_unwritten_changes():
+    table = FakeTable(a=10)
+    table.fail = True
+    ran = []
+
+    async def body():
+        cache = CreditCache(table.load, table.write)
+        cache.add_credits("a", -1, 0)
+        with pytest.raises(RuntimeError):
+            await cache.exclusive(lambda: ran.append(1))
+        assert cache.pending == 1
+
+    asyncio.run(body())
+    assert ran == []
+
+
+def test_threshold_and_stop_flush():
+    table = FakeTable(a=10, b=10, c=10)
+
+    async def body():
+        cache = CreditCache(table.load, table.write, flush_interval=60, flush_threshold=2)
+        cache.start()
+        cache.add_credits("a", -1, 0)
+        await asyncio.sleep(0.01)
+        assert table.batches == []
+        cache.add_credits("b", -1, 0)
+        await asyncio.sleep(0.01)
+        assert len(table.batches) == 1
+        cache.add_credits("c", -1, 0)
+        await cache.stop()
+
+    asyncio.run(body())
+    assert [len(batch) for batch in table.batches] == [2, 1]
+
+
+def test_failed_flush_keeps_the_changes():
+    table = FakeTable(a=10)
+
+    async def body():
+        cache = CreditCache(table.load, table.write)
+        cache.add_credits("a", -4, 0)
+        table.fail = True
+        assert await cache.flush() == 0
+        assert cache.pending == 1
+        table.fail = False
+        cache.add_credits("a", -1, 0)
+        assert await cache.flush() == 1
+
+    asyncio.run(body())
+    assert table.rows["a"]["current_credits"] == 5
+
+
+def test_lru_eviction_and_reload_keep_pending_changes():
+    table = FakeTable(a=10, b=10, c=10)
+
+    async def body():
+        cache = CreditCache(table.load, table.write, max_entries=2)
+        await cache.get("a")
+        cache.add_credits("a", -3, 0)
+        await cache.get("b")
+        await cache.get("c")
+        assert len(cache) == 2
+        # "a" was evicted: reloaded from the DB with its unflushed change on top
+        assert (await cache.get("a"))["current_credits"] == 7
+        cache.invalidate("a")
+        assert (await cache.get("a"))["current_credits"] == 7
+
+    asyncio.run(body())
+    assert table.loads == 5
+
+
+def test_expired_rows_are_reloaded():
+    table = FakeTable(a=10)
+
+    async def body():
+        cache = CreditCache(table.load, table.write, ttl=0)
+        await cache.get("a")
+        table.rows["a"]["current_credits"] = 100  # daily reset
+        return await cache.get("a")
+
+    assert asyncio.run(body())["current_credits"] == 100
+
+
+def test_load_racing_a_flush_is_not_double_counted():
+    table = FakeTable(a=10)
+    table.load_delay = 0.02
+
+    async def body():
+        cache = CreditCache(table.load, table.write)
+        cache.add_credits("a", -4, 0)
+        load = asyncio.ensure_future(cache.get("a"))
+        await asyncio.sleep(0.005)
+        await cache.flush()
+        return await load
+
+    assert asyncio.run(body())["current_credits"] == 6
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
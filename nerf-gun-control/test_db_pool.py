@@ -0,0 +1,108 @@
+import os
+import sys
+import asyncio
+import pytest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from db_pool import POOL_EXHAUSTED, POOL_TIMEOUTS, InstrumentedPool
+
+
+class Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, query, args=None):
+        self.conn.queries.append(query)
+
+    async def fetchall(self):
+        return [(1,)]
+
+
+class Connection:
+    def __init__(self):
+        self.queries = []
+
+    def cursor(self):
+        return Cursor(self)
+
+
+class Pool:
+    """A pool of maxsize connections, handed out by acquire() like aiomysql's"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.size = maxsize
+        self.free = [Connection() for _ in range(maxsize)]
+        self.available = asyncio.Semaphore(maxsize)
+
+    @property
+    def freesize(self):
+        return len(self.free)
+
+    def acquire(self):
+        return Acquire(self)
+
+
+class Acquire:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        await self.pool.available.acquire()
+        self.conn = self.pool.free.pop()
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        self.pool.free.append(self.conn)
+        self.pool.available.release()
+        return False
+
+
+def test_tracks_connections_in_use():
+    async def scenario():
+        pool = InstrumentedPool(Pool(2))
+        async with pool.acquire() as first:
+            assert pool.in_use == 1
+            async with pool.acquire() as second:
+                assert first is not second
+                assert pool.in_use == 2
+        assert pool.in_use == 0
+        # Attributes of the wrapped pool are passed through
+        assert pool.freesize == 2
+
+    asyncio.run(scenario())
+
+
+def test_counts_exhaustion_and_times_out():
+    async def scenario():
+        pool = InstrumentedPool(Pool(1), acquire_timeout=0.01)
+        exhausted = POOL_EXHAUSTED._unlabelled().value
+        timeouts = POOL_TIMEOUTS._unlabelled().value
+        async with pool.acquire():
+            with pytest.raises(asyncio.TimeoutError):
+                async with pool.acquire():
+                    pass
+        assert POOL_EXHAUSTED._unlabelled().value == exhausted + 1
+        assert POOL_TIMEOUTS._unlabelled().value == timeouts + 1
+        assert pool.in_use == 0
+        # The pool still works afterwards
+        async with pool.acquire():
+            pass
+
+    asyncio.run(scenario())
+
+
+def test_warm_up_opens_and_checks_connections():
+    async def scenario():
+        raw = Pool(3)
+        pool = InstrumentedPool(raw)
+        await pool.warm_up(3)
+        assert [conn.queries for conn in raw.free] == [["SELECT 1"]] * 3
+
+    asyncio.run(scenario())
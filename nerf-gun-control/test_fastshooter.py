@@ -0,0 +1,61 @@
+import os
+import sys
+import threading
+import pytest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "nerf-gun-simluator"))
+from fastshooter import DISTRIBUTIONS, benchmark, make_targets, parse_args
+from simulator import GunModel, make_server
+
+BOUNDS = (-45, 45, 0, 60)
+
+
+@pytest.mark.parametrize("distribution", DISTRIBUTIONS)
+def test_targets_stay_in_bounds(distribution):
+    targets = make_targets(distribution, 50, BOUNDS, seed=3)
+    assert len(targets) == 50
+    assert all(-45 <= x <= 45 and 0 <= y <= 60 for x, y in targets)
+    assert targets == make_targets(distribution, 50, BOUNDS, seed=3)
+
+
+def test_sweep_covers_the_range_in_rows():
+    targets = make_targets("sweep", 9, BOUNDS)
+    assert targets[:3] == [(-45, 0), (0, 0), (45, 0)]
+    # every other row goes back the other way
+    assert targets[3:6] == [(45, 30), (0, 30), (-45, 30)]
+    assert targets[-1] == (45, 60)
+
+
+def test_clustered_targets_are_close_together():
+    targets = make_targets("clustered", 100, BOUNDS, seed=1, clusters=1, spread=2)
+    xs = [x for x, _ in targets]
+    assert max(xs) - min(xs) < 20
+
+
+@pytest.fixture
+def gun_url():
+    gun = GunModel(slew_rate=100000, settle_time=0, shot_cycle=0.001, seed=1)
+    httpd = make_server(0, gun, quiet=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.mark.parametrize("controller", ["sync", "async"])
+def test_benchmark_against_simulator(gun_url, controller):
+    args = parse_args(["--url", gun_url, "-n", "5", "--shots", "2", "--controller", controller, "--seed", "1"])
+    results = benchmark(args)
+
+    assert results["ok"] == 5
+    assert results["shots"] == 10
+    assert results["shots_per_sec"] > 0
+    # long-poll: a single /status request per volley
+    assert results["status_polls"] == 5
+    assert sum(bucket["count"] for bucket in results["histogram"]) == 5
+    assert results["gun_stats"]["volleys"] == 5
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
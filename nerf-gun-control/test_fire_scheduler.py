@@ -0,0 +1,239 @@
+import os
+import sys
+import asyncio
+import random
+import pytest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from fire_scheduler import FireScheduler, FireRequest, split_shots, travel
+
+
+async def noop(request):
+    pass
+
+
+def make_request(username, shots=1, level=0, x=0, y=0):
+    return FireRequest(username=username, x=x, y=y, shots=shots, subscription_level=level)
+
+
+def drain(scheduler):
+    order = []
+    while scheduler.depth:
+        order.append(scheduler._pop_next().username)
+    return order
+
+
+def test_spammer_does_not_starve_others():
+    scheduler = FireScheduler(noop, max_pending=10, max_per_user=5)
+    for _ in range(3):
+        assert scheduler.submit(make_request("spammer"))
+    assert scheduler.submit(make_request("viewer"))
+
+    assert drain(scheduler) == ["spammer", "viewer", "spammer", "spammer"]
+
+
+def test_higher_levels_get_larger_share():
+    scheduler = FireScheduler(noop, max_pending=20, max_per_user=10)
+    for _ in range(4):
+        scheduler.submit(make_request("tier0", level=0))
+        scheduler.submit(make_request("tier3", level=3))
+
+    order = drain(scheduler)
+    # tier 3 weighs 4x tier 0: all of its requests go before tier 0's second one
+    assert order[:5].count("tier3") == 4
+
+
+def test_shots_count_against_the_share():
+    scheduler = FireScheduler(noop, max_pending=10, max_per_user=5)
+    scheduler.submit(make_request("big", shots=5))
+    scheduler.submit(make_request("small", shots=1))
+    scheduler.submit(make_request("small", shots=1))
+
+    assert drain(scheduler) == ["small", "small", "big"]
+
+
+def test_rejects_when_full():
+    scheduler = FireScheduler(noop, max_pending=3, max_per_user=2)
+    assert scheduler.submit(make_request("a"))
+    assert scheduler.submit(make_request("a"))
+    assert not scheduler.submit(make_request("a"))
+    assert scheduler.submit(make_request("b"))
+    assert not scheduler.can_accept("c")
+    assert not scheduler.submit(make_request("c"))
+    assert scheduler.depth == 3
+    assert scheduler.user_depth("a") == 2
+
+
+def test_drain_empties_the_queue():
+    scheduler = FireScheduler(noop, max_pending=10, max_per_user=5)
+    scheduler.submit(make_request("a"))
+    scheduler.submit(make_request("a"))
+    scheduler.submit(make_request("b"))
+
+    assert [r.username for r in scheduler.drain()] == ["a", "b", "a"]
+    assert scheduler.depth == 0
+    assert scheduler.user_depth("a") == 0
+    assert scheduler.submit(make_request("a"))
+
+
+def test_worker_serves_requests_one_at_a_time():
+    served = []
+    running = []
+
+    async def handler(batch):
+        running.append(batch)
+        assert len(running) == 1
+        await asyncio.sleep(0.01)
+        served.extend(request.username for request in batch)
+        running.pop()
+
+    async def body():
+        scheduler = FireScheduler(handler, max_pending=10, max_per_user=5)
+        scheduler.start()
+        for name in ["a", "a", "b"]:
+            scheduler.submit(make_request(name))
+        while len(served) < 3:
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(body())
+    assert served == ["a", "b", "a"]
+    assert scheduler.depth == 0
+
+
+def test_worker_survives_handler_errors():
+    served = []
+
+    async def handler(batch):
+        if batch[0].username == "bad":
+            raise RuntimeError("boom")
+        served.append(batch[0].username)
+
+    async def body():
+        scheduler = FireScheduler(handler)
+        scheduler.start()
+        scheduler.submit(make_request("bad"))
+        scheduler.submit(make_request("good"))
+        while not served:
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+
+    asyncio.run(body())
+    assert served == ["good"]
+
+
+def test_coalescing_is_off_by_default():
+    scheduler = FireScheduler(noop)
+    scheduler.submit(make_request("a", x=10, y=10))
+    scheduler.submit(make_request("b", x=10, y=10))
+
+    assert len(scheduler._coalesce(scheduler._pop_next())) == 1
+    assert scheduler.depth == 1
+
+
+def test_coalesces_nearby_targets_of_other_users():
+    scheduler = FireScheduler(noop, coalesce_tolerance=3, coalesce_max_shots=10)
+    scheduler.submit(make_request("a", shots=1, x=10, y=10))
+    scheduler.submit(make_request("a", shots=1, x=10, y=10))
+    scheduler.submit(make_request("b", shots=3, x=12, y=11))
+    scheduler.submit(make_request("c", shots=1, x=30, y=10))
+    scheduler.submit(make_request("d", shots=1, x=8, y=8))
+
+    batch = scheduler._coalesce(scheduler._pop_next())
+    # taken in fair-queuing order: d (1 shot) is due before b (3 shots)
+    assert [r.username for r in batch] == ["a", "d", "b"]
+    # a's second request and the far away one stay queued
+    assert drain(scheduler) == ["c", "a"]
+
+
+def test_coalescing_respects_max_shots():
+    scheduler = FireScheduler(noop, coalesce_tolerance=5, coalesce_max_shots=4)
+    scheduler.submit(make_request("a", shots=2))
+    scheduler.submit(make_request("b", shots=3))
+    scheduler.submit(make_request("c", shots=2))
+
+    batch = scheduler._coalesce(scheduler._pop_next())
+    assert [r.username for r in batch] == ["a", "c"]
+
+
+def serve_all(scheduler):
+    """Pop everything the way the worker does, tracking where the gun is aimed"""
+    served = []
+    while scheduler.depth:
+        request = scheduler._pop_next()
+        scheduler.position = (request.x, request.y)
+        served.append(request)
+    return served
+
+
+def test_reorder_serves_nearest_target():
+    scheduler = FireScheduler(noop, reorder_window=3, max_reorder=5)
+    scheduler.note_position(0, 0)
+    scheduler.submit(make_request("far", x=40, y=40))
+    scheduler.submit(make_request("mid", x=20, y=20))
+    scheduler.submit(make_request("near", x=1, y=1))
+
+    served = serve_all(scheduler)
+    assert [r.username for r in served] == ["near", "mid", "far"]
+    assert served[2].overtaken == 2
+
+
+def test_reorder_window_of_one_keeps_fair_order():
+    scheduler = FireScheduler(noop, reorder_window=1)
+    scheduler.note_position(0, 0)
+    scheduler.submit(make_request("far", x=40, y=40))
+    scheduler.submit(make_request("near", x=1, y=1))
+
+    assert [r.username for r in serve_all(scheduler)] == ["far", "near"]
+
+
+def test_reorder_is_bounded():
+    scheduler = FireScheduler(noop, max_pending=50, max_per_user=50, reorder_window=4, max_reorder=2)
+    scheduler.note_position(0, 0)
+    scheduler.submit(make_request("victim", x=45, y=60))
+    for i in range(10):
+        scheduler.submit(make_request(f"near{i}", x=0, y=i % 2))
+
+    served = serve_all(scheduler)
+    position = [r.username for r in served].index("victim")
+    assert position == 2
+    assert all(r.overtaken <= 2 for r in served)
+
+
+def test_reorder_reduces_travel():
+    rng = random.Random(1234)
+    targets = [(rng.randint(-45, 45), rng.randint(0, 60)) for _ in range(30)]
+
+    def run(window):
+        scheduler = FireScheduler(noop, max_pending=100, reorder_window=window, max_reorder=4)
+        scheduler.note_position(0, 0)
+        for i, (x, y) in enumerate(targets):
+            scheduler.submit(make_request(f"user{i}", x=x, y=y))
+        return travel((0, 0), [(r.x, r.y) for r in serve_all(scheduler)])
+
+    fifo = run(1)
+    reordered = run(5)
+    assert reordered < fifo * 0.75
+
+
+@pytest.mark.parametrize(
+    "fired, requested, expected",
+    [
+        (6, [3, 2, 1], [3, 2, 1]),
+        (9, [3, 2, 1], [3, 2, 1]),
+        (0, [3, 2, 1], [0, 0, 0]),
+        (-1, [3, 2], [0, 0]),
+        (3, [3, 2, 1], [2, 1, 0]),
+        (2, [1, 1, 1], [1, 1, 0]),
+        (5, [5, 5], [3, 2]),
+    ],
+)
+def test_split_shots(fired, requested, expected):
+    shares = split_shots(fired, requested)
+    assert shares == expected
+    assert sum(shares) == max(0, min(fired, sum(requested)))
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,167 @@
+import os
+import sys
+import asyncio
+import time
+import aiohttp
+import pytest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from helix_client import BACKGROUND, INTERACTIVE, HelixClient, is_retryable
+from metrics import REGISTRY
+from twitchio.errors import HTTPException
+
+
+def test_interactive_calls_go_before_queued_background_calls():
+    async def scenario():
+        client = HelixClient(concurrency=1)
+        gate = asyncio.Event()
+        order = []
+
+        async def blocker():
+            await gate.wait()
+
+        async def record(name):
+            order.append(name)
+
+        first = asyncio.ensure_future(client.call(BACKGROUND, "sync", blocker))
+        await asyncio.sleep(0)
+        queued = [
+            asyncio.ensure_future(client.call(BACKGROUND, "sync", lambda: record("background"))),
+            asyncio.ensure_future(client.call(INTERACTIVE, "check", lambda: record("interactive"))),
+        ]
+        await asyncio.sleep(0)
+        assert client.queued(BACKGROUND) == 1 and client.queued(INTERACTIVE) == 1
+        gate.set()
+        await asyncio.gather(first, *queued)
+        assert order == ["interactive", "background"]
+        assert client.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_background_calls_leave_the_reserve_to_interactive_ones():
+    async def scenario():
+        client = HelixClient(reserve=10, backoff=0)
+        client.update(reset=str(time.time() + 0.05), remaining="10")
+
+        async def ok():
+            return "ok"
+
+        assert await client.call(INTERACTIVE, "check", ok) == "ok"
+        start = time.monotonic()
+        assert await client.call(BACKGROUND, "sync", ok) == "ok"
+        # Waited for the window to refill
+        assert time.monotonic() - start >= 0.04
+        assert client.remaining == client.limit
+        assert client.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_the_last_point_is_spent_without_waiting_for_the_reset():
+    async def scenario():
+        client = HelixClient(backoff=0)
+        client.update(reset=str(time.time() + 30), remaining="1")
+        gate = asyncio.Event()
+
+        async def request():
+            # What twitchio checks before sending: the point is this call's
+            assert not client.limited
+            await gate.wait()
+            client.update(reset=str(time.time() + 30), remaining="0")
+            return "ok"
+
+        first = asyncio.ensure_future(client.call(INTERACTIVE, "check", request))
+        await asyncio.sleep(0)
+        # No point left for another call until the window resets
+        second = asyncio.ensure_future(client.call(INTERACTIVE, "check", request))
+        await asyncio.sleep(0)
+        assert client.queued(INTERACTIVE) == 1
+        gate.set()
+        assert await asyncio.wait_for(first, 1) == "ok"
+        assert client.queued(INTERACTIVE) == 1
+        second.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_response_headers_update_the_budget():
+    client = HelixClient()
+    client.update(reset=str(int(time.time()) + 30), remaining="0")
+    assert client.limited
+    assert "nerf_helix_ratelimit_remaining 0" in REGISTRY.render()
+    # A window that is over refills
+    client.update(reset=str(time.time() - 1), remaining="5")
+    assert not client.limited
+    assert client.remaining == client.limit
+
+
+def test_transient_failures_are_retried():
+    async def scenario():
+        client = HelixClient(max_retries=2, backoff=0.001)
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise aiohttp.ClientConnectionError("Connection reset by peer")
+            return "ok"
+
+        assert await client.call(INTERACTIVE, "check", flaky) == "ok"
+        assert len(attempts) == 3
+        assert client.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_errors_twitchio_retried_are_not_retried_again():
+    async def scenario():
+        client = HelixClient(max_retries=2, backoff=0.001)
+        attempts = []
+
+        async def server_error():
+            # twitchio retried it already
+            attempts.append(1)
+            raise HTTPException("Failed to reach Twitch API", reason="Bad Gateway", status=502)
+
+        with pytest.raises(HTTPException):
+            await client.call(INTERACTIVE, "check", server_error)
+        assert len(attempts) == 1
+        assert client.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_retryable_errors():
+    assert is_retryable(aiohttp.ServerDisconnectedError())
+    assert is_retryable(asyncio.TimeoutError())
+    assert not is_retryable(HTTPException("x", status=429))
+    assert not is_retryable(HTTPException("x", status=503))
+    assert not is_retryable(HTTPException("x", status=400))
+    assert not is_retryable(ValueError("x"))
+
+
+def test_cancelled_waiter_gives_up_its_turn():
+    async def scenario():
+        client = HelixClient(concurrency=1)
+        gate = asyncio.Event()
+
+        async def blocker():
+            await gate.wait()
+
+        async def ok():
+            return "ok"
+
+        first = asyncio.ensure_future(client.call(INTERACTIVE, "check", blocker))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(client.call(INTERACTIVE, "check", ok))
+        later = asyncio.ensure_future(client.call(INTERACTIVE, "check", ok))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        gate.set()
+        assert await later == "ok"
+        await first
+        assert waiting.cancelled()
+        assert client.in_flight == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,71 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from loadtest import parse_args, run
+
+
+def test_small_load_run(tmp_path):
+    args = parse_args([
+        "--messages", "20",
+        "--rate", "0",
+        "--users", "10",
+        "--max-pending", "50",
+        "--max-per-user", "5",
+        "--db-latency", "0",
+        "--helix-latency", "0",
+        "--shot-cycle", "0.001",
+        "--settle-time", "0",
+        "--slew-rate", "100000",
+        "--obs-log", str(tmp_path / "obs.txt"),
+    ])
+    results = run(args)
+
+    # Every query the bot makes must be known to the fake DB
+    assert results["unknown_queries"] == {}
+    # Commands of the same viewer share one follower lookup
+    assert results["helix_calls"]["get_channel_followers"] <= 10
+    # The schema is up to date, so migrating it is one version check
+    assert results["db_queries"]["select_schema_version"] == 1
+    # Pricing comes from memory: the levels table is read once at startup
+    assert results["db_queries"]["select_levels"] == 1
+    # and so does gun_active, kept current by the config refresher
+    assert results["db_queries"]["select_gun_active"] == 1
+    assert results["outcomes"] == {"fired": 20}
+    assert results["stages"]["total"]["count"] == 20
+    assert results["stages"]["gun"]["p50"] > 0
+    assert results["throughput"]["shots_per_sec"] > 0
+    # one credit per shot at level 0, all written back by the time the bot stops
+    assert results["credits_spent"] == results["throughput"]["shots"]
+    # one shot_history row per fired command, written in the background
+    assert results["history_rows"] == 20
+
+
+@pytest.mark.parametrize("cache_size", ["0", "1000"])
+def test_credits_are_never_overspent(tmp_path, cache_size):
+    # 3 users with 10 credits each send 60 commands that are all in flight at once
+    args = parse_args([
+        "--messages", "60",
+        "--rate", "0",
+        "--users", "3",
+        "--credits", "10",
+        "--max-pending", "100",
+        "--max-per-user", "20",
+        "--db-latency", "0",
+        "--helix-latency", "0",
+        "--shot-cycle", "0.001",
+        "--settle-time", "0",
+        "--slew-rate", "100000",
+        "--credit-cache-size", cache_size,
+        "--obs-log", str(tmp_path / "obs.txt"),
+    ])
+    results = run(args)
+
+    assert results["unknown_queries"] == {}
+    assert results["outcomes"]["fired"] + results["outcomes"]["credits"] == 60
+    assert results["credits_spent"] == results["throughput"]["shots"] == 30
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
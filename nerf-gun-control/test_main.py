@@ -0,0 +1,286 @@
+import os
+import sys
+import asyncio
+import pytest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+import main
+from loadtest import FakeAuthor, FakeChannel, FakeDatabase, FakeMessage, LoadTestBot
+
+
+@pytest.fixture
+def run_bot(monkeypatch):
+    """
+    run_bot(scenario, fake_db=None, **kwargs) runs `await scenario(bot)` on a
+    LoadTestBot over fake_db (levels only, by default), connected to it and
+    stopped afterwards, and returns what scenario returned.
+    """
+    # Whatever .env says, nothing here talks to Twitch
+    for name in ("TWITCH_CHANNEL_NAME", "TWITCH_ACCESS_TOKEN", "TWITCH_CLIENT_ID"):
+        monkeypatch.setattr(main, name, "loadtest")
+    monkeypatch.setattr(main, "METRICS_PORT", 0)
+
+    def run(scenario, fake_db=None, **kwargs):
+        async def body():
+            bot = LoadTestBot(fake_db or FakeDatabase({}, {0: (5, 1)}, 10), **kwargs)
+            await bot.connect_db()
+            try:
+                return await scenario(bot)
+            finally:
+                await bot.stop_services()
+
+        return asyncio.run(body())
+
+    return run
+
+
+def test_chat_commands_are_registered(run_bot):
+    async def scenario(bot):
+        return set(bot.commands)
+
+    assert run_bot(scenario) >= {"fire", "queue", "reloadconfig", "addbonus"}
+
+
+def test_subscription_levels_reload_when_the_table_changes(run_bot):
+    fake_db = FakeDatabase({}, {0: (5, 1), 1: (100, 10)}, 10)
+
+    async def scenario(bot):
+        assert await bot.load_subscription_levels()
+        before = bot.get_credits_per_shot(1), bot.get_initial_credits(7)
+        assert not await bot.refresh_subscription_levels()
+        fake_db.levels[1] = (100, 4)
+        assert await bot.refresh_subscription_levels()
+        return before, bot.get_credits_per_shot(1)
+
+    before, after = run_bot(scenario, fake_db)
+    # unknown levels are priced like level 0
+    assert before == (10, 5)
+    assert after == 4
+    assert fake_db.queries["select_levels"] == 2
+
+
+def test_config_refresh_follows_the_version(run_bot):
+    fake_db = FakeDatabase({"gun_active": 1, "idle_timeout": 300, "config_version": 3}, {0: (5, 1)}, 10)
+
+    async def scenario(bot):
+        bot.config_version = await bot.get_config_version()
+        bot.gun_config = await bot.load_gun_config()
+        first = bot.gun_config
+        assert await bot.get_gun_status()
+        assert not await bot.refresh_config()
+
+        fake_db.set_config("gun_active", 0)
+        fake_db.set_config("idle_timeout", 30)
+        assert await bot.refresh_config()
+        return first, bot.gun_config
+
+    first, reloaded = run_bot(scenario, fake_db)
+    # The snapshot in use is replaced, never modified
+    assert first["gun_active"] is True and first["idle_timeout"] == 300
+    assert reloaded["gun_active"] is False and reloaded["idle_timeout"] == 30
+    with pytest.raises(TypeError):
+        reloaded["idle_timeout"] = 0
+
+
+def test_parse_gun_config_defaults_and_types():
+    config = main.parse_gun_config([
+        ("home_x", "12"),
+        ("gun_active", "0"),
+        ("idle_timeout", "soon"),
+        ("config_version", "7"),
+    ])
+    assert config["home_x"] == 12
+    assert config["gun_active"] is False
+    # invalid and missing values fall back to the defaults
+    assert config["idle_timeout"] == 300
+    assert config["vertical_offset"] == -60
+    assert "config_version" not in config
+
+
+@pytest.mark.parametrize("cache_size", [0, 1000])
+def test_daily_reset_refills_due_subscribers(run_bot, monkeypatch, cache_size):
+    monkeypatch.setattr(main, "CREDIT_CACHE_SIZE", cache_size)
+    fake_db = FakeDatabase({}, {0: (5, 1), 1: (100, 10)}, 10)
+    fake_db.add_subscriber("due", level=1, credits=3, last_reset_date="2024-01-01")
+    fake_db.add_subscriber("done", level=1, credits=3)
+
+    async def scenario(bot):
+        # 2 credits spent and cached but not written yet
+        assert await bot.reserve_credits("due", 1, 2) == (2, 0)
+        first = await bot.reset_daily_credits()
+        second = await bot.reset_daily_credits()
+        due = await bot.fetch_or_create_user_data("due", 1)
+        return first, second, due["current_credits"]
+
+    first, second, cached = run_bot(scenario, fake_db)
+    assert (first, second) == (1, 0)
+    assert cached == 100
+    assert fake_db.subscribers["due"]["current_credits"] == 100
+    assert fake_db.subscribers["done"]["current_credits"] == 3
+
+
+def test_failed_credit_write_back_is_rolled_back(run_bot):
+    fake_db = FakeDatabase({}, {0: (5, 1)}, 10)
+    execute = fake_db.execute
+
+    async def failing_execute(query, args):
+        # The connection drops on the second row
+        if "current_credits + %s" in query and args[2] == "bob":
+            raise ConnectionError("lost connection")
+        return await execute(query, args)
+
+    fake_db.execute = failing_execute
+
+    async def scenario(bot):
+        with pytest.raises(ConnectionError):
+            await bot.write_credit_changes([(-2, 0, "alice"), (-3, 0, "bob")])
+
+    run_bot(scenario, fake_db)
+    assert (fake_db.queries["begin"], fake_db.queries["commit"], fake_db.queries["rollback"]) == (1, 0, 1)
+
+
+def test_bulk_bonus_grant_is_one_batch(run_bot):
+    fake_db = FakeDatabase({}, {0: (5, 1)}, 10)
+    fake_db.add_subscriber("alice")
+    fake_db.subscribers["alice"]["bonus_credits"] = 20
+
+    async def scenario(bot):
+        await bot.load_subscription_levels()
+        return await bot.grant_bonus_credits({"alice": 50, "bob": 50})
+
+    results = run_bot(scenario, fake_db)
+    assert results == [("alice", 50, 70, False), ("bob", 50, 50, True)]
+    assert fake_db.subscribers["alice"]["bonus_credits"] == 70
+    # bob got a level 0 row with the day's credits and the grant
+    assert fake_db.subscribers["bob"]["current_credits"] == 5
+    assert fake_db.subscribers["bob"]["bonus_credits"] == 50
+    assert fake_db.queries["select_bonuses"] == 1
+    assert fake_db.unknown == {}
+
+
+def test_bonus_credits_are_taken_back_from_existing_users_only(run_bot):
+    fake_db = FakeDatabase({}, {0: (5, 1)}, 10)
+    fake_db.add_subscriber("alice")
+    fake_db.subscribers["alice"]["bonus_credits"] = 20
+
+    async def scenario(bot):
+        return await bot.grant_bonus_credits({"alice": -30, "bob": -10})
+
+    assert run_bot(scenario, fake_db) == [("alice", -30, 0, False)]
+    assert fake_db.subscribers["alice"]["bonus_credits"] == 0
+    assert "bob" not in fake_db.subscribers
+
+
+class FakeFollowEvent:
+    """What twitchio passes to event_eventsub_notification_followV2"""
+
+    def __init__(self, broadcaster_id, user_id):
+        user = type("User", (), {"id": int(user_id)})
+        broadcaster = type("User", (), {"id": int(broadcaster_id)})
+        self.data = type("Follow", (), {"user": user, "broadcaster": broadcaster})
+
+
+def test_follower_checks_are_cached(run_bot):
+    async def scenario(bot):
+        # Synced followers never cost a lookup
+        assert await bot.sync_followers("1000") == 2
+        assert await bot.check_follower_status("1", "1000")
+        assert await bot.check_follower_status("2", "1000")
+        assert bot.helix_calls["get_channel_followers"] == 0
+
+        # Non-followers are looked up once, then cached for a short while
+        assert not await bot.check_follower_status("3", "1000")
+        assert not await bot.check_follower_status("3", "1000")
+        assert bot.helix_calls["get_channel_followers"] == 1
+
+        # A follow notification counts at once
+        await bot.event_eventsub_notification_followV2(FakeFollowEvent("1000", "3"))
+        assert await bot.check_follower_status("3", "1000")
+        assert bot.helix_calls["get_channel_followers"] == 1
+
+    run_bot(scenario, followers={"1", "2"})
+
+
+def test_identities_come_from_chat_tags_then_one_batched_lookup(run_bot):
+    async def scenario(bot):
+        bot.remember_chatter(FakeAuthor("Alice", 42))
+        assert await bot.get_user_id("alice") == "42"
+        assert bot.helix_calls["get_users"] == 0
+
+        # Lookups made at the same time share one fetch_users call
+        ids = await asyncio.gather(*(bot.get_user_id(name) for name in ["bob", "carol", "bob", "dave"]))
+        assert ids[0] == ids[2]
+        assert len(set(ids)) == 3
+        assert bot.helix_calls["get_users"] == 1
+        # and are cached afterwards
+        assert await bot.get_user_id("carol") == ids[1]
+        assert bot.helix_calls["get_users"] == 1
+
+    run_bot(scenario)
+
+
+def test_raid_of_subscription_checks_is_one_request(run_bot):
+    async def scenario(bot):
+        bot.broadcaster_id = "1000"
+        authors = [FakeAuthor(f"raider{i}", 200 + i) for i in range(30)]
+        results = await asyncio.gather(*(bot.check_subscription(author) for author in authors + authors[:5]))
+        assert results == [False] * 35
+        assert bot.helix_calls["get_channel_subscriptions"] == 1
+
+    run_bot(scenario)
+
+
+class FakeSubscriptionEvent:
+    """What twitchio passes to the channel.subscribe / channel.subscription.end handlers"""
+
+    def __init__(self, user_id, tier=None):
+        user = type("User", (), {"id": int(user_id)})
+        self.data = type("Subscription", (), {"user": user, "tier": tier})
+
+
+def test_subscription_tiers_are_resolved_once_and_follow_events(run_bot):
+    async def scenario(bot):
+        bot.broadcaster_id = "1000"
+        alice, bob = FakeAuthor("alice", 42), FakeAuthor("bob", 43)
+        assert await bot.resolve_subscription(alice) == (True, 2)
+        assert await bot.resolve_subscription(bob) == (False, 0)
+        assert await bot.get_subscription_level(alice) == 2
+        assert not await bot.check_subscription(bob)
+        assert bot.helix_calls["get_channel_subscriptions"] == 2
+
+        await bot.event_eventsub_notification_subscription(FakeSubscriptionEvent(43, 3000))
+        await bot.event_eventsub_notification_subscription_end(FakeSubscriptionEvent(42))
+        assert await bot.resolve_subscription(bob) == (True, 3)
+        assert await bot.resolve_subscription(alice) == (False, 0)
+        assert bot.helix_calls["get_channel_subscriptions"] == 2
+
+    run_bot(scenario, tiers={"42": 2000})
+
+
+def test_subscriber_only_mode_prices_by_tier(run_bot, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "NEED_SUBSCRIPTION", True)
+    monkeypatch.setattr(main, "CREDIT_CACHE_SIZE", 0)
+    monkeypatch.setattr(main, "OBS_MESSAGE_LOG_FILE", str(tmp_path / "obs.txt"))
+    fake_db = FakeDatabase({"gun_active": 1}, {0: (5, 1), 1: (100, 10), 2: (200, 8)}, 10)
+    fake_db.add_subscriber("alice", level=2, credits=100)
+    requests = []
+
+    async def scenario(bot):
+        bot.gun_config = main.parse_gun_config([])
+        await bot.load_subscription_levels()
+        channel = FakeChannel("loadtest")
+        bot.fire_scheduler.submit = lambda request: requests.append(request) or True
+        # The offsets put 90, 60 inside the default bounds
+        for author in (FakeAuthor("alice", 42), FakeAuthor("bob", 43)):
+            await bot.do_fire_command(author, FakeMessage("!fire 90 60 2", author, channel), channel, 90, 60, 2)
+        return channel.sent
+
+    sent = run_bot(scenario, fake_db, tiers={"42": 2000})
+    assert [request.username for request in requests] == ["alice"]
+    assert requests[0].subscription_level == 2
+    assert requests[0].credits_per_shot == 8
+    assert any("bob is not a subscriber" in message for message in sent)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
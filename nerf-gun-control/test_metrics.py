@@ -0,0 +1,93 @@
+import os
+import sys
+import asyncio
+import aiohttp
+import pytest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from metrics import Registry, start_metrics_server
+
+
+def test_counter_and_gauge():
+    registry = Registry()
+    fired = registry.counter("shots_total", "Shots", ["user"])
+    fired.labels("a").inc()
+    fired.labels(user="a").inc(2)
+    fired.labels("b").inc()
+    depth = registry.gauge("depth", "Queue depth")
+    depth.set(4)
+    depth.dec()
+
+    text = registry.render()
+    assert "# TYPE shots_total counter" in text
+    assert 'shots_total{user="a"} 3' in text
+    assert 'shots_total{user="b"} 1' in text
+    assert "depth 3" in text
+
+
+def test_same_name_returns_the_same_metric():
+    registry = Registry()
+    assert registry.counter("c", "help") is registry.counter("c", "help")
+    with pytest.raises(ValueError):
+        registry.gauge("c", "help")
+
+
+def test_gauge_function():
+    registry = Registry()
+    queue = [1, 2]
+    registry.gauge("depth", "Queue depth").set_function(lambda: len(queue))
+    queue.append(3)
+    assert "depth 3" in registry.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency", ["endpoint"], buckets=[0.1, 1])
+    for value in [0.05, 0.5, 0.5, 3]:
+        latency.labels("nerf").observe(value)
+
+    text = registry.render()
+    assert 'latency_seconds_bucket{endpoint="nerf",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{endpoint="nerf",le="1"} 3' in text
+    assert 'latency_seconds_bucket{endpoint="nerf",le="+Inf"} 4' in text
+    assert 'latency_seconds_sum{endpoint="nerf"} 4.05' in text
+    assert 'latency_seconds_count{endpoint="nerf"} 4' in text
+
+
+def test_timer_decorates_coroutines():
+    registry = Registry()
+    latency = registry.histogram("call_seconds", "Calls")
+
+    @latency.time()
+    async def call():
+        await asyncio.sleep(0.01)
+        return 42
+
+    assert asyncio.run(call()) == 42
+    with latency.time():
+        pass
+    assert "call_seconds_count 2" in registry.render()
+
+
+def test_metrics_endpoint():
+    registry = Registry()
+    registry.counter("hits_total", "Hits").inc()
+
+    async def body():
+        runner = await start_metrics_server("127.0.0.1", 0, registry)
+        port = runner.addresses[0][1]
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                    return response.status, response.headers["Content-Type"], await response.text()
+        finally:
+            await runner.cleanup()
+
+    status, content_type, text = asyncio.run(body())
+    assert status == 200
+    assert content_type.startswith("text/plain")
+    assert "hits_total 1" in text
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,149 @@
+import os
+import sys
+import asyncio
+import pytest
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+import migrations
+from migrations import LATEST, MIGRATIONS, migrate, migrate_sync
+
+
+class FakeSchema:
+    """Answers the migration runner's queries and records what it executed"""
+
+    def __init__(self, version=None, existing=(), fail_on=None):
+        # None: no schema_version table yet
+        self.version = version
+        # Substrings of `unless` queries that find something already there
+        self.existing = existing
+        self.fail_on = fail_on
+        self.executed = []
+        self.locked = False
+
+    def execute(self, query, params):
+        self.executed.append(query)
+        if self.fail_on and self.fail_on in query:
+            raise RuntimeError("boom")
+        if query == migrations.SELECT_VERSION:
+            if self.version is None:
+                raise RuntimeError("Table 'schema_version' doesn't exist")
+            return [(self.version or None,)]
+        if query == migrations.CREATE_VERSION_TABLE:
+            self.version = self.version or 0
+        elif query.startswith("SELECT GET_LOCK"):
+            self.locked = True
+            return [(1,)]
+        elif query.startswith("SELECT RELEASE_LOCK"):
+            self.locked = False
+            return [(1,)]
+        elif query == migrations.INSERT_VERSION:
+            self.version = max(self.version, params[0])
+        elif query.startswith("SELECT COUNT(*)"):
+            return [(int(any(name in query for name in self.existing)),)]
+        return None
+
+    def applied(self):
+        return [step.sql for m in MIGRATIONS for step in m.steps if step.sql in self.executed]
+
+
+class SyncCursor:
+    def __init__(self, schema):
+        self.schema = schema
+        self.rows = None
+        self.description = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.rows = self.schema.execute(query, params)
+        self.description = [("column",)] if self.rows is not None else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class SyncConnection:
+    def __init__(self, schema):
+        self.schema = schema
+
+    def cursor(self):
+        return SyncCursor(self.schema)
+
+
+class AsyncCursor(SyncCursor):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, query, params=None):
+        SyncCursor.execute(self, query, params)
+
+    async def fetchall(self):
+        return self.rows
+
+
+class AsyncPool:
+    def __init__(self, schema):
+        self.schema = schema
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return AsyncCursor(self.schema)
+
+
+def test_versions_are_unique_and_ordered():
+    versions = [m.version for m in MIGRATIONS]
+    assert versions == sorted(set(versions))
+    assert LATEST == versions[-1]
+
+
+def test_fresh_database_gets_every_migration_once():
+    schema = FakeSchema()
+    assert migrate_sync(SyncConnection(schema), log=lambda message: None) == LATEST
+    assert schema.version == LATEST
+    assert not schema.locked
+    assert schema.applied() == [step.sql for m in MIGRATIONS for step in m.steps]
+
+    # Next start: a single version check
+    schema.executed.clear()
+    assert migrate_sync(SyncConnection(schema)) == LATEST
+    assert schema.executed == [migrations.SELECT_VERSION]
+
+
+def test_existing_columns_and_keys_are_adopted():
+    schema = FakeSchema(existing=("'bonus_credits'", "'user_id'"))
+    migrate_sync(SyncConnection(schema), log=lambda message: None)
+    applied = schema.applied()
+    assert not any("bonus_credits INT" in sql for sql in applied)
+    assert not any("uq_subscribers_user_id" in sql for sql in applied)
+    assert any("uq_system_config_key" in sql for sql in applied)
+
+
+def test_only_newer_migrations_run():
+    schema = FakeSchema(version=LATEST - 1)
+    asyncio.run(migrate(AsyncPool(schema), log=lambda message: None))
+    assert schema.applied() == [step.sql for step in MIGRATIONS[-1].steps]
+    assert schema.version == LATEST
+
+
+def test_failed_migration_is_not_recorded_and_releases_the_lock():
+    schema = FakeSchema(fail_on="ALTER TABLE system_config")
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(migrate(AsyncPool(schema), log=lambda message: None))
+    # Migration 1 stays done, 2 runs again next time
+    assert schema.version == 1
+    assert not schema.locked
@@ -1,10 +1,12 @@
 import os
 import sys
 import pytest
+import time
+import requests
 from unittest.mock import patch, Mock
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
-from nerf_controller import NerfController
+from nerf_controller import NerfController, CircuitBreaker
 
 @pytest.fixture
 def nerf_controller():
@@ -23,7 +25,7 @@ def test_fire_success(mock_get, mock_wait, nerf_controller):
 
     assert success is True
     assert data == {"status": "idle", "shots": 3}
-    mock_get.assert_called_once_with("http://test-server.com/nerf", params={'x': 10, 'y': 20, 'shot': 3})
+    mock_get.assert_called_once_with("http://test-server.com/nerf", params={'x': 10, 'y': 20, 'shot': 3}, timeout=5)
     mock_wait.assert_called_once_with(shots=3)
 
 @patch('nerf_controller.requests.get')
@@ -43,7 +45,7 @@ def test_stop_success(mock_get, nerf_controller):
 
     result = nerf_controller.stop()
     assert result == "Nerf stopped"
-    mock_get.assert_called_once_with("http://test-server.com/stop")
+    mock_get.assert_called_once_with("http://test-server.com/stop", timeout=2)
 
 @patch('nerf_controller.requests.get')
 def test_get_status_success(mock_get, nerf_controller):
@@ -54,7 +56,20 @@ def test_get_status_success(mock_get, nerf_controller):
 
     result = nerf_controller.get_status()
     assert result == {"status": "idle"}
-    mock_get.assert_called_once_with("http://test-server.com/status")
+    mock_get.assert_called_once_with("http://test-server.com/status", timeout=2)
+
+@patch('nerf_controller.requests.get')
+def test_get_status_long_poll(mock_get, nerf_controller):
+    mock_response = Mock()
+    mock_response.json.return_value = {"status": "idle"}
+    mock_response.raise_for_status.return_value = None
+    mock_get.return_value = mock_response
+
+    result = nerf_controller.get_status(wait_for="idle", timeout=10)
+    assert result == {"status": "idle"}
+    mock_get.assert_called_once_with(
+        "http://test-server.com/status", params={"wait_for": "idle", "timeout": 10}, timeout=15
+    )
 
 @patch('nerf_controller.requests.get')
 def test_get_status_error(mock_get, nerf_controller):
@@ -76,6 +91,17 @@ def test_wait_until_idle_success(mock_get_status, nerf_controller):
     assert status["status"] == "idle"
     assert mock_get_status.call_count == 3
 
+@patch('nerf_controller.NerfController.get_status')
+def test_wait_until_idle_uses_long_poll(mock_get_status, nerf_controller):
+    mock_get_status.return_value = {"status": "idle"}
+
+    success, status = nerf_controller.wait_until_idle(timeout=5, shots=2)
+    assert success is True
+    assert status == {"status": "idle", "shots": 2}
+    mock_get_status.assert_called_once()
+    assert mock_get_status.call_args.kwargs["wait_for"] == "idle"
+    assert mock_get_status.call_args.kwargs["timeout"] <= 5
+
 @patch('nerf_controller.NerfController.get_status')
 def test_wait_until_idle_timeout(mock_get_status, nerf_controller):
     mock_get_status.return_value = {"status": "busy"}
@@ -85,6 +111,84 @@ def test_wait_until_idle_timeout(mock_get_status, nerf_controller):
     assert status["status"] == "busy"
     assert mock_get_status.call_count > 1
 
+def test_circuit_breaker_transitions():
+    changes = []
+    breaker = CircuitBreaker(failure_threshold=2, on_state_change=changes.append)
+    assert breaker.allow_request()
+
+    assert breaker.record_failure() is False
+    breaker.record_success()
+    assert breaker.record_failure() is False
+    assert breaker.record_failure() is True
+    assert not breaker.allow_request()
+
+    breaker.half_open()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()
+    assert breaker.record_failure() is True
+
+    breaker.half_open()
+    breaker.record_success()
+    assert breaker.allow_request()
+    assert changes == ["open", "half-open", "open", "half-open", "closed"]
+
+@patch('nerf_controller.requests.get')
+def test_open_breaker_fails_fast(mock_get):
+    controller = NerfController("http://test-server.com", failure_threshold=3, reset_timeout=60)
+    mock_get.side_effect = requests.ConnectionError("Connection refused")
+
+    for _ in range(3):
+        success, _ = controller.fire(x=1, y=2, shot=1)
+        assert success is False
+    assert not controller.available
+
+    mock_get.reset_mock()
+    success, data = controller.fire(x=1, y=2, shot=1)
+    assert success is False
+    assert data["message"] == "gun unavailable (circuit open)"
+    assert controller.get_status()["status"] == "error"
+    # Answered without a request to the gun
+    mock_get.assert_not_called()
+
+@patch('nerf_controller.requests.get')
+def test_ko_status_opens_breaker(mock_get):
+    controller = NerfController("http://test-server.com", failure_threshold=2, reset_timeout=60)
+    mock_response = Mock()
+    mock_response.json.return_value = {"status": "ko"}
+    mock_response.raise_for_status.return_value = None
+    mock_get.return_value = mock_response
+
+    controller.get_status()
+    controller.get_status()
+    assert not controller.available
+
+@patch('nerf_controller.requests.get')
+def test_busy_gun_does_not_open_breaker(mock_get):
+    controller = NerfController("http://test-server.com", failure_threshold=1)
+    busy = requests.HTTPError("429 Too Many Requests", response=Mock(status_code=429))
+    mock_get.return_value.raise_for_status.side_effect = busy
+
+    success, _ = controller.fire(x=1, y=2, shot=1)
+    assert success is False
+    assert controller.available
+
+@patch('nerf_controller.requests.get')
+def test_probe_closes_breaker_when_gun_recovers(mock_get):
+    controller = NerfController("http://test-server.com", failure_threshold=1, reset_timeout=0.01)
+    idle = Mock()
+    idle.json.return_value = {"status": "idle"}
+    idle.raise_for_status.return_value = None
+    mock_get.side_effect = [requests.ConnectionError("down"), requests.ConnectionError("down"), idle]
+
+    controller.get_status()
+    assert not controller.available
+
+    deadline = time.time() + 2
+    while not controller.available and time.time() < deadline:
+        time.sleep(0.01)
+    assert controller.available
+    assert mock_get.call_count == 3
+
 if __name__ == "__main__":
     pytest.main([__file__])
     
\ No newline at end of file
@@ -0,0 +1,91 @@
+import os
+import sys
+import asyncio
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from shot_history import COLUMNS, HISTORY_ROWS, ShotHistory
+
+
+class Writer:
+    def __init__(self, fail=0):
+        self.batches = []
+        self.fail = fail
+
+    async def __call__(self, rows):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("database is down")
+        self.batches.append(rows)
+
+
+def test_rows_follow_the_column_order():
+    async def scenario():
+        writer = Writer()
+        history = ShotHistory(writer)
+        history.record(user_id="alice", x=1, y=2, shots_fired=3)
+        await history.flush()
+        row = writer.batches[0][0]
+        assert len(row) == len(COLUMNS)
+        assert row[COLUMNS.index("user_id")] == "alice"
+        assert row[COLUMNS.index("shots_fired")] == 3
+        assert row[COLUMNS.index("channel")] is None
+
+    asyncio.run(scenario())
+
+
+def test_writes_in_batches():
+    async def scenario():
+        writer = Writer()
+        history = ShotHistory(writer, batch_size=2)
+        for i in range(5):
+            history.record(user_id=f"user{i}")
+        assert await history.flush() == 5
+        assert [len(batch) for batch in writer.batches] == [2, 2, 1]
+        assert history.pending == 0
+
+    asyncio.run(scenario())
+
+
+def test_drops_rows_when_full_without_waiting():
+    async def scenario():
+        history = ShotHistory(Writer(), max_pending=2)
+        dropped = HISTORY_ROWS.labels("dropped").value
+        assert history.record(user_id="a")
+        assert history.record(user_id="b")
+        assert not history.record(user_id="c")
+        assert history.pending == 2
+        assert HISTORY_ROWS.labels("dropped").value == dropped + 1
+
+    asyncio.run(scenario())
+
+
+def test_failed_batch_is_retried_first():
+    async def scenario():
+        writer = Writer(fail=1)
+        history = ShotHistory(writer, batch_size=10)
+        history.record(user_id="a")
+        history.record(user_id="b")
+        assert await history.flush() == 0
+        assert history.pending == 2
+        history.record(user_id="c")
+        assert await history.flush() == 3
+        users = [row[COLUMNS.index("user_id")] for row in writer.batches[0]]
+        assert users == ["a", "b", "c"]
+
+    asyncio.run(scenario())
+
+
+def test_background_task_flushes_a_full_batch_and_stop_writes_the_rest():
+    async def scenario():
+        writer = Writer()
+        history = ShotHistory(writer, batch_size=2, flush_interval=60)
+        history.start()
+        history.record(user_id="a")
+        history.record(user_id="b")
+        await asyncio.sleep(0.01)
+        assert len(writer.batches) == 1
+        history.record(user_id="c")
+        await history.stop()
+        assert sum(len(batch) for batch in writer.batches) == 3
+
+    asyncio.run(scenario())
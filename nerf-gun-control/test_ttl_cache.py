@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from ttl_cache import MISSING, TTLCache
+
+
+def test_values_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = TTLCache(10, ttl=60, negative_ttl=5)
+    cache.set("follower", True)
+    cache.set("stranger", False)
+    assert cache.get("follower") is True
+    assert cache.get("stranger") is False
+
+    now[0] += 10
+    # Negative answers go first
+    assert cache.get("stranger") is MISSING
+    assert cache.get("follower") is True
+    now[0] += 60
+    assert cache.get("follower") is MISSING
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entries_are_dropped():
+    cache = TTLCache(2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+
+
+def test_zero_ttl_or_size_caches_nothing():
+    cache = TTLCache(10, ttl=60, negative_ttl=0)
+    cache.set("stranger", False)
+    assert cache.get("stranger") is MISSING
+    disabled = TTLCache(0, ttl=60)
+    disabled.set("a", 1)
+    assert len(disabled) == 0
+
+
+def test_invalidate():
+    cache = TTLCache(10, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.invalidate("a")
+    assert "a" not in cache and "b" in cache
+    cache.invalidate()
+    assert len(cache) == 0
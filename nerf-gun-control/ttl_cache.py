@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY
+
+CACHE_LOOKUPS = REGISTRY.counter("nerf_cache_lookups_total", "Lookups in the in-memory caches", ["cache", "result"])
+CACHE_ENTRIES = REGISTRY.gauge("nerf_cache_entries", "Entries in the in-memory caches", ["cache"])
+
+# What get() returns for a key that is not cached (None or False can be cached values)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded key -> value cache for answers from Twitch.
+
+    Entries expire ttl seconds after they were set. Falsy values ("does not
+    follow") expire after negative_ttl instead, which is usually much shorter,
+    so a change shows up quickly. At most max_entries are kept, and the least
+    recently used ones are dropped first. Lookups are counted by name in
+    nerf_cache_lookups_total.
+    """
+
+    def __init__(self, max_entries, ttl, negative_ttl=None, name="cache"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.name = name
+        # key -> (value, expires_at)
+        self._entries = OrderedDict()
+        CACHE_ENTRIES.set_function(lambda: len(self._entries), name)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not MISSING
+
+    def get(self, key, count=True):
+        """The cached value, or MISSING if there is none or it expired"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                if count:
+                    CACHE_LOOKUPS.labels(self.name, "hit").inc()
+                return entry[0]
+            del self._entries[key]
+        if count:
+            CACHE_LOOKUPS.labels(self.name, "miss").inc()
+        return MISSING
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl if value else self.negative_ttl
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop one entry, or all of them"""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
@@ -1,40 +1,206 @@
 import sys
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import json
 from urllib.parse import urlparse, parse_qs
+import math
 import time
 import threading
 import random
 import argparse
 
-# Simuler l'état du Nerf gun
-nerf_status = "idle"
-last_check_time = time.time()
+# Upper bound for a single long-poll, in seconds
+MAX_WAIT = 30.0
+
+
+class GunModel:
+    """
+    Simulated state and timing of the Nerf gun.
+
+    A volley takes the time to slew to the target (both servos move at the same
+    time, so the larger of the two angles divided by slew_rate), plus settle_time,
+    plus shot_cycle per shot. With ko_rate > 0, a volley can jam the gun part way
+    through: it reports "ko" with the shots fired so far and recovers by itself
+    after ko_duration seconds (0: stays ko until /stop).
+
+    All random draws come from one seeded generator, so runs with the same --seed
+    and the same sequence of requests behave the same.
+    """
+
+    def __init__(
+        self,
+        slew_rate=120.0,
+        settle_time=0.1,
+        shot_cycle=0.5,
+        ko_rate=0.0,
+        ko_duration=10.0,
+        seed=None,
+    ):
+        self.slew_rate = slew_rate
+        self.settle_time = settle_time
+        self.shot_cycle = shot_cycle
+        self.ko_rate = ko_rate
+        self.ko_duration = ko_duration
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+        self.status = "idle"
+        self.last_shots = 0
+        self.position = (0.0, 0.0)
+        # Wakes up /status?wait_for=... long-polls on every state change
+        self.changed = threading.Condition()
+        # Bumped by every volley and /stop so a cancelled volley does not touch the state
+        self.generation = 0
+        self.stats = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"volleys": 0, "shots": 0, "travel": 0.0, "busy_time": 0.0, "ko": 0}
+
+    def random(self):
+        with self.rng_lock:
+            return self.rng.random()
+
+    def uniform(self, a, b):
+        with self.rng_lock:
+            return self.rng.uniform(a, b)
+
+    def set_status(self, status, generation=None):
+        with self.changed:
+            if generation is not None and generation != self.generation:
+                return False
+            self.status = status
+            self.changed.notify_all()
+            return True
+
+    def wait_for(self, state, timeout):
+        with self.changed:
+            self.changed.wait_for(lambda: self.status in (state, "ko"), timeout)
+            return self.snapshot()
+
+    def snapshot(self):
+        status = {"status": self.status}
+        if self.status == "ko":
+            status["shots"] = self.last_shots
+        return status
+
+    def start_volley(self, x, y, shots):
+        """Returns None if the volley started, or the HTTP error to answer with"""
+        with self.changed:
+            if self.status == "ko":
+                return 503, "Service Unavailable"
+            if self.status == "busy":
+                return 429, "Too Many Requests"
+            self.generation += 1
+            generation = self.generation
+            self.status = "busy"
+            self.changed.notify_all()
+
+            old_x, old_y = self.position
+            self.position = (x, y)
+            move_time = max(abs(x - old_x), abs(y - old_y)) / self.slew_rate
+            self.stats["travel"] += math.hypot(x - old_x, y - old_y)
+            self.stats["volleys"] += 1
+
+        jam_after = self.draw_jam(shots)
+        threading.Thread(
+            target=self._run_volley,
+            args=(generation, move_time, shots, jam_after),
+            daemon=True,
+        ).start()
+        return None
+
+    def draw_jam(self, shots):
+        """Decided up front: the shots a volley fires before it jams, or None if it does not"""
+        if shots > 0 and self.random() < self.ko_rate:
+            return int(self.uniform(0, shots))
+        return None
+
+    def _run_volley(self, generation, move_time, shots, jam_after):
+        start = time.monotonic()
+        time.sleep(move_time + (self.settle_time if shots > 0 else 0))
+
+        fired = 0
+        for _ in range(shots):
+            if jam_after is not None and fired == jam_after:
+                break
+            time.sleep(self.shot_cycle)
+            fired += 1
+
+        with self.changed:
+            if generation != self.generation:
+                return
+            self.stats["shots"] += fired
+            self.stats["busy_time"] += time.monotonic() - start
+            self.last_shots = fired
+            if jam_after is not None:
+                self.stats["ko"] += 1
+                self.status = "ko"
+            else:
+                self.status = "idle"
+            self.changed.notify_all()
+
+        if jam_after is not None and self.ko_duration > 0:
+            time.sleep(self.ko_duration)
+            self.set_status("idle", generation)
+
+    def stop(self):
+        with self.changed:
+            self.generation += 1
+            self.status = "idle"
+            self.changed.notify_all()
 
-def check_ko_state():
-    global nerf_status, last_check_time
-    current_time = time.time()
-    if current_time - last_check_time >= 600:  # 10 minutes
-        if random.random() < 0.05:  # 5% chance
-            nerf_status = "ko"
-        last_check_time = current_time
 
 class NerfHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the controllers expect from the real gun
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in two writes: without this, Nagle's algorithm holds
+    # the body back until the client's delayed ACK, adding ~40 ms to every answer
+    disable_nagle_algorithm = True
+    # Set by make_server()
+    gun = None
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    drop_rate = 0.0
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def inject_network_faults(self):
+        """Delay the request and maybe fail it. Returns False if the request was dropped or failed."""
+        delay = self.latency + (self.gun.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+        if self.drop_rate and self.gun.random() < self.drop_rate:
+            # Close without answering, like a gun that fell off the network
+            self.close_connection = True
+            return False
+        if self.error_rate and self.gun.random() < self.error_rate:
+            self.send_error(500, "Injected failure")
+            return False
+        return True
+
     def do_GET(self):
-        check_ko_state()
         parsed_path = urlparse(self.path)
-        
+        # /stats is for the benchmark, not the bot: keep it out of the fault injection
+        if parsed_path.path != "/stats" and not self.inject_network_faults():
+            return
+
         if parsed_path.path == "/nerf":
             self.handle_nerf(parse_qs(parsed_path.query))
         elif parsed_path.path == "/stop":
             self.handle_stop()
         elif parsed_path.path == "/status":
-            self.handle_status()
+            self.handle_status(parse_qs(parsed_path.query))
+        elif parsed_path.path == "/stats":
+            self.handle_stats(parse_qs(parsed_path.query))
         else:
             self.send_error(404, "Not Found")
 
     def do_POST(self):
-        check_ko_state()
+        if not self.inject_network_faults():
+            return
         content_length = int(self.headers['Content-Length'])
         post_data = self.rfile.read(content_length)
         parsed_data = parse_qs(post_data.decode('utf-8'))
@@ -44,61 +210,113 @@ class NerfHandler(BaseHTTPRequestHandler):
         else:
             self.send_error(404, "Not Found")
 
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, body):
+        self.send_body(json.dumps(body).encode(), 'application/json')
+
     def handle_nerf(self, params):
-        global nerf_status
-        if nerf_status == "ko":
-            self.send_error(503, "Service Unavailable")
+        try:
+            x = float(params.get('x', [0])[0])
+            y = float(params.get('y', [0])[0])
+            shot = int(params.get('shot', [1])[0])
+        except ValueError:
+            self.send_error(400, "Bad Request")
             return
-        elif nerf_status == "busy":
-            self.send_error(429, "Too Many Requests")
+
+        error = self.gun.start_volley(x, y, shot)
+        if error:
+            self.send_error(*error)
             return
-        
-        nerf_status = "busy"
-        
-        x = params.get('x', [0])[0]
-        y = params.get('y', [0])[0]
-        shot = int(params.get('shot', [1])[0])
-        
-        response = f"Nerf activated: x={x}, y={y}, shot={shot}"
-        self.send_response(200)
-        self.send_header('Content-type', 'text/plain')
-        self.end_headers()
-        self.wfile.write(response.encode())
-        
-        # Simulate the time taken for shots
-        threading.Thread(target=self.simulate_shots, args=(shot,)).start()
 
-    def simulate_shots(self, shots):
-        global nerf_status
-        time.sleep(0.5 * shots)
-        nerf_status = "idle"
+        # Same shape as the real gun: the controller reads the count after "shots:"
+        self.send_json({"status": "busy", "message": f"Nerf activated: x={x:g}, y={y:g}, shots:{shot}"})
 
     def handle_stop(self):
-        global nerf_status
-        nerf_status = "idle"
-        
-        self.send_response(200)
-        self.send_header('Content-type', 'text/plain')
-        self.end_headers()
-        self.wfile.write("Nerf stopped".encode())
+        self.gun.stop()
+        self.send_body("Nerf stopped".encode(), 'text/plain')
 
-    def handle_status(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        status_json = json.dumps({"status": nerf_status})
-        self.wfile.write(status_json.encode())
+    def handle_status(self, params):
+        # Long-poll: /status?wait_for=idle&timeout=10 only answers once the gun
+        # reaches the requested state (or goes "ko"), or when the timeout expires.
+        wait_for = params.get('wait_for', [None])[0]
+        if wait_for:
+            timeout = min(float(params.get('timeout', [MAX_WAIT])[0]), MAX_WAIT)
+            self.send_json(self.gun.wait_for(wait_for, timeout))
+        else:
+            with self.gun.changed:
+                status = self.gun.snapshot()
+            self.send_json(status)
+
+    def handle_stats(self, params):
+        # /stats?reset=1 returns the counters and starts a new measurement
+        with self.gun.changed:
+            body = dict(self.gun.stats, position=self.gun.position, status=self.gun.status)
+            if params.get('reset', ['0'])[0] == '1':
+                self.gun.reset_stats()
+        self.send_json(body)
+
+
+def make_server(port, gun, latency=0.0, jitter=0.0, error_rate=0.0, drop_rate=0.0, quiet=False):
+    handler = type(
+        "ConfiguredNerfHandler",
+        (NerfHandler,),
+        {
+            "gun": gun,
+            "latency": latency,
+            "jitter": jitter,
+            "error_rate": error_rate,
+            "drop_rate": drop_rate,
+        },
+    )
+    httpd = ThreadingHTTPServer(('', port), handler)
+    httpd.daemon_threads = True
+    httpd.quiet = quiet
+    return httpd
 
-def run(port):
-    server_address = ('', port)
-    httpd = HTTPServer(server_address, NerfHandler)
+def run(port, gun, **kwargs):
+    httpd = make_server(port, gun, **kwargs)
     print(f"Starting Nerf server on port {port}")
     httpd.serve_forever()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Nerf Gun Control Server")
     parser.add_argument('-p', '--port', type=int, default=5555, help="Port to run the server on (default: 5555)")
+    parser.add_argument('--seed', type=int, default=None, help="Seed for every random draw, for reproducible runs")
+    parser.add_argument('--slew-rate', type=float, default=120.0, help="Servo speed in degrees per second (default: 120)")
+    parser.add_argument('--settle-time', type=float, default=0.1, help="Pause after a move before the first shot, in seconds (default: 0.1)")
+    parser.add_argument('--shot-cycle', type=float, default=0.5, help="Time per shot, in seconds (default: 0.5)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Network latency added to every request, in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random +/- variation of the latency, in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Probability that a request fails with HTTP 500")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="Probability that a request is dropped without an answer")
+    parser.add_argument('--ko-rate', type=float, default=0.0, help="Probability that a volley jams the gun")
+    parser.add_argument('--ko-duration', type=float, default=10.0, help="Seconds a jammed gun stays ko, 0 for until /stop (default: 10)")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Do not log every request")
     args = parser.parse_args()
 
-    run(args.port)
-    
\ No newline at end of file
+    gun = GunModel(
+        slew_rate=args.slew_rate,
+        settle_time=args.settle_time,
+        shot_cycle=args.shot_cycle,
+        ko_rate=args.ko_rate,
+        ko_duration=args.ko_duration,
+        seed=args.seed,
+    )
+    try:
+        run(
+            args.port,
+            gun,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            drop_rate=args.drop_rate,
+            quiet=args.quiet,
+        )
+    except KeyboardInterrupt:
+        sys.exit(0)
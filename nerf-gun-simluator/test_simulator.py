@@ -0,0 +1,44 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from simulator import GunModel
+
+
+def run_volley(gun, x, y, shots):
+    assert gun.start_volley(x, y, shots) is None
+    # Wait for the volley to end: idle, or ko when it jammed
+    with gun.changed:
+        gun.changed.wait_for(lambda: gun.status != "busy", 5)
+    return gun.snapshot()
+
+
+def test_volley_time_is_slew_settle_and_shot_cycles():
+    gun = GunModel(slew_rate=1000, settle_time=0.02, shot_cycle=0.01, seed=1)
+    assert run_volley(gun, 90, 30, 3) == {"status": "idle"}
+    # The larger angle sets the slew: 90 / 1000 + 0.02 + 3 * 0.01
+    assert 0.14 <= gun.stats["busy_time"] < 0.25
+    assert gun.stats["shots"] == 3
+    assert gun.position == (90, 30)
+
+
+def test_jams_are_reproducible_with_a_seed():
+    def jams(seed):
+        gun = GunModel(ko_rate=0.5, seed=seed)
+        return [gun.draw_jam(10) for _ in range(20)]
+
+    assert jams(7) == jams(7)
+    assert jams(7) != jams(8)
+    drawn = [jam for jam in jams(7) if jam is not None]
+    assert drawn and all(0 <= jam < 10 for jam in drawn)
+
+
+def test_jammed_volley_reports_the_shots_fired():
+    gun = GunModel(slew_rate=100000, settle_time=0, shot_cycle=0.001, ko_rate=1.0, ko_duration=0, seed=3)
+    expected = GunModel(ko_rate=1.0, seed=3).draw_jam(5)
+    assert run_volley(gun, 0, 0, 5) == {"status": "ko", "shots": expected}
+    assert gun.stats["ko"] == 1
+    # Stays ko until /stop
+    assert gun.start_volley(0, 0, 1) == (503, "Service Unavailable")
+    gun.stop()
+    assert gun.snapshot() == {"status": "idle"}
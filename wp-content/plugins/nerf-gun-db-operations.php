@@ -22,7 +22,8 @@ function create_nerf_gun_config_table() {
             'max_horizontal_angle' => '45',
             'min_vertical_angle' => '0',
             'max_vertical_angle' => '60',
-            'gun_active' => '0'  // Default to inactive
+            'gun_active' => '0',  // Default to inactive
+            'config_version' => '0'
         );
         foreach ($default_values as $key => $value) {
             $wpdb->insert(
@@ -34,6 +35,17 @@ function create_nerf_gun_config_table() {
     }
 }
 
+// The bot reloads system_config and subscription_levels when config_version changes
+function bump_nerf_config_version() {
+    global $wpdb;
+    $table_name = $wpdb->prefix . 'system_config';
+
+    return $wpdb->query("
+        INSERT INTO $table_name (config_key, config_value) VALUES ('config_version', '1')
+        ON DUPLICATE KEY UPDATE config_value = CAST(config_value AS UNSIGNED) + 1
+    ");
+}
+
 function get_nerf_gun_config() {
     global $wpdb;
     $table_name = $wpdb->prefix . 'system_config';
@@ -72,6 +84,7 @@ function update_nerf_gun_config($config) {
                 WHERE config_key = %s
             ", $values[$i], $keys[$i]));
         }
+        bump_nerf_config_version();
 
         // If no exception is thrown, commit the transaction
         $wpdb->query('COMMIT');
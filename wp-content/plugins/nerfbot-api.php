@@ -156,6 +156,7 @@ function update_subscription_levels($request) {
     }
     
     if ($success) {
+        bump_nerf_config_version();
         $wpdb->query('COMMIT');
         return new WP_REST_Response($levels, 200);
     } else {